@@ -1,16 +1,18 @@
 import streamlit as st
-import pandas as pd
-import os
 import json
 import time
 import copy
 import altair as alt
-import streamlit.components.v1 as components
 import zipfile
 import io
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import os
 from datetime import datetime
+from storage import get_backend
+from core import (DEFAULT_ITEMS, get_date_info, load_startup, save_settings_to_cloud, save_prices_to_cloud,
+                  load_data, save_dataframe, overwrite_conflicts, search_project, list_months, load_cube, append_data, update_category_config,
+                  add_new_category_block, delete_category_block, create_zip_backup, export_daily_reports, restore_records, item_table, save_item_table, previous_working_day, day_entry_frame, append_day)
+from reports import section_frames, search_groups, dashboard_summary, conflict_table
+from profiling import PROFILE_ALL, start_rerun, finish_rerun, span, summary_frame
 
 # ==========================================
 # 0. 系統設定
@@ -19,39 +21,7 @@ st.set_page_config(page_title="專案施工管理系統 PRO Max (線上版)", la
 
 # --- 🔐 安全設定 ---
 SYSTEM_PASSWORD = "225088" 
-
-# --- 檔案路徑 ---
-KEY_FILE = 'service_key.json'      # Google API 金鑰
-SHEET_NAME = 'construction_db'     # Google 試算表名稱
-
-# --- 台灣例假日 ---
-HOLIDAYS = {
-    "2025-01-01": "元旦", "2025-01-27": "小年夜", "2025-01-28": "除夕", "2025-01-29": "春節", "2025-01-30": "初二", "2025-01-31": "初三",
-    "2025-02-28": "和平紀念日", "2025-04-04": "兒童節/清明節", "2025-05-01": "勞動節", "2025-05-31": "端午節",
-    "2025-10-06": "中秋節", "2025-10-10": "國慶日",
-    "2026-01-01": "元旦", "2026-02-16": "小年夜", "2026-02-17": "除夕", "2026-02-18": "春節",
-    "2026-02-28": "和平紀念日", "2026-04-04": "兒童節", "2026-04-05": "清明節", "2026-05-01": "勞動節",
-    "2026-06-19": "端午節", "2026-09-25": "中秋節", "2026-10-10": "國慶日"
-}
-
-# --- 預設值 ---
-DEFAULT_CAT_CONFIG = [
-    {"key": "施工說明", "display": "01. 施工說明", "type": "text"},
-    {"key": "相關紀錄", "display": "02. 相關紀錄", "type": "text"},
-    {"key": "進料管理", "display": "03. 進料管理", "type": "text"},
-    {"key": "用料管理", "display": "04. 用料管理", "type": "usage"},
-    {"key": "工種 (人力)", "display": "05. 工種 (人力)", "type": "cost"},
-    {"key": "機具 (設備)", "display": "06. 機具 (設備)", "type": "cost"}
-]
-
-DEFAULT_ITEMS = {
-    "施工說明": ["正常施工", "暫停施工", "收尾階段", "驗收缺失改善", "天候不佳"],
-    "相關紀錄": ["本日會議", "主管走動", "重要事件紀錄", "工安事項", "會勘紀錄"],
-    "進料管理": ["鋼筋進場", "水泥進場", "磁磚進場", "設備進場", "其他材料"],
-    "用料管理": ["混凝土 3000psi", "混凝土 2500psi", "CLSM", "級配", "水泥砂漿"],
-    "工種 (人力)": ["粗工", "泥作", "水電", "油漆", "木工", "鐵工", "板模", "綁鐵", "打石", "清潔"],
-    "機具 (設備)": ["挖土機 (怪手)", "山貓", "吊車", "發電機", "空壓機", "破碎機", "夯實機", "貨車"]
-}
+ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "")   # 以此密碼登入者可看到效能紀錄面板；未設定則停用
 
 # ==========================================
 # 1. 🔐 登入驗證
@@ -60,6 +30,7 @@ if 'logged_in' not in st.session_state: st.session_state.logged_in = False
 
 def check_login():
     if st.session_state.password_input == SYSTEM_PASSWORD: st.session_state.logged_in = True
+    elif ADMIN_PASSWORD and st.session_state.password_input == ADMIN_PASSWORD: st.session_state.logged_in = True; st.session_state.is_admin = True
     else: st.error("❌ 密碼錯誤")
 
 if not st.session_state.logged_in:
@@ -67,167 +38,24 @@ if not st.session_state.logged_in:
     st.text_input("請輸入密碼：", type="password", key="password_input", on_change=check_login)
     st.stop()
 
-# ==========================================
-# 2. 核心邏輯 (雲端化升級 - 修正 API 錯誤)
-# ==========================================
-@st.cache_resource
-def get_google_client():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = None
-    if os.path.exists(KEY_FILE):
-        try: creds = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE, scope)
-        except: return None
-    else:
-        try:
-            if "gcp_service_account" in st.secrets:
-                creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
-        except: return None
-    if not creds: return None
-    return gspread.authorize(creds)
-
-def get_sheet(sheet_title):
-    client = get_google_client()
-    if not client: return None
-    try:
-        sh = client.open(SHEET_NAME)
-        try:
-            return sh.worksheet(sheet_title)
-        except:
-            return sh.add_worksheet(title=sheet_title, rows="100", cols="20")
-    except: return None
-
-def get_date_info(date_obj):
-    weekdays = ["(週一)", "(週二)", "(週三)", "(週四)", "(週五)", "(週六)", "(週日)"]
-    date_str = date_obj.strftime("%Y-%m-%d")
-    w_str = weekdays[date_obj.weekday()]
-    if date_str in HOLIDAYS: return f"🔴 {w_str} ★{HOLIDAYS[date_str]}", True 
-    return (f"🔴 {w_str}", True) if date_obj.weekday() >= 5 else (f"{w_str}", False)
-
-# --- 雲端設定存取函數 (API 修復版) ---
-def load_settings_from_cloud():
-    sheet = get_sheet("settings")
-    default_settings = {"projects": ["預設專案"], "items": {"預設專案": copy.deepcopy(DEFAULT_ITEMS)}, "cat_config": copy.deepcopy(DEFAULT_CAT_CONFIG)}
-    if not sheet: return default_settings
-    try:
-        # 讀取 A1 儲存格的值
-        data = sheet.acell('A1').value
-        return json.loads(data) if data else default_settings
-    except: return default_settings
-
-def save_settings_to_cloud(data):
-    # 同步更新 session_state
-    st.session_state.settings_data = data
-    sheet = get_sheet("settings")
-    if sheet:
-        try:
-            json_str = json.dumps(data, ensure_ascii=False)
-            # 修正: 使用 values=[[內容]] 並指定 range_name，符合新版 gspread 規範
-            sheet.update(values=[[json_str]], range_name='A1')
-        except Exception as e:
-            st.error(f"雲端存檔錯誤 (可能是資料量過大): {e}")
-
-def load_prices_from_cloud():
-    sheet = get_sheet("item_prices")
-    if not sheet: return {}
-    try:
-        data = sheet.acell('A1').value
-        return json.loads(data) if data else {}
-    except: return {}
-
-def save_prices_to_cloud(data):
-    # 同步更新 session_state
-    st.session_state.price_data = data
-    sheet = get_sheet("item_prices")
-    if sheet:
-        try:
-            json_str = json.dumps(data, ensure_ascii=False)
-            # 修正: 使用 values=[[內容]] 並指定 range_name
-            sheet.update(values=[[json_str]], range_name='A1')
-        except Exception as e:
-            st.error(f"雲端存檔錯誤: {e}")
-
-def load_data():
-    cols = ['日期', '專案', '類別', '名稱', '單位', '數量', '單價', '總價', '備註', '月份']
-    sheet = get_sheet("sheet1") # 預設工作表
-    if not sheet: return pd.DataFrame(columns=cols)
-    try:
-        data = sheet.get_all_records()
-        if not data: return pd.DataFrame(columns=cols)
-        df = pd.DataFrame(data)
-        for col in ['專案', '類別', '名稱', '單位', '備註']: df[col] = df[col].fillna("").astype(str)
-        df['日期'] = pd.to_datetime(df['日期'], errors='coerce').dt.date
-        df = df.dropna(subset=['日期']) 
-        df['月份'] = pd.to_datetime(df['日期']).dt.strftime("%Y-%m")
-        for col in ['總價', '數量', '單價']: df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        return df
-    except: return pd.DataFrame(columns=cols)
-
-def save_dataframe(df):
-    sheet = get_sheet("sheet1")
-    if not sheet: return
-    df_save = df.copy().fillna('') 
-    df_save = df_save.drop(columns=[c for c in ['月份', '刪除', 'temp_month', '星期/節日', '🗓️ 星期/節日'] if c in df_save.columns])
-    df_save['日期'] = df_save['日期'].astype(str)
-    try:
-        sheet.clear(); sheet.update([df_save.columns.values.tolist()] + df_save.values.tolist())
-    except Exception as e: st.error(f"雲端存檔失敗: {e}")
-
-def append_data(date, project, category, category_type, name, unit, qty, price, note):
-    total = qty * price if category_type == 'cost' else 0
-    row = [str(date), project, category, name, unit, qty, price, total, note]
-    sheet = get_sheet("sheet1")
-    if sheet: sheet.append_row(row)
-
-# 修正：更新項目名稱時同時更新雲端設定
-def update_item_name(project, category, old_name, new_name, settings, prices):
-    if old_name == new_name: return False
-    curr_list = settings["items"][project].get(category, [])
-    if new_name in curr_list: return False 
-    if old_name in curr_list: curr_list[curr_list.index(old_name)] = new_name
-    if project in prices and category in prices[project] and old_name in prices[project][category]:
-        prices[project][category][new_name] = prices[project][category].pop(old_name)
-        save_prices_to_cloud(prices)
-    df_cur = load_data()
-    if not df_cur.empty:
-        df_cur.loc[(df_cur['專案']==project) & (df_cur['類別']==category) & (df_cur['名稱']==old_name), '名稱'] = new_name
-        save_dataframe(df_cur)
-    save_settings_to_cloud(settings); return True
-
-def update_category_config(idx, new_display, settings):
-    settings["cat_config"][idx]["display"] = new_display; save_settings_to_cloud(settings); return True
-
-def add_new_category_block(new_key, new_display, new_type, settings):
-    for cat in settings["cat_config"]:
-        if cat["key"] == new_key: return False
-    settings["cat_config"].append({"key": new_key, "display": new_display, "type": new_type})
-    for proj in settings["items"]:
-        if new_key not in settings["items"][proj]: settings["items"][proj][new_key] = []
-    save_settings_to_cloud(settings); return True
-
-def delete_category_block(idx, settings):
-    del settings["cat_config"][idx]; save_settings_to_cloud(settings); return True
-
-def create_zip_backup():
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        df_bak = load_data()
-        zip_file.writestr("construction_data.csv", df_bak.to_csv(index=False))
-        # 備份時從雲端抓取最新設定
-        stg = load_settings_from_cloud()
-        prc = load_prices_from_cloud()
-        zip_file.writestr("settings.json", json.dumps(stg, ensure_ascii=False, indent=4))
-        zip_file.writestr("item_prices.json", json.dumps(prc, ensure_ascii=False, indent=4))
-    buffer.seek(0); return buffer
+# --- 效能紀錄 (選用)：上一次被 st.rerun() 中斷的紀錄在此補寫 ---
+if 'session_tag' not in st.session_state: st.session_state.session_tag = datetime.now().strftime("%H%M%S%f")
+if 'profile_history' not in st.session_state: st.session_state.profile_history = []
+def remember_profile(rec):
+    if rec: st.session_state.profile_history = (st.session_state.profile_history + [rec])[-20:]
+
+_prev = st.session_state.get('rerun_profile')
+if _prev is not None and not _prev.finished: remember_profile(finish_rerun(_prev, interrupted=True))
+st.session_state.rerun_profile = start_rerun(st.session_state.session_tag, PROFILE_ALL or st.session_state.get('profiling', False))
+st.session_state.full_run = True   # 整頁執行中 (分頁 fragment 單獨重新執行時為 False)
 
 # --- 初始化 (改從雲端讀取) ---
-if 'settings_data' not in st.session_state:
-    st.session_state.settings_data = load_settings_from_cloud()
-if 'price_data' not in st.session_state:
-    st.session_state.price_data = load_prices_from_cloud()
+st.session_state.sheet_meta_saved = 0
+if 'settings_data' not in st.session_state or 'price_data' not in st.session_state:
+    st.session_state.settings_data, st.session_state.price_data, st.session_state.startup_timings = load_startup()
 
 settings_data = st.session_state.settings_data
 price_data = st.session_state.price_data
-df = load_data()
 CAT_CONFIG_LIST = settings_data["cat_config"]
 
 if 'mem_project' not in st.session_state: st.session_state.mem_project = settings_data["projects"][0]
@@ -237,6 +65,7 @@ if 'last_check_date' not in st.session_state: st.session_state.last_check_date =
 # ==========================================
 # 主介面
 # ==========================================
+TABS = ["📝 快速日報輸入", "🛠️ 報表總覽與編輯修正", "📊 成本儀表板", "🏗️ 專案管理區"]
 st.title("🏗️ 專案施工管理系統 PRO Max (線上版)")
 
 with st.sidebar:
@@ -247,7 +76,7 @@ with st.sidebar:
     global_date = st.date_input("📅 工作日期", st.session_state.mem_date)
     if global_date != st.session_state.last_check_date:
         st.session_state.last_check_date = global_date
-        components.html("""<script>var tabs=window.parent.document.querySelectorAll('[data-testid="stTab"]');if(tabs.length>0){tabs[0].click();}</script>""", height=0, width=0)
+        st.session_state.active_tab = TABS[0]   # 換日期時回到輸入頁
     day_str, is_red = get_date_info(global_date)
     st.markdown(f"### {global_date} {day_str}")
     st.session_state.mem_project = global_project; st.session_state.mem_date = global_date
@@ -262,129 +91,174 @@ with st.sidebar:
         st.rerun()
     if st.button("🔒 登出"): st.session_state.logged_in = False; st.rerun()
 
-tab_entry, tab_data, tab_dash, tab_settings = st.tabs(["📝 快速日報輸入", "🛠️ 報表總覽與編輯修正", "📊 成本儀表板", "🏗️ 專案管理區"])
+active_tab = st.radio("分頁", TABS, key="active_tab", horizontal=True, label_visibility="collapsed")
+
+# 只執行目前選取的分頁；每個分頁是一個 fragment，分頁內的操作 (表單送出、編輯儲存) 只重新執行該分頁
+def tab_fragment(name):
+    def wrap(fn):
+        @st.fragment
+        def run():
+            if st.session_state.get('full_run'):
+                with span(name): fn()
+                return
+            # fragment 單獨重新執行：另起一筆效能紀錄 (上一筆被 st.rerun 中斷者補寫)
+            prev = st.session_state.get('rerun_profile')
+            if prev is not None and not prev.finished: remember_profile(finish_rerun(prev, interrupted=True))
+            prof = st.session_state.rerun_profile = start_rerun(st.session_state.session_tag, PROFILE_ALL or st.session_state.get('profiling', False))
+            with span(name): fn()
+            remember_profile(finish_rerun(prof))
+        return run
+    return wrap
+
+def rerun_tab():
+    # 分頁 fragment 單獨執行中只重新執行該分頁；整頁執行中 (例如同時改了側邊欄) 則整頁重新執行
+    st.rerun(scope="app" if st.session_state.get('full_run') else "fragment")
 
 # === Tab 1: 快速日報輸入 ===
-with tab_entry:
+@tab_fragment("Tab 1 快速日報輸入")
+def tab_entry():
     st.info(f"正在填寫：**{global_project}** / **{global_date}**")
     d_key = str(global_date); handled_keys = []
 
-    # 1. 施工說明 & 相關紀錄
-    if len(CAT_CONFIG_LIST) >= 2:
-        with st.expander(f"📝 {CAT_CONFIG_LIST[0]['display']} 及 {CAT_CONFIG_LIST[1]['display']}", expanded=True):
-            cols = st.columns(2)
-            for i in range(2):
-                conf = CAT_CONFIG_LIST[i]; handled_keys.append(conf["key"])
-                with cols[i]:
-                    st.markdown(f"**{conf['display']}**")
-                    opts = current_items.get(conf["key"], [])
-                    it = st.selectbox("項目", opts if opts else ["(請先至設定頁新增項目)"], key=f"s_{i}_{d_key}")
-                    p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
-                    with st.form(key=f"f_{i}_{d_key}"):
-                        tx = st.text_area("內容", height=100, key=f"a_{i}_{d_key}")
-                        if st.form_submit_button("💾 儲存") and opts:
-                            append_data(global_date, global_project, conf["key"], conf["type"], it, p_set["unit"], 1, 0, tx); st.toast("儲存成功")
-
-    # 2. 進料管理
-    if len(CAT_CONFIG_LIST) >= 3:
-        conf = CAT_CONFIG_LIST[2]; handled_keys.append(conf["key"])
-        with st.expander(f"🚛 {conf['display']}", expanded=True):
-            cols = st.columns(3); opts = current_items.get(conf["key"], [])
-            for k in range(3):
-                with cols[k]:
-                    it = st.selectbox("材料", opts if opts else ["(請先新增項目)"], key=f"is_{k}_{d_key}")
-                    p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
-                    with st.form(key=f"f_2_{k}_{d_key}"):
-                        q = st.number_input("數量", min_value=0.0, step=1.0, key=f"iq_{k}_{d_key}")
-                        u = st.text_input("單位", value=p_set["unit"], key=f"iu_{k}_{d_key}_{it}")
-                        n = st.text_input("備註", key=f"in_n_{k}_{d_key}")
-                        if st.form_submit_button(f"💾 儲存 {k+1}") and opts:
-                            append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, 0, n); st.rerun()
-
-    # 3. 用料管理
-    if len(CAT_CONFIG_LIST) >= 4:
-        conf = CAT_CONFIG_LIST[3]; handled_keys.append(conf["key"])
-        with st.expander(f"🧱 {conf['display']}", expanded=True):
-            cols = st.columns(3); opts = current_items.get(conf["key"], [])
-            for k in range(3):
-                with cols[k]:
-                    it = st.selectbox("材料", opts if opts else ["(請先新增項目)"], key=f"us_{k}_{d_key}")
-                    p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "m3"})
-                    with st.form(key=f"f_3_{k}_{d_key}"):
-                        q = st.number_input("數量", min_value=0.0, step=0.5, key=f"uq_{k}_{d_key}")
-                        u = st.text_input("單位", value=p_set["unit"], key=f"uu_{k}_{d_key}_{it}")
-                        n = st.text_input("備註", key=f"un_n_{k}_{d_key}")
-                        if st.form_submit_button(f"💾 儲存 {k+1}") and opts:
-                            append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, 0, n); st.rerun()
-
-    # 4. 人力與機具
-    if len(CAT_CONFIG_LIST) >= 6:
-        with st.expander("👷 人力與機具出工紀錄", expanded=True):
-            cols = st.columns(2)
-            for i in [4, 5]:
-                conf = CAT_CONFIG_LIST[i]; handled_keys.append(conf["key"])
-                with cols[i-4]:
-                    st.markdown(f"### {conf['display']}")
+    if st.toggle("📋 整日批次輸入 (表格填寫，一次儲存)", key="bulk_mode"):
+        prev_day = previous_working_day(global_date)
+        copy_prev = st.checkbox(f"帶入前一工作日 {prev_day} {get_date_info(prev_day)[0]} 的資料", key=f"bulk_copy_{d_key}")
+        grid = day_entry_frame(global_project, CAT_CONFIG_LIST, current_items, price_data.get(global_project, {}), prev_day if copy_prev else None)
+        # 放在 form 裡：編輯儲存格不觸發重新執行，按下儲存才一次送出
+        with st.form(key=f"bulk_{d_key}"):
+            st.caption("填寫數量或備註的列才會儲存 (文字類別填寫備註即可)")
+            edited = st.data_editor(grid, key=f"bulk_grid_{global_project}_{d_key}_{copy_prev}_{st.session_state.get('bulk_saved', 0)}", hide_index=True, use_container_width=True, num_rows="fixed",
+                                    column_config={"_key": None, "_type": None, "類別": st.column_config.TextColumn(disabled=True), "名稱": st.column_config.TextColumn(disabled=True),
+                                                   "數量": st.column_config.NumberColumn(min_value=0.0, step=0.5), "單價": st.column_config.NumberColumn(min_value=0.0), "備註": st.column_config.TextColumn(width="large")})
+            if st.form_submit_button("💾 一次儲存整日資料", type="primary"):
+                n = append_day(global_date, global_project, edited)
+                if n: st.session_state.bulk_saved = st.session_state.get('bulk_saved', 0) + 1; st.toast(f"已儲存 {n} 筆"); rerun_tab()
+                else: st.warning("沒有填寫任何數量或內容")
+    else:
+        # 1. 施工說明 & 相關紀錄
+        if len(CAT_CONFIG_LIST) >= 2:
+            with st.expander(f"📝 {CAT_CONFIG_LIST[0]['display']} 及 {CAT_CONFIG_LIST[1]['display']}", expanded=True):
+                cols = st.columns(2)
+                for i in range(2):
+                    conf = CAT_CONFIG_LIST[i]; handled_keys.append(conf["key"])
+                    with cols[i]:
+                        st.markdown(f"**{conf['display']}**")
+                        opts = current_items.get(conf["key"], [])
+                        it = st.selectbox("項目", opts if opts else ["(請先至設定頁新增項目)"], key=f"s_{i}_{d_key}")
+                        p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
+                        with st.form(key=f"f_{i}_{d_key}"):
+                            tx = st.text_area("內容", height=100, key=f"a_{i}_{d_key}")
+                            if st.form_submit_button("💾 儲存") and opts:
+                                append_data(global_date, global_project, conf["key"], conf["type"], it, p_set["unit"], 1, 0, tx); st.toast("儲存成功")
+
+        # 2. 進料管理
+        if len(CAT_CONFIG_LIST) >= 3:
+            conf = CAT_CONFIG_LIST[2]; handled_keys.append(conf["key"])
+            with st.expander(f"🚛 {conf['display']}", expanded=True):
+                cols = st.columns(3); opts = current_items.get(conf["key"], [])
+                for k in range(3):
+                    with cols[k]:
+                        it = st.selectbox("材料", opts if opts else ["(請先新增項目)"], key=f"is_{k}_{d_key}")
+                        p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
+                        with st.form(key=f"f_2_{k}_{d_key}"):
+                            q = st.number_input("數量", min_value=0.0, step=1.0, key=f"iq_{k}_{d_key}")
+                            u = st.text_input("單位", value=p_set["unit"], key=f"iu_{k}_{d_key}_{it}")
+                            n = st.text_input("備註", key=f"in_n_{k}_{d_key}")
+                            if st.form_submit_button(f"💾 儲存 {k+1}") and opts:
+                                append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, 0, n); rerun_tab()
+
+        # 3. 用料管理
+        if len(CAT_CONFIG_LIST) >= 4:
+            conf = CAT_CONFIG_LIST[3]; handled_keys.append(conf["key"])
+            with st.expander(f"🧱 {conf['display']}", expanded=True):
+                cols = st.columns(3); opts = current_items.get(conf["key"], [])
+                for k in range(3):
+                    with cols[k]:
+                        it = st.selectbox("材料", opts if opts else ["(請先新增項目)"], key=f"us_{k}_{d_key}")
+                        p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "m3"})
+                        with st.form(key=f"f_3_{k}_{d_key}"):
+                            q = st.number_input("數量", min_value=0.0, step=0.5, key=f"uq_{k}_{d_key}")
+                            u = st.text_input("單位", value=p_set["unit"], key=f"uu_{k}_{d_key}_{it}")
+                            n = st.text_input("備註", key=f"un_n_{k}_{d_key}")
+                            if st.form_submit_button(f"💾 儲存 {k+1}") and opts:
+                                append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, 0, n); rerun_tab()
+
+        # 4. 人力與機具
+        if len(CAT_CONFIG_LIST) >= 6:
+            with st.expander("👷 人力與機具出工紀錄", expanded=True):
+                cols = st.columns(2)
+                for i in [4, 5]:
+                    conf = CAT_CONFIG_LIST[i]; handled_keys.append(conf["key"])
+                    with cols[i-4]:
+                        st.markdown(f"### {conf['display']}")
+                        opts = current_items.get(conf["key"], [])
+                        it = st.selectbox("項目", opts if opts else ["(請先新增項目)"], key=f"cs_{i}_{d_key}")
+                        p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "工" if i==4 else "式"})
+                        with st.form(key=f"f_{i}_{d_key}"):
+                            cq, cp = st.columns(2)
+                            q = cq.number_input("數量", value=1.0, step=0.5, key=f"cq_{i}_{d_key}")
+                            p = cp.number_input("單價", value=float(p_set["price"]), key=f"cp_{i}_{d_key}_{it}")
+                            u = st.text_input("單位", value=p_set["unit"], key=f"cu_{i}_{d_key}_{it}")
+                            n = st.text_input("備註", key=f"cn_n_{i}_{d_key}")
+                            if st.form_submit_button("💾 新增紀錄") and opts:
+                                append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, p, n); rerun_tab()
+
+        # 🌟 動態同步區
+        for conf in CAT_CONFIG_LIST:
+            if conf["key"] not in handled_keys:
+                with st.expander(f"📌 {conf['display']}", expanded=True):
                     opts = current_items.get(conf["key"], [])
-                    it = st.selectbox("項目", opts if opts else ["(請先新增項目)"], key=f"cs_{i}_{d_key}")
-                    p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "工" if i==4 else "式"})
-                    with st.form(key=f"f_{i}_{d_key}"):
-                        cq, cp = st.columns(2)
-                        q = cq.number_input("數量", value=1.0, step=0.5, key=f"cq_{i}_{d_key}")
-                        p = cp.number_input("單價", value=float(p_set["price"]), key=f"cp_{i}_{d_key}_{it}")
-                        u = st.text_input("單位", value=p_set["unit"], key=f"cu_{i}_{d_key}_{it}")
-                        n = st.text_input("備註", key=f"cn_n_{i}_{d_key}")
-                        if st.form_submit_button("💾 新增紀錄") and opts:
-                            append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, p, n); st.rerun()
-
-    # 🌟 動態同步區
-    for conf in CAT_CONFIG_LIST:
-        if conf["key"] not in handled_keys:
-            with st.expander(f"📌 {conf['display']}", expanded=True):
-                opts = current_items.get(conf["key"], [])
-                if opts:
-                    it = st.selectbox("選擇項目", opts, key=f"ds_{conf['key']}")
-                    p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
-                    with st.form(key=f"dyn_{conf['key']}_{d_key}"):
-                        if conf["type"] == 'text':
-                            tx = st.text_area("內容內容", key=f"dt_{conf['key']}"); q, p, u = 1, 0, p_set["unit"]
-                        else:
-                            c1, c2, c3 = st.columns(3)
-                            q = c1.number_input("數量", value=1.0, key=f"dq_{conf['key']}")
-                            p = c2.number_input("單價", value=float(p_set["price"]), key=f"dp_{conf['key']}_{it}") if conf["type"] == 'cost' else 0
-                            u = c3.text_input("單位", value=p_set["unit"], key=f"du_{conf['key']}_{it}")
-                            tx = st.text_input("備註", key=f"dn_n_{conf['key']}")
-                        if st.form_submit_button("💾 儲存資料"):
-                            append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, p, tx); st.rerun()
+                    if opts:
+                        it = st.selectbox("選擇項目", opts, key=f"ds_{conf['key']}")
+                        p_set = price_data.get(global_project, {}).get(conf["key"], {}).get(it, {"price": 0, "unit": "式"})
+                        with st.form(key=f"dyn_{conf['key']}_{d_key}"):
+                            if conf["type"] == 'text':
+                                tx = st.text_area("內容內容", key=f"dt_{conf['key']}"); q, p, u = 1, 0, p_set["unit"]
+                            else:
+                                c1, c2, c3 = st.columns(3)
+                                q = c1.number_input("數量", value=1.0, key=f"dq_{conf['key']}")
+                                p = c2.number_input("單價", value=float(p_set["price"]), key=f"dp_{conf['key']}_{it}") if conf["type"] == 'cost' else 0
+                                u = c3.text_input("單位", value=p_set["unit"], key=f"du_{conf['key']}_{it}")
+                                tx = st.text_input("備註", key=f"dn_n_{conf['key']}")
+                            if st.form_submit_button("💾 儲存資料"):
+                                append_data(global_date, global_project, conf["key"], conf["type"], it, u, q, p, tx); rerun_tab()
 
 # === Tab 2: 報表總覽 ===
-with tab_data:
-    proj_df = df[df['專案'] == global_project].copy()
-    if proj_df.empty: st.info(f"專案【{global_project}】無資料")
+@tab_fragment("Tab 2 報表總覽")
+def tab_data():
+    months = list_months(global_project)
+    if not months: st.info(f"專案【{global_project}】無資料")
     else:
         c1, c2, c3 = st.columns([2, 2, 2])
-        months = sorted(proj_df['月份'].unique().tolist(), reverse=True)
         with c1: ed_month = st.selectbox("編輯月份", months, key="ed_m")
-        month_df = proj_df[proj_df['月份'] == ed_month].copy()
+        month_df = load_data(global_project, [ed_month])
         dates = sorted(month_df['日期'].unique().tolist())
-        with c2: ed_date = st.selectbox("日期篩選", ["整個月"] + dates, key="ed_d")
+        with c2: ed_date = st.selectbox("日期篩選", ["整個月"] + dates, key="ed_d", format_func=lambda d: d if isinstance(d, str) else d.strftime("%Y-%m-%d"))
         with c3: search = st.text_input("搜尋關鍵字", key="search_key")
+        search_all = st.toggle("🔎 搜尋整個專案 (跨月份)", key="search_all")
         st.divider()
+        if search_all: render_search(search); return
+
+        sections, month_cats = section_frames(month_df, ed_date, search, ed_month)
 
         def render_section(cat_key, cat_disp, cat_type, key):
             sk = f"conf_{key}"; 
             if sk not in st.session_state: st.session_state[sk] = False
-            sec_df = month_df[month_df['類別'] == cat_key].copy()
-            if not sec_df.empty:
+            if cat_key in month_cats:
                 st.subheader(cat_disp)
-                view = sec_df.copy()
-                if ed_date != "整個月": view = view[view['日期'] == ed_date]
-                if search:
-                    mask = view.apply(lambda x: search in str(x['名稱']) or search in str(x['備註']), axis=1)
-                    view = view[mask]
+                ck = f"cf_{key}"
+                if st.session_state.get(ck):
+                    st.warning(f"⚠️ 有 {len(st.session_state[ck])} 筆在您編輯期間已被其他人修改，未寫入（其餘修改已儲存）")
+                    st.dataframe(conflict_table(st.session_state[ck]), hide_index=True)
+                    k1, k2, _ = st.columns([2, 2, 4])
+                    with k1:
+                        if st.button("🔄 放棄我的修改", key=f"cr_{key}"): del st.session_state[ck]; rerun_tab()
+                    with k2:
+                        if st.button("⚠️ 仍以我的修改覆蓋", key=f"co_{key}"): overwrite_conflicts(st.session_state[ck]); del st.session_state[ck]; rerun_tab()
+                view = sections.get(cat_key)
                 
-                if not view.empty:
-                    view['🗓️ 星期/節日'] = view['日期'].apply(lambda x: get_date_info(x)[0])
+                if view is not None and not view.empty:
+                    view = view.copy()
                     if '刪除' not in view.columns: view.insert(0, "刪除", False)
                     
                     if cat_disp.startswith("01.") or cat_disp.startswith("02."):
@@ -394,21 +268,19 @@ with tab_data:
                     else:
                         cols_to_show = ['刪除', '日期', '🗓️ 星期/節日', '名稱', '數量', '單位', '單價', '總價', '備註']
                     
-                    view_final = view[[c for c in cols_to_show if c in view.columns]]
-                    col_cfg = {"刪除": st.column_config.CheckboxColumn(width="small"), "日期": st.column_config.DateColumn(format="YYYY-MM-DD", width="small"), "🗓️ 星期/節日": st.column_config.TextColumn(disabled=True, width="medium"), "名稱": st.column_config.TextColumn(width="medium"), "數量": st.column_config.NumberColumn(width="small"), "單位": st.column_config.TextColumn(width="small"), "單價": st.column_config.NumberColumn(width="small"), "總價": st.column_config.NumberColumn(disabled=True, width="small"), "備註": st.column_config.TextColumn(width="large")}
+                    view_final = view[[c for c in cols_to_show + ['_id', '_ver'] if c in view.columns]]
+                    col_cfg = {"_id": None, "_ver": None, "刪除": st.column_config.CheckboxColumn(width="small"), "日期": st.column_config.DateColumn(format="YYYY-MM-DD", width="small"), "🗓️ 星期/節日": st.column_config.TextColumn(disabled=True, width="medium"), "名稱": st.column_config.TextColumn(width="medium"), "數量": st.column_config.NumberColumn(width="small"), "單位": st.column_config.TextColumn(width="small"), "單價": st.column_config.NumberColumn(width="small"), "總價": st.column_config.NumberColumn(disabled=True, width="small"), "備註": st.column_config.TextColumn(width="large")}
                     edited = st.data_editor(view_final.sort_values('日期', ascending=False), key=f"e_{key}", column_config=col_cfg, use_container_width=True, hide_index=True)
                     
                     b1, b2, _ = st.columns([1, 1, 6])
                     with b1: 
                         if st.button("💾 更新修改", key=f"s_{key}"): 
-                            target_indices = edited.index
-                            common_cols = [c for c in edited.columns if c in df.columns and c not in ['刪除', '🗓️ 星期/節日']]
-                            for col in common_cols: df.loc[target_indices, col] = edited[col]
-                            if cat_type == 'cost': df.loc[target_indices, '總價'] = df.loc[target_indices, '數量'] * df.loc[target_indices, '單價']
-                            if '刪除' in edited.columns:
-                                delete_indices = edited[edited['刪除']].index
-                                if not delete_indices.empty: df.drop(delete_indices, inplace=True)
-                            save_dataframe(df); st.toast("✅ 更新成功"); time.sleep(0.5); st.rerun()
+                            new_view = edited.copy()
+                            if cat_type == 'cost': new_view['總價'] = new_view['數量'] * new_view['單價']
+                            if '刪除' in new_view.columns: new_view = new_view[~new_view['刪除']]
+                            st.session_state[ck] = save_dataframe(new_view, base=view_final)
+                            if not st.session_state[ck]: st.toast("✅ 更新成功"); time.sleep(0.5)
+                            rerun_tab()
 
                     with b2: 
                         if st.button("🗑️ 刪除選取", key=f"d_{key}", type="primary"): 
@@ -416,45 +288,67 @@ with tab_data:
                     if st.session_state[sk]: 
                         st.warning("確定刪除？")
                         if st.button("✔️ 是", key=f"y_{key}"):
-                            delete_indices = edited[edited['刪除']].index
-                            df.drop(delete_indices, inplace=True); save_dataframe(df); st.session_state[sk] = False; st.rerun()
-                        if st.button("❌ 否", key=f"n_{key}"): st.session_state[sk] = False; st.rerun()
+                            st.session_state[ck] = save_dataframe(edited[~edited['刪除']], base=view_final); st.session_state[sk] = False; rerun_tab()
+                        if st.button("❌ 否", key=f"n_{key}"): st.session_state[sk] = False; rerun_tab()
 
         for config in CAT_CONFIG_LIST:
             render_section(config["key"], config["display"], config["type"], f"sec_{config['key']}")
 
+def open_in_editor(month):
+    # 搜尋結果 → 編輯區：切到該月份 (整個月)，保留關鍵字
+    st.session_state.ed_m = month; st.session_state.ed_d = "整個月"; st.session_state.search_all = False
+
+def render_search(search):
+    if not search.strip(): st.info("請輸入關鍵字 (多個關鍵字以空白分隔)"); return
+    res = search_project(global_project, search)
+    groups = search_groups(res, [c["key"] for c in CAT_CONFIG_LIST])
+    disp = {c["key"]: c["display"] for c in CAT_CONFIG_LIST}
+    st.caption(f"共 {len(res)} 筆，分布在 {len(groups)} 個月份")
+    col_cfg = {"日期": st.column_config.DateColumn(format="YYYY-MM-DD"), "備註": st.column_config.TextColumn(width="large")}
+    for month, cats in groups:
+        with st.expander(f"📅 {month}（{sum(len(g) for _, g in cats)} 筆）", expanded=len(groups) <= 3):
+            for cat, g in cats:
+                st.markdown(f"**{disp.get(cat, cat)}**")
+                st.dataframe(g[['日期', '名稱', '數量', '單位', '總價', '備註']], hide_index=True, column_config=col_cfg, use_container_width=True)
+            st.button("✏️ 在編輯區開啟", key=f"go_{month}", on_click=open_in_editor, args=(month,))
+
 # === Tab 3: 成本儀表板 ===
-with tab_dash:
-    if not df.empty:
-        dash_df = df[df['專案'] == global_project].copy()
-        if not dash_df.empty:
-            dash_df['Year'] = pd.to_datetime(dash_df['日期']).dt.year
-            y_list = sorted(dash_df['Year'].unique().tolist(), reverse=True)
-            c_y, c_m, _ = st.columns([2, 2, 4])
-            with c_y: sel_y = st.selectbox("📅 統計年份", y_list, key="dash_y")
-            year_df = dash_df[dash_df['Year'] == sel_y]
-            m_list = sorted(year_df['月份'].unique().tolist(), reverse=True)
-            with c_m: sel_m = st.selectbox("📅 統計月份", m_list, key="dash_m")
-            month_df = year_df[year_df['月份'] == sel_m]; today_str = datetime.now().date()
-            k1, k2, k3 = st.columns(3)
-            k1.metric("今日費用", f"${dash_df[dash_df['日期'] == today_str]['總價'].sum():,.0f}")
-            k2.metric(f"{sel_m} 費用", f"${month_df['總價'].sum():,.0f}")
-            k3.metric(f"{sel_y} 年度總計", f"${year_df['總價'].sum():,.0f}")
-            st.divider()
-            cost_df = month_df[month_df['總價'] > 0]
-            if not cost_df.empty:
-                st.altair_chart(alt.Chart(cost_df.groupby('類別')['總價'].sum().reset_index()).mark_arc(outerRadius=100, innerRadius=50).encode(theta="總價", color="類別", tooltip=["類別", "總價"]), use_container_width=True)
-                for c in cost_df['類別'].unique():
-                    c_data = cost_df[cost_df['類別'] == c]
-                    with st.expander(f"{c} (總計: ${c_data['總價'].sum():,.0f})"):
-                        st.bar_chart(c_data.groupby('名稱')['總價'].sum().reset_index().sort_values('總價', ascending=False), x='名稱', y='總價')
-            else: st.info(f"{sel_m} 尚無金額紀錄。")
+@tab_fragment("Tab 3 成本儀表板")
+def tab_dash():
+    all_months = list_months(global_project)
+    if all_months:
+        y_list = sorted({m[:4] for m in all_months}, reverse=True)
+        c_y, c_m, _ = st.columns([2, 2, 4])
+        with c_y: sel_y = st.selectbox("📅 統計年份", y_list, key="dash_y")
+        m_list = [m for m in all_months if m.startswith(sel_y)]
+        with c_m: sel_m = st.selectbox("📅 統計月份", m_list, key="dash_m")
+        # 讀取預先彙總的成本表 (每日每項目一列)，不載入原始紀錄
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        summary = dashboard_summary(load_cube(global_project, set(m_list) | {today_str[:7]}), today_str, sel_m, m_list)
+        k1, k2, k3 = st.columns(3)
+        k1.metric("今日費用", f"${summary['today']:,.0f}")
+        k2.metric(f"{sel_m} 費用", f"${summary['month']:,.0f}")
+        k3.metric(f"{sel_y} 年度總計", f"${summary['year']:,.0f}")
+        st.divider()
+        if summary['by_item']:
+            st.altair_chart(alt.Chart(summary['by_cat']).mark_arc(outerRadius=100, innerRadius=50).encode(theta="總價", color="類別", tooltip=["類別", "總價"]), use_container_width=True)
+            for c, c_data in summary['by_item'].items():
+                with st.expander(f"{c} (總計: ${c_data['總價'].sum():,.0f})"):
+                    st.bar_chart(c_data, x='名稱', y='總價')
+        else: st.info(f"{sel_m} 尚無金額紀錄。")
 
 # === Tab 4: 🏗️ 專案管理區 (表單化輸入) ===
-with tab_settings:
+@tab_fragment("Tab 4 專案管理區")
+def tab_settings():
     st.header("🏗️ 專案管理區")
     with st.expander("📦 資料備份中心", expanded=False):
-        st.download_button("📦 下載完整備份 (ZIP)", create_zip_backup(), file_name=f"backup_{datetime.now().strftime('%Y%m%d')}.zip", mime="application/zip")
+        if st.button("📦 準備完整備份 (ZIP)"):
+            with st.spinner("備份建立中..."):
+                try: st.session_state.backup_path = create_zip_backup()
+                except Exception as e: st.error(f"備份失敗：{e}")
+        if st.session_state.get('backup_path') and os.path.exists(st.session_state.backup_path):
+            with open(st.session_state.backup_path, 'rb') as f:
+                st.download_button("⬇️ 下載備份檔", f, file_name=f"backup_{datetime.now().strftime('%Y%m%d')}.zip", mime="application/zip")
         uploaded_file = st.file_uploader("📤 系統還原 (ZIP/CSV/JSON)", type=['csv', 'zip', 'json'])
         if uploaded_file and st.button("⚠️ 確認執行還原"):
             try:
@@ -463,20 +357,41 @@ with tab_settings:
                     if "settings" in uploaded_file.name: save_settings_to_cloud(data)
                     else: save_prices_to_cloud(data)
                     st.success(f"設定檔還原成功！"); time.sleep(1); st.rerun()
-                elif uploaded_file.name.endswith('.csv'):
-                    df_new = pd.read_csv(uploaded_file, encoding='utf-8-sig'); save_dataframe(df_new)
-                    new_projs = df_new['專案'].unique().tolist(); changed = False
-                    for p in new_projs:
-                        if p and p not in settings_data["projects"]:
-                            settings_data["projects"].append(p)
-                            if p not in settings_data["items"]: settings_data["items"][p] = copy.deepcopy(DEFAULT_ITEMS)
-                            changed = True
-                    if changed: save_settings_to_cloud(settings_data)
-                    st.success("資料還原成功！"); time.sleep(1); st.rerun()
-                elif uploaded_file.name.endswith('.zip'):
-                    st.warning("雲端版不支援 ZIP 還原，請解壓縮後分別上傳 JSON 與 CSV。")
+                else:
+                    if uploaded_file.name.endswith('.zip'):
+                        zf = zipfile.ZipFile(uploaded_file); names = zf.namelist()
+                        if "settings.json" in names: save_settings_to_cloud(json.loads(zf.read("settings.json")))
+                        if "item_prices.json" in names: save_prices_to_cloud(json.loads(zf.read("item_prices.json")))
+                        open_csv = (lambda: zf.open("construction_data.csv")) if "construction_data.csv" in names else None
+                    else:
+                        raw = uploaded_file.getvalue(); open_csv = lambda: io.BytesIO(raw)
+                    n = 0
+                    if open_csv:
+                        bar = st.progress(0.0, text="資料還原中...")
+                        n, new_projs = restore_records(open_csv, lambda frac, done: bar.progress(frac, text=f"資料還原中... {done} 筆"))
+                        cur = st.session_state.settings_data; changed = False
+                        for p in new_projs:
+                            if p not in cur["projects"]:
+                                cur["projects"].append(p)
+                                if p not in cur["items"]: cur["items"][p] = copy.deepcopy(DEFAULT_ITEMS)
+                                changed = True
+                        if changed: save_settings_to_cloud(cur)
+                    st.success(f"資料還原成功！({n} 筆紀錄)"); time.sleep(1); st.rerun()
             except Exception as e: st.error(f"還原失敗：{e}")
-            
+
+    with st.expander("🖨️ 施工日報批次匯出 (Excel)", expanded=False):
+        today = datetime.now().date()
+        rng = st.date_input("匯出期間", value=(today.replace(day=1), today), key="report_range")
+        if len(rng) == 2 and st.button(f"🖨️ 產生 {global_project} 的施工日報 (每日一份)"):
+            bar = st.progress(0.0, text="日報產生中...")
+            try: st.session_state.report_path = export_daily_reports(global_project, rng[0], rng[1], CAT_CONFIG_LIST, lambda done, total: bar.progress(done / total, text=f"日報產生中... {done}/{total} 天"))
+            except Exception as e: st.session_state.report_path = None; st.error(f"匯出失敗：{e}")
+            else:
+                if not st.session_state.report_path: st.info("期間內沒有紀錄。")
+        if st.session_state.get('report_path') and os.path.exists(st.session_state.report_path):
+            with open(st.session_state.report_path, 'rb') as f:
+                st.download_button("⬇️ 下載施工日報 (ZIP)", f, file_name=f"施工日報_{global_project}_{rng[0]}_{rng[-1]}.zip", mime="application/zip")
+
     with st.expander("1. 專案管理", expanded=True):
         # 修正：使用 form 防止輸入時觸發上傳
         with st.form("add_project_form"):
@@ -536,46 +451,44 @@ with tab_settings:
         if t_conf:
             tk = t_conf["key"]; ct = t_conf["type"]; c_list = current_items.get(tk, [])
             
-            # 修正：使用 form 包裹新增輸入框，防止輸入時重新整理
-            with st.form(f"add_item_form_{tk}"):
-                c_a, c_b = st.columns([3, 1])
-                ni_in = c_a.text_input(f"在【{target_v}】新增項目內容", key=f"no_{tk}")
-                if c_b.form_submit_button("➕ 加入項目") and ni_in:
-                    current_items[tk].append(ni_in); save_settings_to_cloud(settings_data); st.rerun()
-            
-            st.markdown(f"**目前項目清單 ({len(c_list)})**")
-            if ct == 'text': h1, h2, h3, h4 = st.columns([3, 3, 1, 1]); h1.caption("原名稱"); h2.caption("新名稱"); h3.caption("存"); h4.caption("刪")
-            elif ct == 'usage': h1, h2, h3, h4, h5 = st.columns([2, 2, 2, 1, 1]); h1.caption("原名稱"); h2.caption("新名稱"); h3.caption("預設單位"); h4.caption("存"); h5.caption("刪")
-            else: h1, h2, h3, h4, h5, h6 = st.columns([2, 2, 1, 1, 0.5, 0.5]); h1.caption("原名稱"); h2.caption("新名稱"); h3.caption("單價"); h4.caption("單位"); h5.caption("存"); h6.caption("刪")
-            
-            for it_v in c_list:
-                p_i = price_data.get(global_project, {}).get(tk, {}).get(it_v, {"price": 0, "unit": "式"})
-                if ct == 'text':
-                    r1, r2, r3, r4 = st.columns([3, 3, 1, 1])
-                    with r1: st.text(it_v)
-                    with r2: rnn_in = r2.text_input("RN", value=it_v, key=f"r_{tk}_{it_v}", label_visibility="collapsed")
-                    if r3.button("💾", key=f"s_{tk}_{it_v}"):
-                        if rnn_in != it_v: update_item_name(global_project, tk, it_v, rnn_in, settings_data, price_data)
-                        st.toast("已更新"); st.rerun()
-                    if r4.button("🗑️", key=f"dl_{tk}_{it_v}"): current_items[tk].remove(it_v); save_settings_to_cloud(settings_data); st.rerun()
-                elif ct == 'usage':
-                    r1, r2, r3, r4, r5 = st.columns([2, 2, 2, 1, 1])
-                    with r1: st.text(it_v)
-                    with r2: rnn_in = r2.text_input("RN", value=it_v, key=f"r_{tk}_{it_v}", label_visibility="collapsed")
-                    with r3: nu_in = r3.text_input("U", value=p_i["unit"], key=f"u_{tk}_{it_v}", label_visibility="collapsed")
-                    if r4.button("💾", key=f"s_{tk}_{it_v}"):
-                        if rnn_in != it_v: update_item_name(global_project, tk, it_v, rnn_in, settings_data, price_data)
-                        if tk not in price_data[global_project]: price_data[global_project][tk] = {}
-                        price_data[global_project][tk][rnn_in if rnn_in != it_v else it_v] = {"price": 0, "unit": nu_in}; save_prices_to_cloud(price_data); st.rerun()
-                    if r5.button("🗑️", key=f"dl_{tk}_{it_v}"): current_items[tk].remove(it_v); save_settings_to_cloud(settings_data); st.rerun()
-                else:
-                    r1, r2, r3, r4, r5, r6 = st.columns([2, 2, 1, 1, 0.5, 0.5])
-                    with r1: st.text(it_v)
-                    with r2: rnn_in = r2.text_input("RN", value=it_v, key=f"r_{tk}_{it_v}", label_visibility="collapsed")
-                    with r3: np_in = r3.number_input("P", value=float(p_i["price"]), key=f"p_{tk}_{it_v}", label_visibility="collapsed")
-                    with r4: nu_in = r4.text_input("U", value=p_i["unit"], key=f"u_{tk}_{it_v}", label_visibility="collapsed")
-                    if r5.button("💾", key=f"s_{tk}_{it_v}"):
-                        if rnn_in != it_v: update_item_name(global_project, tk, it_v, rnn_in, settings_data, price_data)
-                        if tk not in price_data[global_project]: price_data[global_project][tk] = {}
-                        price_data[global_project][tk][rnn_in if rnn_in != it_v else it_v] = {"price": np_in, "unit": nu_in}; save_prices_to_cloud(price_data); st.rerun()
-                    if r6.button("🗑️", key=f"dl_{tk}_{it_v}"): current_items[tk].remove(it_v); save_settings_to_cloud(settings_data); st.rerun()
+            # 整表編輯：放在 form 裡，編輯儲存格不觸發重新執行；改名、單價/單位、新增與刪除按下儲存才一次檢查並寫入
+            with st.form(key=f"items_form_{tk}"):
+                st.caption(f"**目前項目清單 ({len(c_list)})** — 直接修改儲存格；表格最下方新增列，勾選列後按垃圾桶刪除")
+                items_df = item_table(c_list, price_data.get(global_project, {}).get(tk, {}))
+                edited = st.data_editor(items_df, key=f"items_{global_project}_{tk}_{st.session_state.get('items_saved', 0)}", hide_index=True, use_container_width=True, num_rows="dynamic",
+                                        column_config={"_原名稱": None, "名稱": st.column_config.TextColumn(required=True),
+                                                       "單價": st.column_config.NumberColumn(min_value=0.0, format="%.0f") if ct == 'cost' else None,
+                                                       "單位": st.column_config.TextColumn(default="式") if ct != 'text' else None})
+                if st.form_submit_button("💾 儲存變更", type="primary"):
+                    errors = save_item_table(global_project, tk, ct, edited, settings_data, price_data)
+                    if errors: st.error("未儲存，請修正：\n\n" + "\n".join(f"- {e}" for e in errors))
+                    else: st.session_state.items_saved = st.session_state.get('items_saved', 0) + 1; st.toast("已更新"); st.rerun()
+
+{TABS[0]: tab_entry, TABS[1]: tab_data, TABS[2]: tab_dash, TABS[3]: tab_settings}[active_tab]()
+
+with st.sidebar:
+    st.caption(f"⚡ 本次執行省下 {st.session_state.get('sheet_meta_saved', 0)} 次試算表開啟呼叫")
+    ws_status = get_backend().write_status()
+    if ws_status:
+        st.caption(f"📤 待上傳 {ws_status[0]} 筆 / 已上傳 {ws_status[1]} 筆")
+        if ws_status[2]: st.caption(f"⚠️ 上傳失敗，稍後自動重試：{ws_status[2]}")
+    cube_status = get_backend().cube_status()
+    if cube_status and cube_status[0]: st.caption(f"⚠️ 成本彙總更新失敗 {cube_status[0]} 次，下次讀取時重建：{cube_status[1]}")
+    q = get_backend().quota_status()
+    if q and (q['排隊秒數'] or q['合併'] or q['重試']): st.caption(f"⏳ API 配額排程 (自啟動起)：{q['呼叫']} 次呼叫 / 排隊 {q['排隊秒數']}s / 合併重複讀取 {q['合併']} 次 / 重試 {q['重試']} 次")
+    st.caption(f"💾 儲存後端：{get_backend().name}")
+    if st.session_state.get('startup_timings'): st.caption("🚀 啟動讀取 " + " / ".join(f"{k} {v:.2f}s" for k, v in st.session_state.startup_timings.items()))
+    mem_now, mem_old = get_backend().dataset_memory()
+    if mem_now: st.caption(f"🧠 共用資料集 {mem_now / 2**20:.1f} MB（原格式約 {mem_old / 2**20:.1f} MB；各 session 共用，不再各自複製）")
+    remember_profile(finish_rerun(st.session_state.rerun_profile)); st.session_state.full_run = False
+    if st.session_state.get('is_admin'):
+        with st.expander("🛠️ 效能紀錄 (管理員)", expanded=False):
+            st.toggle("記錄本 session 的每次執行", key="profiling", disabled=PROFILE_ALL)
+            if st.session_state.profile_history:
+                last = st.session_state.profile_history[-1]
+                st.caption(f"{last['time']} {'(已中斷) ' if last['interrupted'] else ''}耗時 {last['wall']:.2f}s / API {last['api_calls']} 次 {last['api_time']:.2f}s / "
+                           f"{(last['bytes_sent'] + last['bytes_received']) / 1024:,.0f} KB / {last['rows']:,} 列")
+                st.dataframe(summary_frame(last), hide_index=True, use_container_width=True)
+                st.caption("最近幾次執行")
+                st.dataframe([{"時間": r['time'], "秒": r['wall'], "API": r['api_calls'], "KB": round((r['bytes_sent'] + r['bytes_received']) / 1024, 1), "中斷": r['interrupted']} for r in reversed(st.session_state.profile_history)], hide_index=True, use_container_width=True)
+            else: st.caption("開啟後下一次執行開始記錄")
@@ -0,0 +1,168 @@
+import json
+import time
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol
+
+# ==========================================
+# 記憶體中的 gspread 替身 (Client / Spreadsheet / Worksheet)
+# ==========================================
+# 只實作 storage.py 用到的方法；每次呼叫記錄方法、工作表、傳送/回應位元組與模擬延遲
+class CallLog:
+    def __init__(self, latency_ms=0.0, bandwidth=1_000_000, sleep=False):
+        self.latency_ms = latency_ms; self.bandwidth = bandwidth; self.sleep = sleep   # bandwidth: bytes/秒
+        self.calls = []
+
+    def record(self, sheet, op, payload, result):
+        sent = _size(payload); received = _size(result)
+        delay = self.latency_ms / 1000 + (sent + received) / self.bandwidth
+        self.calls.append({"sheet": sheet, "op": op, "bytes_sent": sent, "bytes_received": received, "latency": delay})
+        if self.sleep: time.sleep(delay)
+        return result
+
+    def mark(self): return len(self.calls)
+
+    def since(self, mark):
+        calls = self.calls[mark:]
+        return {"calls": len(calls), "bytes": sum(c["bytes_sent"] + c["bytes_received"] for c in calls), "simulated_latency": round(sum(c["latency"] for c in calls), 4),
+                "ops": _count(f"{c['op']}" for c in calls)}
+
+def _size(obj):
+    return 0 if obj is None else len(json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8'))
+
+def _count(items):
+    out = {}
+    for i in items: out[i] = out.get(i, 0) + 1
+    return out
+
+def _cell(v):
+    # 與試算表顯示值相同：數字 2600.0 → '2600'
+    if isinstance(v, bool): return str(v).upper()
+    if isinstance(v, (int, float)):
+        v = float(v); return str(int(v)) if v.is_integer() else str(v)
+    return '' if v is None else str(v)
+
+def _api_error(code, message, status="INVALID_ARGUMENT"):
+    # 與 Sheets API 相同的錯誤回應 (gspread 由 response.json() 解析)
+    resp = requests.Response(); resp.status_code = code
+    resp._content = json.dumps({"error": {"code": code, "message": message, "status": status}}).encode('utf-8')
+    return gspread.exceptions.APIError(resp)
+
+def _title(a1):
+    return a1.split('!')[0].strip("'")
+
+def _grid(a1):
+    g = a1_range_to_grid_range(a1.split('!')[-1].replace("'", ""))
+    return g.get('startRowIndex', 0), g.get('endRowIndex'), g.get('startColumnIndex', 0), g.get('endColumnIndex')
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, sheet_id):
+        self.spreadsheet = spreadsheet; self.title = title; self.id = sheet_id; self.rows = []
+
+    def _log(self, op, payload, result): return self.spreadsheet.log.record(self.title, op, payload, result)
+
+    def _trimmed(self):
+        while self.rows and not any(self.rows[-1]): self.rows.pop()
+        width = max((len(r) for r in self.rows), default=0)
+        return [r + [''] * (width - len(r)) for r in self.rows]
+
+    def _read(self, a1):
+        r0, r1, c0, c1 = _grid(a1)
+        out = [r[c0:c1] for r in self._trimmed()[r0:r1]]
+        while out and not any(out[-1]): out.pop()
+        return out
+
+    def _write(self, a1, values):
+        r0, _, c0, _ = _grid(a1)
+        for i, row in enumerate(values):
+            while len(self.rows) <= r0 + i: self.rows.append([])
+            target = self.rows[r0 + i]
+            if len(target) < c0 + len(row): target.extend([''] * (c0 + len(row) - len(target)))
+            for j, v in enumerate(row): target[c0 + j] = _cell(v)
+
+    def get_all_values(self, **kw):
+        return self._log("get_all_values", None, [list(r) for r in self._trimmed()])
+
+    def get_values(self, range_name=None, **kw):
+        return self._log("get_values", range_name, self._read(range_name) if range_name else [list(r) for r in self._trimmed()])
+
+    def acell(self, label, **kw):
+        value = (self._read(label) or [['']])[0]
+        self._log("acell", label, value)
+        return gspread.cell.Cell(*a1_to_rowcol(label), value=value[0] if value and value[0] != '' else None)
+
+    def update(self, values=None, range_name=None, **kw):
+        self._write(range_name or "A1", values); return self._log("update", values, {})
+
+    def batch_update(self, data, **kw):
+        for d in data: self._write(d["range"], d["values"])
+        return self._log("batch_update", data, {})
+
+    def append_rows(self, values, table_range=None, **kw):
+        # table_range：與試算表相同，由該列往下找到表格結尾後寫入；未指定時接在最後一列之後
+        rows = self._trimmed(); start = len(rows) + 1
+        if table_range:
+            start = a1_to_rowcol(table_range)[0]
+            while start <= len(rows) and any(rows[start - 1]): start += 1
+        self.rows = rows
+        self._write(f"A{start}", values)
+        res = {"updates": {"updatedRange": f"'{self.title}'!A{start}:{gspread.utils.rowcol_to_a1(start + len(values) - 1, max((len(r) for r in values), default=1))}", "updatedRows": len(values)}}
+        return self._log("append_rows", values, res)
+
+    def clear(self):
+        self.rows = []; return self._log("clear", None, {})
+
+class FakeSpreadsheet:
+    def __init__(self, log):
+        self.log = log; self.sheets = {}; self.next_id = 1
+
+    def worksheet(self, title):
+        self.log.record(title, "worksheet", None, None)
+        if title not in self.sheets: raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows=100, cols=20, **kw):
+        self.log.record(title, "add_worksheet", None, None)
+        return self.seed(title, [])
+
+    def seed(self, title, rows):
+        # 不記錄呼叫：直接放入初始資料
+        ws = self.sheets.get(title) or FakeWorksheet(self, title, self.next_id)
+        if title not in self.sheets: self.sheets[title] = ws; self.next_id += 1
+        ws.rows = [[_cell(v) for v in r] for r in rows]
+        return ws
+
+    def _sheet_of(self, a1):
+        return self.sheets[_title(a1)]
+
+    def _check_ranges(self, op, ranges, payload):
+        # 範圍所在的工作表不存在：與 API 相同，整批以 400 "Unable to parse range" 失敗 (仍計入一次呼叫)
+        missing = [r for r in ranges if _title(r) not in self.sheets]
+        if missing:
+            self.log.record("*", op, payload, None)
+            raise _api_error(400, f"Unable to parse range: {missing[0]}")
+
+    def values_batch_get(self, ranges, params=None, **kw):
+        self._check_ranges("values_batch_get", ranges, ranges)
+        res = {"valueRanges": [{"range": r, "values": self._sheet_of(r)._read(r)} for r in ranges]}
+        return self.log.record("*", "values_batch_get", ranges, res)
+
+    def values_batch_update(self, body=None, **kw):
+        self._check_ranges("values_batch_update", [d["range"] for d in body["data"]], body)
+        for d in body["data"]: self._sheet_of(d["range"])._write(d["range"], d["values"])
+        return self.log.record("*", "values_batch_update", body, {})
+
+    def batch_update(self, body, **kw):
+        for req in body.get("requests", []):
+            rng = req.get("deleteDimension", {}).get("range")
+            if rng and rng.get("dimension") == "ROWS":
+                ws = next(w for w in self.sheets.values() if w.id == rng["sheetId"])
+                del ws.rows[rng["startIndex"]:rng["endIndex"]]
+        return self.log.record("*", "batch_update", body, {})
+
+class FakeClient:
+    def __init__(self, log=None):
+        self.log = log or CallLog(); self.spreadsheet = FakeSpreadsheet(self.log)
+
+    def open(self, title):
+        self.log.record("*", "open", title, None); return self.spreadsheet
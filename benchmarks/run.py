@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import platform
+from datetime import datetime
+
+# ==========================================
+# 離線效能測試：假 gspread + 合成資料，輸出 JSON
+# ==========================================
+# 用法：python -m benchmarks.run [--sizes 1000,10000,100000] [--backend sheets|sqlite] [--latency-ms 80] [--out bench.json]
+# 必須在匯入 storage/core 之前設定：日誌、備份與 SQLite 放在暫存目錄；背景上傳只在明確 flush 時執行
+WORK = tempfile.mkdtemp(prefix="bench_")
+os.environ["WRITE_JOURNAL"] = os.path.join(WORK, "pending_rows.db")
+os.environ["BACKUP_DIR"] = os.path.join(WORK, "backups")
+os.environ["FLUSH_BATCH"] = "1000000"; os.environ["FLUSH_INTERVAL"] = "1e9"
+
+import pandas as pd
+import streamlit.logger
+import storage
+import core
+import reports
+from benchmarks.fake_gspread import CallLog, FakeClient
+from benchmarks.synth import generate
+
+streamlit.logger.set_log_level("error")   # 不在 streamlit run 下執行的警告
+
+def use_client(client):
+    # 以假 client 取代 Google 連線，並清掉上一輪的工作表/後端快取
+    fake = lambda: client
+    fake.clear = lambda: None
+    storage.get_google_client = fake
+    storage.reset_sheet_handles(); storage._make_backend.clear()
+
+def run_size(size, backend, projects, log):
+    results = []
+    def measure(op, fn):
+        mark = log.mark(); t0 = time.perf_counter()
+        out = fn()
+        results.append({"rows": size, "op": op, "seconds": round(time.perf_counter() - t0, 5), **log.since(mark)})
+        if isinstance(out, pd.DataFrame): results[-1]["result_rows"] = len(out)
+        return out
+
+    rows, settings, prices = generate(size, projects)
+    client = FakeClient(log); use_client(client)
+    storage.STORAGE_BACKEND = backend
+    storage.SQLITE_FILE = os.path.join(WORK, f"bench_{size}.db")
+    storage.SNAPSHOT_DIR = os.path.join(WORK, f"snapshots_{size}")
+    sh = client.spreadsheet
+    if backend == "sheets":
+        sh.seed(storage.LEGACY_SHEET, rows)
+        sh.seed("settings", [[json.dumps(settings, ensure_ascii=False)]]); sh.seed("item_prices", [[json.dumps(prices, ensure_ascii=False)]])
+        measure("partition_legacy", storage.partition_legacy_sheet)
+    else:
+        b = storage.get_backend()
+        b.save_settings(settings); b.save_prices(prices)
+        recs = [dict(zip(rows[0], r), _id=storage.new_row_id()) for r in rows[1:]]
+        measure("seed_insert", lambda: b.insert_records(recs))
+
+    project = settings["projects"][0]
+    if backend == "sheets":
+        # 第一次啟動：設定/單價的正規化工作表尚未建立，批次讀取回應 400 後改為平行讀取 (並將舊版整包 JSON 轉成正規化列)
+        storage._make_backend.clear()
+        measure("startup_batch_first_run", core.load_startup)
+    # 之後的啟動讀取：逐一讀取 (設定 → 單價 → 分區清單) 與一次批次讀取，各自從新的後端開始
+    storage._make_backend.clear()
+    measure("startup_sequential", lambda: (core.load_settings_from_cloud(), core.load_prices_from_cloud(), core.list_months(project)))
+    storage._make_backend.clear()
+    stg, prc, _ = measure("startup_batch", core.load_startup)
+    months = measure("list_months", lambda: core.list_months(project))
+    month = months[len(months) // 2]; year_months = [m for m in months if m[:4] == month[:4]]
+    month_df = measure("load_data_month_cold", lambda: core.load_data(project, [month]))
+    measure("load_data_month_warm", lambda: core.load_data(project, [month]))
+    measure("load_data_all", lambda: core.load_data())
+    if backend == "sheets":
+        # 程序重啟：本機快照 + 分區清單 (快照由上面的讀取寫入)
+        storage._make_backend.clear()
+        measure("load_data_all_from_snapshot", lambda: core.load_data())
+    measure("tab2_section_frames", lambda: reports.section_frames(month_df, "整個月", "", month))
+    measure("tab2_section_frames_search", lambda: reports.section_frames(month_df, "整個月", "粗工", month))
+    measure("search_project_cold", lambda: core.search_project(project, "粗工"))
+    measure("search_project_warm", lambda: core.search_project(project, "粗工"))
+    measure("tab3_cube_cold", lambda: core.load_cube(project, year_months))
+    cube = measure("tab3_cube_warm", lambda: core.load_cube(project, year_months))
+    measure("tab3_summary", lambda: reports.dashboard_summary(cube, f"{month}-15", month, year_months))
+
+    edited = storage.editable_frame(month_df); idx = edited.index[:20]
+    edited.loc[idx, '數量'] = edited.loc[idx, '數量'] + 1; edited.loc[idx, '總價'] = edited.loc[idx, '數量'] * edited.loc[idx, '單價']
+    measure("save_dataframe_20_edits", lambda: core.save_dataframe(edited, base=month_df))
+    measure("append_data_x20", lambda: [core.append_data(f"{month}-10", project, "工種 (人力)", "cost", "粗工", "工", 1, 2500, f"bench {i}") for i in range(20)])
+    queue = getattr(storage.get_backend(), "queue", None)
+    if queue is not None: measure("append_flush", queue.flush)
+    measure("update_item_name", lambda: core.update_item_name(project, "機具 (設備)", "山貓", "山貓 (改)", stg, prc))
+    # 細項整表編輯：整個類別調價 + 一個改名，一次儲存
+    table = core.item_table(stg["items"][project]["工種 (人力)"], prc.get(project, {}).get("工種 (人力)", {}))
+    table["單價"] = table["單價"] * 1.05; table.loc[0, "名稱"] = table.loc[0, "名稱"] + " (改)"
+    measure("save_item_table_reprice", lambda: core.save_item_table(project, "工種 (人力)", "cost", table, stg, prc))
+    if backend == "sheets":
+        # 另一個程序 (新的後端)：彙總分區已建立並經上面的寫入增量更新，只讀取分區清單與要求的月份
+        measure("tab3_cube_restart", lambda: storage.GoogleSheetsBackend().load_cube(project, year_months))
+    measure("create_zip_backup_cold", core.create_zip_backup)
+    measure("create_zip_backup_cached", core.create_zip_backup)
+    # 整月施工日報 (預設：天數少於 EXPORT_POOL_MIN 時本行程產生)；資料的整年：強制子行程平行產生 vs 本行程逐日產生 (刪掉每次的輸出，避免沿用快取)
+    first, last = pd.Period(month).start_time.date(), pd.Period(month).end_time.date()
+    out = measure("export_daily_reports_month", lambda: core.export_daily_reports(project, first, last, stg["cat_config"]))
+    if out: os.remove(out)
+    first, last = pd.Period(min(year_months)).start_time.date(), pd.Period(max(year_months)).end_time.date()
+    pool_min = core.EXPORT_POOL_MIN; core.EXPORT_POOL_MIN = 0
+    out = measure("export_daily_reports_year_pool", lambda: core.export_daily_reports(project, first, last, stg["cat_config"]))
+    if out: os.remove(out)
+    core.EXPORT_POOL_MIN = pool_min; workers = core.EXPORT_WORKERS; core.EXPORT_WORKERS = 1
+    measure("export_daily_reports_year_serial", lambda: core.export_daily_reports(project, first, last, stg["cat_config"]))
+    core.EXPORT_WORKERS = workers
+    return results
+
+def main():
+    ap = argparse.ArgumentParser(description="離線效能測試 (假 gspread + 合成資料)")
+    ap.add_argument("--sizes", default="1000,10000,100000")
+    ap.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    ap.add_argument("--projects", type=int, default=3)
+    ap.add_argument("--latency-ms", type=float, default=80.0, help="每次 API 呼叫的模擬延遲")
+    ap.add_argument("--bandwidth", type=float, default=1_000_000, help="模擬頻寬 (bytes/秒)")
+    ap.add_argument("--sleep", action="store_true", help="實際等待模擬延遲 (預設只記錄)")
+    ap.add_argument("--out", default="", help="輸出檔 (預設印到 stdout)")
+    args = ap.parse_args()
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        log = CallLog(args.latency_ms, args.bandwidth, args.sleep)
+        results += run_size(size, args.backend, args.projects, log)
+        print(f"{size} 筆完成", file=sys.stderr)
+    report = {"meta": {"time": datetime.now().isoformat(timespec="seconds"), "backend": args.backend, "projects": args.projects, "latency_ms": args.latency_ms,
+                       "bandwidth": args.bandwidth, "python": platform.python_version(), "pandas": pd.__version__}, "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text + "\n")
+    else: print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import copy
+import math
+import random
+from datetime import date, timedelta
+from core import DEFAULT_CAT_CONFIG, DEFAULT_ITEMS
+
+# ==========================================
+# 合成工地資料：N 專案 × M 天，依 DEFAULT_CAT_CONFIG 的類別產生紀錄
+# ==========================================
+UNIT_PRICE = {"工種 (人力)": (2200, 3500), "機具 (設備)": (3000, 15000)}
+NOTES = ["", "", "", "上午", "下午", "趕工", "補料", "依監造指示", "雨後復工", "夜間作業"]
+PER_DAY = {"text": 1, "usage": 1, "cost": 2}   # 每專案每天各類型的筆數
+
+def rows_per_day():
+    return sum(PER_DAY[c["type"]] for c in DEFAULT_CAT_CONFIG)
+
+def day_records(rng, project, day):
+    out = []
+    for conf in DEFAULT_CAT_CONFIG:
+        items = DEFAULT_ITEMS.get(conf["key"], ["項目"])
+        for name in rng.sample(items, min(PER_DAY[conf["type"]], len(items))):
+            qty, price, unit = 1, 0, "式"
+            if conf["type"] == "cost":
+                qty = rng.choice([0.5, 1, 1, 2, 3, 4]); price = rng.randrange(*UNIT_PRICE.get(conf["key"], (1000, 5000)), 100)
+                unit = "工" if "人力" in conf["key"] else "天"
+            elif conf["type"] == "usage": qty, unit = round(rng.uniform(1, 30), 1), "m3"
+            note = f"{name}：{rng.choice(NOTES)}" if conf["type"] == "text" else rng.choice(NOTES)
+            out.append([day.isoformat(), project, conf["key"], name, unit, qty, price, qty * price if conf["type"] == "cost" else 0, note])
+    return out
+
+def generate(rows, projects=3, start=date(2023, 1, 2), seed=0):
+    # 回傳 (sheet1 列 [含標題], 設定, 單價)；逐日輪流各專案，取前 rows 筆
+    rng = random.Random(seed)
+    names = [f"{i + 1:02d}.測試專案{chr(65 + i % 26)}" for i in range(projects)]
+    days = math.ceil(rows / (projects * rows_per_day()))
+    data = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for p in names: data += day_records(rng, p, day)
+    settings = {"projects": names, "items": {p: copy.deepcopy(DEFAULT_ITEMS) for p in names}, "cat_config": copy.deepcopy(DEFAULT_CAT_CONFIG)}
+    prices = {p: {c["key"]: {it: {"price": rng.randrange(*UNIT_PRICE[c["key"]], 100), "unit": "工" if "人力" in c["key"] else "天"} for it in DEFAULT_ITEMS[c["key"]]}
+                  for c in DEFAULT_CAT_CONFIG if c["type"] == "cost"} for p in names}
+    return [['日期', '專案', '類別', '名稱', '單位', '數量', '單價', '總價', '備註']] + data[:rows], settings, prices
@@ -0,0 +1,385 @@
+import streamlit as st
+import pandas as pd
+import json
+import copy
+import zipfile
+import os
+import hashlib
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from storage import get_backend, diff_frames, row_snapshot, new_row_id, empty_frame, SheetUnavailable
+from profiling import profiled
+from daily_report import render_day
+
+# ==========================================
+# 核心邏輯：預設值、雲端存取與備份 (app.py 與 benchmarks 共用)
+# ==========================================
+# --- 台灣例假日 ---
+HOLIDAYS = {
+    "2025-01-01": "元旦", "2025-01-27": "小年夜", "2025-01-28": "除夕", "2025-01-29": "春節", "2025-01-30": "初二", "2025-01-31": "初三",
+    "2025-02-28": "和平紀念日", "2025-04-04": "兒童節/清明節", "2025-05-01": "勞動節", "2025-05-31": "端午節",
+    "2025-10-06": "中秋節", "2025-10-10": "國慶日",
+    "2026-01-01": "元旦", "2026-02-16": "小年夜", "2026-02-17": "除夕", "2026-02-18": "春節",
+    "2026-02-28": "和平紀念日", "2026-04-04": "兒童節", "2026-04-05": "清明節", "2026-05-01": "勞動節",
+    "2026-06-19": "端午節", "2026-09-25": "中秋節", "2026-10-10": "國慶日"
+}
+
+# --- 預設值 ---
+DEFAULT_CAT_CONFIG = [
+    {"key": "施工說明", "display": "01. 施工說明", "type": "text"},
+    {"key": "相關紀錄", "display": "02. 相關紀錄", "type": "text"},
+    {"key": "進料管理", "display": "03. 進料管理", "type": "text"},
+    {"key": "用料管理", "display": "04. 用料管理", "type": "usage"},
+    {"key": "工種 (人力)", "display": "05. 工種 (人力)", "type": "cost"},
+    {"key": "機具 (設備)", "display": "06. 機具 (設備)", "type": "cost"}
+]
+
+DEFAULT_ITEMS = {
+    "施工說明": ["正常施工", "暫停施工", "收尾階段", "驗收缺失改善", "天候不佳"],
+    "相關紀錄": ["本日會議", "主管走動", "重要事件紀錄", "工安事項", "會勘紀錄"],
+    "進料管理": ["鋼筋進場", "水泥進場", "磁磚進場", "設備進場", "其他材料"],
+    "用料管理": ["混凝土 3000psi", "混凝土 2500psi", "CLSM", "級配", "水泥砂漿"],
+    "工種 (人力)": ["粗工", "泥作", "水電", "油漆", "木工", "鐵工", "板模", "綁鐵", "打石", "清潔"],
+    "機具 (設備)": ["挖土機 (怪手)", "山貓", "吊車", "發電機", "空壓機", "破碎機", "夯實機", "貨車"]
+}
+
+# --- 備份 / 還原 ---
+BACKUP_DIR = os.environ.get("BACKUP_DIR", os.path.join(tempfile.gettempdir(), "construction_backups"))
+BACKUP_KEEP = 3          # 保留最近幾份備份檔
+BACKUP_CHUNK = 2000      # 匯出時每批寫入的列數
+RESTORE_CHUNK = 500      # 還原時每批送出的列數
+
+# --- 施工日報批次匯出 ---
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", str(min(4, os.cpu_count() or 1))))   # 產生活頁簿的子行程數
+EXPORT_POOL_MIN = int(os.environ.get("EXPORT_POOL_MIN", "90"))   # 天數少於此值時直接在本行程產生 (spawn 子行程重新匯入 core 約 2 秒、每天約 30 毫秒：4 個子行程約一季以上才划算)
+
+def get_date_info(date_obj):
+    weekdays = ["(週一)", "(週二)", "(週三)", "(週四)", "(週五)", "(週六)", "(週日)"]
+    date_str = date_obj.strftime("%Y-%m-%d")
+    w_str = weekdays[date_obj.weekday()]
+    if date_str in HOLIDAYS: return f"🔴 {w_str} ★{HOLIDAYS[date_str]}", True 
+    return (f"🔴 {w_str}", True) if date_obj.weekday() >= 5 else (f"{w_str}", False)
+
+# --- 雲端設定存取函數 (經由儲存後端) ---
+def default_settings():
+    return {"projects": ["預設專案"], "items": {"預設專案": copy.deepcopy(DEFAULT_ITEMS)}, "cat_config": copy.deepcopy(DEFAULT_CAT_CONFIG)}
+
+def stop_on_read_error(what, e):
+    # 讀取失敗 (配額用盡、網路中斷…) 不可當成沒有資料：顯示原因並停止本次執行，避免空白/預設值之後被存回雲端
+    st.error(f"⚠️ {what}失敗，請稍後重新整理：{e}"); st.stop()
+    raise e   # 不在 Streamlit 執行環境 (benchmarks) 時 st.stop() 不會中斷
+
+@profiled("load_startup")
+def load_startup():
+    # 登入後一次取得設定與單價 (試算表後端連同分區清單只需一次 values_batch_get)；回傳 (設定, 單價, {步驟: 秒})
+    t0 = time.perf_counter()
+    try: settings, prices, timings = get_backend().load_startup()
+    except SheetUnavailable: settings, prices, timings = None, None, {}   # 未設定雲端：以預設值啟動 (存檔同樣略過)
+    except Exception as e: stop_on_read_error("讀取設定與單價", e)
+    timings['合計'] = round(time.perf_counter() - t0, 4)
+    return settings or default_settings(), prices or {}, timings
+
+@profiled("load_settings_from_cloud")
+def load_settings_from_cloud():
+    try: return get_backend().load_settings() or default_settings()
+    except SheetUnavailable: return default_settings()
+    except Exception as e: stop_on_read_error("讀取設定", e)
+
+@profiled("save_settings_to_cloud")
+def save_settings_to_cloud(data):
+    # 同步更新 session_state
+    st.session_state.settings_data = data
+    try: get_backend().save_settings(data)
+    except SheetUnavailable: pass
+    except Exception as e:
+        st.error(f"雲端存檔錯誤: {e}")
+
+@profiled("load_prices_from_cloud")
+def load_prices_from_cloud():
+    try: return get_backend().load_prices() or {}
+    except SheetUnavailable: return {}
+    except Exception as e: stop_on_read_error("讀取單價", e)
+
+@profiled("save_prices_to_cloud")
+def save_prices_to_cloud(data):
+    # 同步更新 session_state
+    st.session_state.price_data = data
+    try: get_backend().save_prices(data)
+    except SheetUnavailable: pass
+    except Exception as e:
+        st.error(f"雲端存檔錯誤: {e}")
+
+@profiled("load_data")
+def load_data(project=None, months=None):
+    # 只載入指定專案/月份 (SQLite 依索引查詢；試算表由共用快取篩選)
+    try: return get_backend().load_records(project, months)
+    except SheetUnavailable: return empty_frame()
+    except Exception as e: stop_on_read_error("讀取紀錄", e)
+
+@profiled("save_dataframe")
+def save_dataframe(df, base=None):
+    # base: 編輯前的快照 (預設為目前資料集)；只寫入兩者的差異
+    # 以編輯前的列版本為條件寫入：他人已改過同一欄的列不寫入，回傳衝突清單由畫面詢問
+    if base is None: base = load_data()
+    df_save = df.drop(columns=[c for c in ['月份', '刪除', 'temp_month', '星期/節日', '🗓️ 星期/節日'] if c in df.columns])
+    try:
+        updates, deletes, inserts = diff_frames(base, df_save)
+        return get_backend().apply_changes(updates, deletes, inserts, base=row_snapshot(base, set(updates) | set(deletes)))
+    except SheetUnavailable: return []
+    except Exception as e:
+        st.error(f"雲端存檔失敗: {e}"); get_backend().invalidate(); return []
+
+def overwrite_conflicts(conflicts):
+    # 使用者確認以自己的修改為準：不帶版本條件重寫 (已被他人刪除的列無法修改，略過)
+    updates = {c['_id']: c['修改'] for c in conflicts if c['修改'] is not None}
+    deletes = [c['_id'] for c in conflicts if c['修改'] is None]
+    try: get_backend().apply_changes(updates, deletes, [])
+    except SheetUnavailable: pass
+    except Exception as e:
+        st.error(f"雲端存檔失敗: {e}"); get_backend().invalidate()
+
+@profiled("search_project")
+def search_project(project, query):
+    # 整個專案 (跨月份) 的名稱/備註關鍵字搜尋
+    try: return get_backend().search_records(project, query)
+    except SheetUnavailable: return empty_frame()
+    except Exception as e: stop_on_read_error("搜尋", e)
+
+@profiled("list_months")
+def list_months(project):
+    try: return get_backend().list_months(project)
+    except SheetUnavailable: return []
+    except Exception as e: stop_on_read_error("讀取月份清單", e)
+
+@profiled("load_cube")
+def load_cube(project, months=None):
+    # 成本彙總 (專案 × 日期 × 類別 × 名稱)，隨新增/編輯增量更新
+    try: return get_backend().load_cube(project, months)
+    except SheetUnavailable: return pd.DataFrame(columns=['專案', '日期', '類別', '名稱', '總價', '數量', '筆數', '月份'])
+    except Exception as e: stop_on_read_error("讀取成本彙總", e)
+
+@profiled("append_data")
+def append_data(date, project, category, category_type, name, unit, qty, price, note):
+    total = qty * price if category_type == 'cost' else 0
+    rec = {'日期': str(date), '專案': project, '類別': category, '名稱': name, '單位': unit, '數量': qty, '單價': price, '總價': total, '備註': note, '_id': new_row_id()}
+    get_backend().append_records([rec])
+
+# --- 整日批次輸入 ---
+def previous_working_day(date):
+    # 往前找第一個不是週末、也不在 HOLIDAYS 的日期
+    date = date - timedelta(days=1)
+    while date.weekday() >= 5 or date.strftime("%Y-%m-%d") in HOLIDAYS: date -= timedelta(days=1)
+    return date
+
+def category_kind(conf):
+    # 紀錄的欄位型態：進料/用料 (顯示名稱 03./04.，與報表總覽的欄位規則相同) 即使類型為 text 也記錄數量與單位
+    if conf.get("type", "text") == 'text' and str(conf.get("display", "")).startswith(("03.", "04.")): return 'usage'
+    return conf.get("type", "text")
+
+def day_entry_frame(project, cat_list, items, prices, copy_from=None):
+    # 每個類別/項目一列，單位與單價取自單價設定；copy_from 有值時帶入該日的數量、單位、單價與備註 (同項目多筆時數量加總)
+    prev = {}
+    if copy_from is not None:
+        df = load_data(project, [copy_from.strftime("%Y-%m")])
+        for r in df[df['日期'] == pd.Timestamp(copy_from)].to_dict('records'):
+            p = prev.setdefault((r['類別'], r['名稱']), {'數量': 0.0, '單位': r['單位'], '單價': r['單價'], '備註': []})
+            p['數量'] += float(r['數量']); p['單位'] = r['單位']; p['單價'] = r['單價']
+            if r['備註']: p['備註'].append(r['備註'])
+    rows = []
+    for conf in cat_list:
+        kind = category_kind(conf); names = list(items.get(conf["key"], []))
+        names += [n for c, n in prev if c == conf["key"] and n not in names]   # 前一日有、但已從選單移除的項目
+        for name in names:
+            p_set = prices.get(conf["key"], {}).get(name, {}); old = prev.get((conf["key"], name))
+            rows.append({"類別": conf["display"], "名稱": name,
+                         "數量": 0.0 if kind == 'text' or not old else old['數量'],
+                         "單位": old['單位'] if old else p_set.get("unit", "式"),
+                         "單價": float(old['單價'] if old else p_set.get("price", 0)) if kind == 'cost' else 0.0,
+                         "備註": "；".join(old['備註']) if old else "", "_key": conf["key"], "_type": kind})
+    return pd.DataFrame(rows, columns=["類別", "名稱", "數量", "單位", "單價", "備註", "_key", "_type"])
+
+@profiled("append_day")
+def append_day(date, project, grid):
+    # 有填數量或備註 (文字類別為有填內容) 的列組成紀錄，一次批次寫入；回傳筆數
+    recs = []
+    for r in grid.to_dict('records'):
+        qty = 0.0 if pd.isna(r["數量"]) else float(r["數量"]); price = 0.0 if pd.isna(r["單價"]) else float(r["單價"])
+        note = "" if pd.isna(r["備註"]) else str(r["備註"]).strip()
+        if r["_type"] == 'text':
+            if not note: continue
+            qty, price = 1, 0
+        elif qty <= 0 and not note: continue
+        if r["_type"] != 'cost': price = 0
+        recs.append({'日期': str(date), '專案': project, '類別': r["_key"], '名稱': r["名稱"], '單位': "" if pd.isna(r["單位"]) else r["單位"],
+                     '數量': qty, '單價': price, '總價': qty * price, '備註': note, '_id': new_row_id()})
+    if recs: get_backend().append_records(recs)
+    return len(recs)
+
+# 修正：更新項目名稱時同時更新雲端設定
+@profiled("update_item_name")
+def update_item_name(project, category, old_name, new_name, settings, prices):
+    if old_name == new_name: return False
+    curr_list = settings["items"][project].get(category, [])
+    if new_name in curr_list: return False 
+    if old_name in curr_list: curr_list[curr_list.index(old_name)] = new_name
+    if project in prices and category in prices[project] and old_name in prices[project][category]:
+        prices[project][category][new_name] = prices[project][category].pop(old_name)
+    # 紀錄、設定與單價的名稱由後端一次寫入 (試算表：只改受影響的儲存格)
+    st.session_state.settings_data = settings; st.session_state.price_data = prices
+    try: get_backend().rename_item(project, category, old_name, new_name)
+    except SheetUnavailable: pass
+    except Exception as e:
+        st.error(f"雲端存檔失敗: {e}"); get_backend().invalidate()
+    return True
+
+# --- 細項內容整表編輯 (名稱 / 單價 / 單位) ---
+def item_table(items, cat_prices):
+    # 類別的項目清單 → 編輯用表格；_原名稱 供儲存時辨識改名、刪除與新增的列
+    rows = [{"名稱": n, "單價": float(cat_prices.get(n, {}).get("price", 0)), "單位": cat_prices.get(n, {}).get("unit", "式"), "_原名稱": n} for n in items]
+    return pd.DataFrame(rows, columns=["名稱", "單價", "單位", "_原名稱"])
+
+def check_item_table(table, items):
+    # 整表檢查，回傳 (錯誤訊息清單, [(名稱, 單價, 單位, 原名稱)])；有錯誤時不寫入任何變更
+    errors = []; rows = []
+    for i, r in enumerate(table.to_dict('records'), 1):
+        name = "" if pd.isna(r["名稱"]) else str(r["名稱"]).strip()
+        orig = "" if pd.isna(r["_原名稱"]) else str(r["_原名稱"])
+        unit = "式" if pd.isna(r["單位"]) or not str(r["單位"]).strip() else str(r["單位"]).strip()
+        try: price = 0.0 if pd.isna(r["單價"]) else float(r["單價"])
+        except (TypeError, ValueError): price = -1.0
+        if not name: errors.append(f"第 {i} 列：名稱不可空白"); continue
+        if price < 0: errors.append(f"第 {i} 列「{name}」：單價需為 0 以上的數字")
+        rows.append((name, price, unit, orig))
+    names = [r[0] for r in rows]
+    errors += [f"名稱重複：{n}" for n in sorted({n for n in names if names.count(n) > 1})]
+    # 改成其他項目原本的名稱會合併兩者的紀錄 (互換/串接亦同)，需分次儲存
+    errors += [f"「{o}」不可改名為既有項目「{n}」" for n, _, _, o in rows if o and n != o and n in items]
+    return errors, rows
+
+@profiled("save_item_table")
+def save_item_table(project, category, category_type, table, settings, prices):
+    # 改名、單價/單位修改、新增與刪除一次套用：紀錄的改名由後端一次批次處理，設定與單價再一次批次寫入；回傳錯誤訊息清單
+    items = settings["items"][project].get(category, [])
+    errors, rows = check_item_table(table, items)
+    if errors: return errors
+    renames = {o: n for n, _, _, o in rows if o and o != n}
+    old_prices = prices.get(project, {}).get(category, {})
+    settings["items"][project][category] = [n for n, _, _, _ in rows]
+    if category_type == 'text': cat_prices = {n: old_prices[o] for n, _, _, o in rows if o in old_prices}
+    else: cat_prices = {n: {"price": p if category_type == 'cost' else 0, "unit": u} for n, p, u, _ in rows}
+    prices.setdefault(project, {})[category] = cat_prices
+    st.session_state.settings_data = settings; st.session_state.price_data = prices
+    try:
+        if renames: get_backend().rename_items(project, category, renames)
+        get_backend().save_catalog(settings, prices)
+    except SheetUnavailable: pass
+    except Exception as e:
+        st.error(f"雲端存檔失敗: {e}"); get_backend().invalidate()
+    return []
+
+def update_category_config(idx, new_display, settings):
+    settings["cat_config"][idx]["display"] = new_display; save_settings_to_cloud(settings); return True
+
+def add_new_category_block(new_key, new_display, new_type, settings):
+    for cat in settings["cat_config"]:
+        if cat["key"] == new_key: return False
+    settings["cat_config"].append({"key": new_key, "display": new_display, "type": new_type})
+    for proj in settings["items"]:
+        if new_key not in settings["items"][proj]: settings["items"][proj][new_key] = []
+    save_settings_to_cloud(settings); return True
+
+def delete_category_block(idx, settings):
+    del settings["cat_config"][idx]; save_settings_to_cloud(settings); return True
+
+@profiled("create_zip_backup")
+def create_zip_backup():
+    # 只在按下按鈕時建立；以資料版本 + 設定/單價內容的雜湊命名，版本未變就直接沿用同一檔案
+    backend = get_backend()
+    stg = load_settings_from_cloud()
+    prc = load_prices_from_cloud()
+    version = hashlib.sha1(json.dumps([backend.data_version(), stg, prc], ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:16]
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    path = os.path.join(BACKUP_DIR, f"backup_{version}.zip")
+    if os.path.exists(path): return path
+    tmp = f"{path}.{new_row_id()}.tmp"
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        # 紀錄逐批寫入壓縮串流，不在記憶體中組出整份 CSV
+        with zip_file.open("construction_data.csv", "w", force_zip64=True) as f:
+            header = True
+            for chunk in backend.iter_records(BACKUP_CHUNK):
+                f.write(chunk.reindex(columns=empty_frame().columns).to_csv(index=False, header=header).encode('utf-8')); header = False
+            if header: f.write(empty_frame().to_csv(index=False).encode('utf-8'))
+        zip_file.writestr("settings.json", json.dumps(stg, ensure_ascii=False, indent=4))
+        zip_file.writestr("item_prices.json", json.dumps(prc, ensure_ascii=False, indent=4))
+    os.replace(tmp, path); prune_exports("backup_")
+    return path
+
+def prune_exports(prefix):
+    olds = sorted((os.path.join(BACKUP_DIR, n) for n in os.listdir(BACKUP_DIR) if n.startswith(prefix) and n.endswith(".zip")), key=os.path.getmtime, reverse=True)
+    for old in olds[BACKUP_KEEP:]:
+        try: os.remove(old)
+        except: pass
+
+def daily_report_payloads(project, start, end, cat_config):
+    # 一次載入期間內各月份的紀錄，依日期分組成每日報表的內容 (類別依選單順序；沒有紀錄的日期不產生)
+    months = [str(m) for m in pd.period_range(start, end, freq='M')]
+    df = load_data(project, months)
+    df = df[(df['日期'] >= pd.Timestamp(start)) & (df['日期'] <= pd.Timestamp(end))]
+    conf = {c["key"]: c for c in cat_config}
+    for day, day_df in df.groupby('日期', sort=True):
+        groups = dict(tuple(day_df.groupby('類別', sort=False, observed=True)))
+        keys = [c["key"] for c in cat_config if c["key"] in groups] + [k for k in groups if k not in conf]   # 已從設定移除的類別排在最後
+        label, holiday = get_date_info(day)
+        yield {"project": project, "date": day.strftime("%Y-%m-%d"), "label": label.replace("🔴", "").strip(), "holiday": holiday,
+               "sections": [{"title": conf[k]["display"] if k in conf else k, "type": category_kind(conf[k]) if k in conf else "cost" if groups[k]['總價'].sum() else "text",
+                             "rows": [[r.名稱, float(r.數量), r.單位, float(r.單價), float(r.總價), r.備註] for r in groups[k].itertuples(index=False)]} for k in keys]}
+
+@profiled("export_daily_reports")
+def export_daily_reports(project, start, end, cat_config, progress=lambda done, total: None):
+    # 期間內每個有紀錄的日期一份施工日報 (xlsx)：子行程平行產生，完成一份即寫入 ZIP (不在記憶體中累積整批)；
+    # 以資料版本 + 條件命名，資料未變就直接沿用同一檔案；期間內沒有紀錄回傳 None
+    payloads = list(daily_report_payloads(project, start, end, cat_config))
+    if not payloads: return None
+    version = hashlib.sha1(json.dumps([get_backend().data_version(), project, str(start), str(end), cat_config], ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:16]
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    path = os.path.join(BACKUP_DIR, f"reports_{version}.zip")
+    if os.path.exists(path): return path
+    tmp = f"{path}.{new_row_id()}.tmp"; pool = None
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zip_file:
+            if len(payloads) < EXPORT_POOL_MIN or EXPORT_WORKERS <= 1: results = map(render_day, payloads)
+            else:
+                # spawn：不複製本行程的執行緒與鎖 (背景上傳佇列、Streamlit 伺服器)
+                pool = ProcessPoolExecutor(EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                results = pool.map(render_day, payloads, chunksize=max(1, len(payloads) // (EXPORT_WORKERS * 4)))
+            for i, (name, data) in enumerate(results, 1):
+                zip_file.writestr(name, data, compress_type=zipfile.ZIP_STORED); progress(i, len(payloads))   # xlsx 本身已壓縮
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    finally:
+        if pool: pool.shutdown(cancel_futures=True)
+    os.replace(tmp, path); prune_exports("reports_")
+    return path
+
+@profiled("restore_records")
+def restore_records(open_csv, progress=lambda frac, done: None):
+    # 分塊讀取備份 CSV：依 _id 只寫入差異、新列批次新增，最後刪除備份中沒有的列
+    backend = get_backend()
+    base = backend.load_records()
+    with open_csv() as f: total = max(sum(1 for _ in f) - 1, 1)
+    seen = set(); projects = set(); done = 0
+    with open_csv() as f:
+        for chunk in pd.read_csv(f, encoding='utf-8-sig', dtype=str, keep_default_na=False, chunksize=RESTORE_CHUNK):
+            chunk = chunk.drop(columns=[c for c in ['月份', '刪除'] if c in chunk.columns])
+            if '_id' in chunk.columns: chunk = chunk[(chunk['_id'] == '') | ~chunk['_id'].isin(seen)]
+            updates, _, inserts = diff_frames(base[base['_id'].isin(chunk['_id'])] if '_id' in chunk.columns else base.iloc[0:0], chunk)
+            backend.apply_changes(updates, [], inserts)
+            if '_id' in chunk.columns: seen.update(chunk['_id'])
+            projects.update(p for p in chunk['專案'] if p); done += len(chunk)
+            progress(min(done / total, 1.0), done)
+    backend.apply_changes({}, [rid for rid in base['_id'] if rid not in seen], [])
+    return done, projects
@@ -0,0 +1,55 @@
+import io
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+# ==========================================
+# 施工日報活頁簿 (批次匯出時在子行程產生；只依賴 openpyxl，子行程不需載入 streamlit/pandas)
+# ==========================================
+COLUMNS = {
+    "text": ["項目", "內容"],
+    "usage": ["項目", "數量", "單位", "備註"],
+    "cost": ["項目", "數量", "單位", "單價", "金額", "備註"],
+}
+FORMATS = {"text": [None, None], "usage": [None, "#,##0.##", None, None], "cost": [None, "#,##0.##", None, "#,##0", "#,##0", None]}
+WIDTHS = {"A": 24, "B": 12, "C": 8, "D": 12, "E": 14, "F": 40}
+THIN = Side(style="thin", color="999999")
+BOX = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+HEAD_FILL = PatternFill("solid", fgColor="DDEBF7")
+TOTAL_FILL = PatternFill("solid", fgColor="F2F2F2")
+WRAP = Alignment(wrap_text=True, vertical="top")
+
+def report_name(payload):
+    return f"{payload['project']}/{payload['date']}_施工日報.xlsx"
+
+def _row(ws, values, formats=(), font=None, fill=None):
+    ws.append(values); r = ws.max_row
+    for j in range(1, len(values) + 1):
+        cell = ws.cell(r, j); cell.border = BOX; cell.alignment = WRAP
+        if j <= len(formats) and formats[j - 1]: cell.number_format = formats[j - 1]
+        if font: cell.font = font
+        if fill: cell.fill = fill
+
+def render_day(payload):
+    # payload: {'project', 'date', 'label' (星期/節日), 'holiday', 'sections': [{'title', 'type', 'rows': [[名稱, 數量, 單位, 單價, 總價, 備註]]}]}
+    # 回傳 (ZIP 內的檔名, xlsx 位元組)
+    wb = Workbook(); ws = wb.active; ws.title = "施工日報"
+    for c, w in WIDTHS.items(): ws.column_dimensions[c].width = w
+    ws.page_setup.orientation = "portrait"; ws.page_setup.fitToWidth = 1; ws.page_setup.fitToHeight = 0
+    ws.sheet_properties.pageSetUpPr.fitToPage = True
+    ws.append([f"{payload['project']} 施工日報"]); ws.cell(1, 1).font = Font(size=16, bold=True)
+    ws.append([f"日期：{payload['date']} {payload['label']}"]); ws.cell(2, 1).font = Font(size=12, color="C00000" if payload['holiday'] else "000000")
+    total = 0.0
+    for sec in payload['sections']:
+        kind = sec['type'] if sec['type'] in COLUMNS else "text"; fmt = FORMATS[kind]
+        ws.append([]); ws.append([sec['title']]); ws.cell(ws.max_row, 1).font = Font(size=12, bold=True)
+        _row(ws, COLUMNS[kind], font=Font(bold=True), fill=HEAD_FILL)
+        subtotal = 0.0
+        for name, qty, unit, price, amount, note in sec['rows']:
+            if kind == "cost": _row(ws, [name, qty, unit, price, amount, note], fmt); subtotal += amount
+            elif kind == "usage": _row(ws, [name, qty, unit, note], fmt)
+            else: _row(ws, [name, note], fmt)
+        if kind == "cost":
+            _row(ws, ["小計", None, None, None, subtotal, None], fmt, font=Font(bold=True), fill=TOTAL_FILL); total += subtotal
+    ws.append([]); _row(ws, ["本日費用合計", None, None, None, total, None], FORMATS["cost"], font=Font(bold=True, size=12), fill=TOTAL_FILL)
+    buf = io.BytesIO(); wb.save(buf)
+    return report_name(payload), buf.getvalue()
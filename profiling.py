@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# ==========================================
+# 效能紀錄 (選用)：每次 rerun 的耗時、Google API 呼叫數/位元組、DataFrame 列數
+# ==========================================
+PROFILE_ALL = os.environ.get("PROFILE", "") == "1"                          # 所有 session 都記錄；否則由管理員在側邊欄開啟
+PROFILE_LOG = os.environ.get("PROFILE_LOG", "profile_log.jsonl")
+PROFILE_LOG_MAX = int(os.environ.get("PROFILE_LOG_MAX", str(5 * 1024 * 1024)))   # bytes；超過即輪替
+PROFILE_LOG_KEEP = int(os.environ.get("PROFILE_LOG_KEEP", "3"))
+
+# 每個 rerun 在自己的執行緒執行：目前的紀錄放在 thread-local，背景上傳執行緒不計入
+_local = threading.local()
+_log_lock = threading.Lock(); _logger = None
+
+class RerunProfile:
+    def __init__(self, session):
+        self.session = session; self.time = datetime.now().isoformat(timespec="seconds")
+        self.start = self.last = time.perf_counter()
+        self.api_calls = 0; self.api_errors = 0; self.bytes_sent = 0; self.bytes_received = 0; self.api_time = 0.0; self.rows = 0
+        self.spans = {}; self.finished = False
+
+    def to_dict(self, interrupted=False):
+        return {"time": self.time, "session": self.session, "wall": round(self.last - self.start, 4), "interrupted": interrupted,
+                "api_calls": self.api_calls, "api_errors": self.api_errors, "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received,
+                "api_time": round(self.api_time, 4), "rows": self.rows, "spans": self.spans}
+
+def current():
+    return getattr(_local, "profile", None)
+
+def start_rerun(session, enabled):
+    _local.profile = RerunProfile(session) if enabled else None
+    return _local.profile
+
+def finish_rerun(profile, interrupted=False):
+    # 寫入 JSONL；被 st.rerun()/st.stop() 中斷的 rerun 由下一次 rerun 補寫 (interrupted=True)
+    if profile is None or profile.finished: return None
+    profile.finished = True
+    if not interrupted: profile.last = time.perf_counter()
+    rec = profile.to_dict(interrupted)
+    try: _get_logger().info(json.dumps(rec, ensure_ascii=False))
+    except: pass
+    return rec
+
+def _get_logger():
+    global _logger
+    with _log_lock:
+        if _logger is None:
+            _logger = logging.getLogger("construction.profile"); _logger.setLevel(logging.INFO); _logger.propagate = False
+            handler = RotatingFileHandler(PROFILE_LOG, maxBytes=PROFILE_LOG_MAX, backupCount=PROFILE_LOG_KEEP, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s")); _logger.addHandler(handler)
+        return _logger
+
+@contextmanager
+def span(name):
+    # 區段耗時 (含內層區段)；同名區段在一次 rerun 中累加
+    p = current()
+    if p is None:
+        yield; return
+    t0 = time.perf_counter(); calls0, bytes0, rows0 = p.api_calls, p.bytes_sent + p.bytes_received, p.rows
+    try: yield
+    finally:
+        p.last = time.perf_counter()
+        s = p.spans.setdefault(name, {"count": 0, "wall": 0.0, "api_calls": 0, "bytes": 0, "rows": 0})
+        s["count"] += 1; s["wall"] = round(s["wall"] + p.last - t0, 4)
+        s["api_calls"] += p.api_calls - calls0; s["bytes"] += p.bytes_sent + p.bytes_received - bytes0; s["rows"] += p.rows - rows0
+
+def profiled(name):
+    # 函式裝飾器：以 span 包住；回傳 DataFrame 時計入列數
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if current() is None: return fn(*args, **kwargs)
+            with span(name):
+                out = fn(*args, **kwargs)
+                if isinstance(out, pd.DataFrame): current().rows += len(out)
+                return out
+        return inner
+    return wrap
+
+def instrument_http(http_client):
+    # 包住 gspread 的 HTTPClient.request：所有 Google API 呼叫 (含 open/worksheet) 都經過這裡
+    orig = http_client.request
+    def request(method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        p = current()
+        if p is None: return orig(method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+        t0 = time.perf_counter()
+        try: resp = orig(method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+        except Exception:
+            p.api_errors += 1; raise
+        finally:
+            p.last = time.perf_counter(); p.api_calls += 1; p.api_time += p.last - t0
+            p.bytes_sent += len(data or b"") + (len(_json_dumps(json)) if json is not None else 0)
+        p.bytes_received += len(resp.content or b"")
+        return resp
+    http_client.request = request
+    return http_client
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+def summary_frame(rec):
+    # 側邊欄顯示用：各區段依耗時排序
+    rows = [{"區段": k, "次數": v["count"], "秒": v["wall"], "API": v["api_calls"], "KB": round(v["bytes"] / 1024, 1), "列數": v["rows"]} for k, v in rec["spans"].items()]
+    return pd.DataFrame(rows, columns=["區段", "次數", "秒", "API", "KB", "列數"]).sort_values("秒", ascending=False)
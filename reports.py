@@ -0,0 +1,53 @@
+import streamlit as st
+import pandas as pd
+from core import get_date_info
+from storage import editable_frame
+
+# ==========================================
+# 報表資料準備 (Tab 2 編輯區 / Tab 3 成本儀表板)
+# ==========================================
+@st.cache_data
+def date_label_table(month):
+    # 整月每日的 星期/節日 標籤；報表以查表對應，不逐列計算
+    days = pd.date_range(f"{month}-01", pd.Period(month).end_time.normalize())
+    return {d: get_date_info(d)[0] for d in days}
+
+def section_frames(month_df, ed_date, search, month):
+    # 日期篩選與關鍵字搜尋一次套用在整月資料，再以 groupby 分到各類別；回傳 ({類別: 資料}, 整月有資料的類別)
+    view_df = month_df
+    if ed_date != "整個月": view_df = view_df[view_df['日期'] == ed_date]
+    for term in search.split():   # 多個關鍵字 (空白分隔) 需全部符合，與跨月搜尋相同
+        view_df = view_df[view_df['名稱'].str.contains(term, case=False, regex=False) | view_df['備註'].str.contains(term, case=False, regex=False)]
+    # 共用資料集唯讀且為 category 欄位，只把篩選後要編輯的列轉回一般欄位
+    view_df = editable_frame(view_df).assign(**{'🗓️ 星期/節日': view_df['日期'].map(date_label_table(month))})
+    return dict(tuple(view_df.groupby('類別', sort=False))), set(month_df['類別'].unique())
+
+def search_groups(result_df, cat_order):
+    # 跨月搜尋結果依月份 (新→舊)、類別 (選單順序) 分組；回傳 [(月份, [(類別, 資料)])]
+    if result_df.empty: return []
+    df = editable_frame(result_df).sort_values('日期', ascending=False)
+    order = {k: i for i, k in enumerate(cat_order)}
+    return [(m, sorted(g.groupby('類別', sort=False), key=lambda kv: order.get(kv[0], len(order)))) for m, g in df.groupby('月份', sort=False)]
+
+def dashboard_summary(cube_df, today_str, sel_m, m_list):
+    # cube_df: 成本彙總 (load_cube)；回傳今日/當月/年度金額與當月各類別、各項目的金額
+    month_df = cube_df[cube_df['月份'] == sel_m]
+    cost_df = month_df[month_df['總價'] > 0]
+    return {
+        "today": cube_df[cube_df['日期'] == today_str]['總價'].sum(),
+        "month": month_df['總價'].sum(),
+        "year": cube_df[cube_df['月份'].isin(m_list)]['總價'].sum(),
+        "by_cat": cost_df.groupby('類別', observed=True)['總價'].sum().reset_index(),
+        "by_item": {c: g.groupby('名稱')['總價'].sum().reset_index().sort_values('總價', ascending=False) for c, g in cost_df.groupby('類別', sort=False)},
+    }
+
+def conflict_table(conflicts):
+    # save_dataframe 回傳的衝突 → 提示用表格 (他人目前的值 / 我的修改)
+    rows = []
+    for c in conflicts:
+        cur = c['目前'] or {}; mine = c['修改'] or {}
+        rows.append({"動作": c['動作'], "日期": cur.get('日期', mine.get('日期', '')), "名稱": cur.get('名稱', mine.get('名稱', '')),
+                     "狀況": "已被他人刪除" if c['目前'] is None else "他人已修改：" + "、".join(c['欄位']),
+                     "他人的值": "、".join(f"{k}={cur[k]}" for k in c['欄位']) if cur else "",
+                     "我的修改": "刪除" if c['修改'] is None else "、".join(f"{k}={v}" for k, v in mine.items())})
+    return pd.DataFrame(rows)
@@ -0,0 +1,1795 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import time
+import re
+import threading
+import uuid
+import weakref
+import random
+import sqlite3
+import argparse
+import hashlib
+import gspread
+import pyarrow as pa
+import requests
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import date
+from oauth2client.service_account import ServiceAccountCredentials
+from profiling import profiled, instrument_http
+
+# ==========================================
+# 儲存層：Google 試算表 / 本機 SQLite
+# ==========================================
+# --- 後端選擇 (環境變數 STORAGE_BACKEND 或 secrets 的 storage_backend：sheets / sqlite) ---
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "")
+SQLITE_FILE = os.environ.get("SQLITE_FILE", "construction.db")
+
+# --- 檔案路徑 ---
+KEY_FILE = 'service_key.json'      # Google API 金鑰
+SHEET_NAME = 'construction_db'     # Google 試算表名稱
+
+# --- 資料快取 (所有 session 共用) ---
+DATA_CACHE_TTL = int(os.environ.get("DATA_CACHE_TTL", "60"))         # 秒；逾時後只抓取新增的列
+DATA_FULL_RELOAD = int(os.environ.get("DATA_FULL_RELOAD", "900"))    # 秒；定期完整重讀以同步他處的修改/刪除
+
+# --- 背景批次寫入 (新增紀錄先寫入本機日誌，再合併成 append_rows 上傳) ---
+JOURNAL_FILE = os.environ.get("WRITE_JOURNAL", "pending_rows.db")
+FLUSH_BATCH = int(os.environ.get("FLUSH_BATCH", "20"))             # 累積筆數達此值立即上傳
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "3"))      # 秒；最舊一筆等待超過此值即上傳
+FLUSH_MAX_BACKOFF = float(os.environ.get("FLUSH_MAX_BACKOFF", "300"))
+
+# --- API 配額：所有 gspread 呼叫都經過排程器 (讀/寫各一個 token bucket，相同的讀取合併，429/5xx 退避重試) ---
+SHEETS_READS_PER_MIN = int(os.environ.get("SHEETS_READS_PER_MIN", "60"))     # Sheets API 每位使用者每分鐘讀取配額 (服務帳戶即一位使用者)
+SHEETS_WRITES_PER_MIN = int(os.environ.get("SHEETS_WRITES_PER_MIN", "60"))   # 每分鐘寫入配額
+SHEETS_RETRIES = int(os.environ.get("SHEETS_RETRIES", "5"))                  # 429/5xx/連線錯誤的重試次數
+SHEETS_MAX_WAIT = float(os.environ.get("SHEETS_MAX_WAIT", "60"))             # 秒；單一呼叫排隊等配額 + 重試等待的上限
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# --- 分區：每個「專案 × 月份」一張工作表，_manifest 記錄分區與列數 ---
+MANIFEST_SHEET = "_manifest"
+MANIFEST_HEADER = ['工作表', '專案', '月份', '列數', '版本', '彙總']   # 版本：分區內每次就地修改/刪除 +1；彙總：該分區的彙總表對應的「列數:版本」
+LEGACY_SHEET = "sheet1"            # 分區前的單一資料表 (轉換後保留作為備份)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")   # 分區快取的本機快照 (Arrow IPC，可 memory-map)；空字串停用
+
+# --- 設定與單價：每個專案/類別/項目一列 (取代 A1 儲存格的整包 JSON) ---
+SETTINGS_SHEET = "settings_rows"
+PRICES_SHEET = "price_rows"
+SETTINGS_HEADER = ['種類', '專案', '類別', '名稱', '顯示', '類型', '排序']   # 前 4 欄為鍵
+PRICES_HEADER = ['專案', '類別', '名稱', '單價', '單位']                     # 前 3 欄為鍵
+CUBE_SHEET = "cost_cube"          # 成本彙總：專案 × 日期 × 類別 × 名稱 (試算表後端改為每個分區一張 c_…)
+CUBE_HEADER = ['專案', '日期', '類別', '名稱', '總價', '數量', '筆數']               # 前 4 欄為鍵
+TABLES = {SETTINGS_SHEET: (SETTINGS_HEADER, 4), PRICES_SHEET: (PRICES_HEADER, 3), CUBE_SHEET: (CUBE_HEADER, 4)}
+
+# --- 資料欄位 ---
+DATA_COLS = ['日期', '專案', '類別', '名稱', '單位', '數量', '單價', '總價', '備註', '月份', '_id', '_ver']
+SHEET_HEADER = ['日期', '專案', '類別', '名稱', '單位', '數量', '單價', '總價', '備註', '_id', '_ver']   # _id: 每列固定不變的識別碼；_ver: 每次修改 +1
+NUM_COLS = ['數量', '單價', '總價']
+CATEGORY_COLS = ['專案', '類別', '名稱', '單位', '月份']   # 低基數欄位以 category 儲存
+
+# ==========================================
+# 1. Google 連線
+# ==========================================
+# --- 配額排程：包住 gspread 的 HTTPClient.request，所有 session 共用同一組配額 ---
+class SheetBusy(Exception): pass   # 配額用盡或 Google 暫時無法服務，等待/重試後仍失敗
+
+class TokenBucket:
+    # 任意 60 秒內最多 per_min 次：容量 (可突發) 為四分之一，其餘以固定速率補充
+    def __init__(self, per_min):
+        self.capacity = max(1, per_min // 4); self.rate = max(1, per_min - self.capacity) / 60
+        self.tokens = float(self.capacity); self.at = time.monotonic(); self.lock = threading.Lock()
+
+    def _reserve(self):
+        # 取得一個 token；不足時先預約 (tokens 變負數) 並回傳需等待的秒數，排隊的呼叫依序放行
+        with self.lock:
+            now = time.monotonic(); self.tokens = min(self.capacity, self.tokens + (now - self.at) * self.rate); self.at = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def _release(self):
+        with self.lock: self.tokens += 1
+
+    def take(self, deadline):
+        wait = self._reserve()
+        if wait and time.monotonic() + wait > deadline:
+            self._release(); raise SheetBusy("Google 試算表 API 配額已用盡，請稍後再試")
+        if wait: time.sleep(wait)
+        return wait
+
+def _status_code(e):
+    return getattr(e, 'code', None) or getattr(getattr(e, 'response', None), 'status_code', None)
+
+def _retryable(e, write=False):
+    # 寫入只在 429 重試 (請求被拒絕、未套用)；5xx/逾時可能已在伺服器端套用，重送會重複新增或刪錯列，交由呼叫端先確認狀態
+    if isinstance(e, gspread.exceptions.APIError): return _status_code(e) == 429 if write else _status_code(e) in RETRY_STATUS
+    return not write and isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+class RequestScheduler:
+    def __init__(self, reads_per_min, writes_per_min):
+        self.reads = TokenBucket(reads_per_min); self.writes = TokenBucket(writes_per_min)
+        self.lock = threading.Lock(); self.inflight = {}   # 進行中的 GET (端點, 參數) → Future，相同的讀取共用結果
+        self.calls = 0; self.coalesced = 0; self.retries = 0; self.waited = 0.0; self.last_error = None
+
+    def wrap(self, http_client):
+        orig = http_client.request
+        def request(method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+            send = lambda: orig(method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+            if method.upper() != 'GET': return self._send(send, self.writes, write=True)
+            key = (endpoint, _json_key(params))
+            with self.lock:
+                fut = self.inflight.get(key); leader = fut is None
+                if leader: fut = self.inflight[key] = Future()
+                else: self.coalesced += 1
+            if not leader: return fut.result()
+            try:
+                resp = self._send(send, self.reads); fut.set_result(resp); return resp
+            except BaseException as e:
+                fut.set_exception(e); raise
+            finally:
+                with self.lock: self.inflight.pop(key, None)
+        http_client.request = request
+        return http_client
+
+    def _send(self, send, bucket, write=False):
+        # 先排隊取得配額；讀取遇 429/5xx/連線錯誤、寫入遇 429 時以指數退避 + 完全隨機抖動重試，總等待不超過 SHEETS_MAX_WAIT
+        deadline = time.monotonic() + SHEETS_MAX_WAIT
+        for attempt in range(SHEETS_RETRIES + 1):
+            waited = bucket.take(deadline)
+            with self.lock: self.calls += 1; self.waited += waited
+            try: return send()
+            except Exception as e:
+                if not _retryable(e, write): raise
+                delay = random.uniform(0, min(32.0, 2.0 ** attempt))
+                with self.lock: self.last_error = str(e)
+                if attempt == SHEETS_RETRIES or time.monotonic() + delay > deadline:
+                    if _status_code(e) == 429: raise SheetBusy("Google 試算表 API 配額已用盡，請稍後再試") from e
+                    raise
+                with self.lock: self.retries += 1
+                time.sleep(delay)
+
+    def status(self):
+        with self.lock: return {'呼叫': self.calls, '合併': self.coalesced, '重試': self.retries, '排隊秒數': round(self.waited, 1), '最後錯誤': self.last_error}
+
+def _json_key(obj):
+    return json.dumps(obj, sort_keys=True, default=str) if obj else ''
+
+SCHEDULER = RequestScheduler(SHEETS_READS_PER_MIN, SHEETS_WRITES_PER_MIN)
+
+@st.cache_resource
+@profiled("get_google_client")
+def get_google_client():
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    creds = None
+    if os.path.exists(KEY_FILE):
+        try: creds = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE, scope)
+        except: return None
+    else:
+        try:
+            if "gcp_service_account" in st.secrets:
+                creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
+        except: return None
+    if not creds: return None
+    client = gspread.authorize(creds)
+    if hasattr(client, "http_client"):
+        instrument_http(client.http_client)   # gspread 6：效能紀錄開啟時計算 API 呼叫數與位元組 (每次實際送出)
+        SCHEDULER.wrap(client.http_client)    # 配額排程在最外層：排隊、合併、重試
+    return client
+
+# --- 試算表 / 工作表物件快取 (與 client 一樣跨 rerun 保留) ---
+class SheetHandles:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spreadsheet = None; self.worksheets = {}
+
+@st.cache_resource
+def get_sheet_handles():
+    return SheetHandles()
+
+def reset_sheet_handles(reauth=False):
+    h = get_sheet_handles()
+    with h.lock: h.spreadsheet = None; h.worksheets = {}
+    if reauth: get_google_client.clear()
+
+def _count_saved_meta_calls(n):
+    # 每次 rerun 開頭歸零，側邊欄顯示本次省下的 open/worksheet 呼叫數
+    try: st.session_state.sheet_meta_saved = st.session_state.get('sheet_meta_saved', 0) + n
+    except: pass
+
+def get_spreadsheet():
+    client = get_google_client()
+    if not client: return None
+    h = get_sheet_handles()
+    with h.lock:
+        try:
+            if h.spreadsheet is None: h.spreadsheet = client.open(SHEET_NAME)
+            else: _count_saved_meta_calls(1)
+            return h.spreadsheet
+        except gspread.exceptions.SpreadsheetNotFound: return None   # 配額/網路錯誤照常拋出，不當成「沒有試算表」
+
+@profiled("get_sheet")
+def get_sheet(sheet_title, create=True):
+    client = get_google_client()
+    if not client: return None
+    h = get_sheet_handles()
+    with h.lock:
+        if sheet_title in h.worksheets:
+            _count_saved_meta_calls(2); return h.worksheets[sheet_title]
+        try:
+            if h.spreadsheet is None: h.spreadsheet = client.open(SHEET_NAME)
+            else: _count_saved_meta_calls(1)
+            try:
+                ws = h.spreadsheet.worksheet(sheet_title)
+            except gspread.exceptions.WorksheetNotFound:
+                if not create: return None
+                ws = h.spreadsheet.add_worksheet(title=sheet_title, rows="100", cols="20")
+            h.worksheets[sheet_title] = ws; return ws
+        except gspread.exceptions.SpreadsheetNotFound: return None
+
+class SheetUnavailable(Exception): pass
+
+def _is_stale_handle(e):
+    if isinstance(e, (gspread.exceptions.WorksheetNotFound, gspread.exceptions.SpreadsheetNotFound)): return True
+    if isinstance(e, gspread.exceptions.APIError):
+        code = _status_code(e)
+        # 401: 憑證過期；404: 試算表已不存在。400 Unable to parse range 是範圍所在的工作表不存在，重開試算表再試一次也一樣，直接交給呼叫端 (_missing_range)
+        return code in (401, 404)
+    return False
+
+def _forget_sheet(sheet_title):
+    h = get_sheet_handles()
+    with h.lock: h.worksheets.pop(sheet_title, None)
+
+def _missing_range(e):
+    # 讀取範圍所在的工作表尚未建立 (第一次使用)；其他錯誤 (配額、網路) 不可當成沒有資料
+    return isinstance(e, gspread.exceptions.APIError) and _status_code(e) == 400 and 'Unable to parse range' in str(e)
+
+def with_sheet(sheet_title, op):
+    # 以快取的工作表執行 op(sheet)；憑證過期或工作表失效時清掉快取重新開啟一次
+    sheet = get_sheet(sheet_title)
+    if not sheet: raise SheetUnavailable(f"無法開啟工作表 {sheet_title}")
+    try: return op(sheet)
+    except Exception as e:
+        if _missing_range(e): _forget_sheet(sheet_title)   # 工作表已被刪除：不重試，下次呼叫重新取得
+        if not _is_stale_handle(e): raise
+        reset_sheet_handles(reauth=isinstance(e, gspread.exceptions.APIError) and getattr(e, 'code', None) == 401)
+        sheet = get_sheet(sheet_title)
+        if not sheet: raise SheetUnavailable(f"無法開啟工作表 {sheet_title}")
+        return op(sheet)
+
+def with_spreadsheet(op):
+    # 跨工作表的批次操作 (values_batch_get / values_batch_update / batch_update)
+    sh = get_spreadsheet()
+    if not sh: raise SheetUnavailable("無法開啟試算表")
+    try: return op(sh)
+    except Exception as e:
+        if not _is_stale_handle(e): raise
+        reset_sheet_handles(reauth=isinstance(e, gspread.exceptions.APIError) and getattr(e, 'code', None) == 401)
+        sh = get_spreadsheet()
+        if not sh: raise SheetUnavailable("無法開啟試算表")
+        return op(sh)
+
+# ==========================================
+# 2. 資料列處理與差異比對 (各後端共用)
+# ==========================================
+def new_row_id():
+    return uuid.uuid4().hex[:12]
+
+def build_frame(header, rows):
+    rows = [list(r) + [''] * (len(header) - len(r)) for r in rows]
+    df = pd.DataFrame([r[:len(header)] for r in rows], columns=header)
+    for c in ['_id', '_ver']:
+        if c not in df.columns: df[c] = ''
+    return compact_frame(df)
+
+def _compact_num(s):
+    # 全為整數且在 int32 範圍內 → int32，否則 float64 (不用 float32，避免寫回時出現誤差)
+    s = pd.to_numeric(s, errors='coerce').fillna(0).astype(float)
+    if len(s) and (s % 1 == 0).all() and s.abs().max() < 2 ** 31: return s.astype('int32')
+    return s
+
+def compact_frame(df):
+    # 共用資料集的精簡格式：日期 datetime64 (無效日期的列略過)、低基數欄位 category、數字欄位盡量用 int32
+    df = df.reset_index(drop=True)
+    d = pd.to_datetime(df['日期'], errors='coerce')
+    if d.isna().any(): df = df[d.notna()].reset_index(drop=True); d = d.dropna().reset_index(drop=True)
+    ym = (d.dt.year * 12 + d.dt.month - 1).to_numpy(dtype='int64')
+    uniq, codes = np.unique(ym, return_inverse=True)
+    cols = {'日期': d}
+    for c in ['專案', '類別', '名稱', '單位']: cols[c] = df[c].fillna('').astype(str).astype('category') if len(df) else pd.Series([], dtype='category')
+    for c in NUM_COLS: cols[c] = _compact_num(df[c])
+    for c in ['備註', '_id']: cols[c] = df[c].fillna('').astype(str)
+    cols['_ver'] = pd.to_numeric(df['_ver'], errors='coerce').fillna(0).astype('int32')
+    cols['月份'] = pd.Categorical.from_codes(codes.reshape(-1), [f"{v // 12}-{v % 12 + 1:02d}" for v in uniq])
+    return pd.DataFrame(cols)[DATA_COLS]
+
+def concat_frames(frames):
+    frames = [f for f in frames if len(f)]
+    if not frames: return empty_frame()
+    return frames[0] if len(frames) == 1 else compact_frame(pd.concat(frames, ignore_index=True))
+
+def editable_frame(df):
+    # 共用資料集唯讀交給各 session (不改 pandas 的全域設定)；要修改時一律經此複製一份，並轉回一般欄位 (category → 字串、整數 → 浮點)
+    return df.astype({c: str for c in CATEGORY_COLS if c in df.columns} | {c: float for c in NUM_COLS if c in df.columns})
+
+def memory_usage(df):
+    # (精簡格式的位元組, 舊格式 [object 字串 + date 物件 + float64] 的位元組)
+    legacy = df.astype({c: object for c in CATEGORY_COLS + ['備註', '_id'] if c in df.columns} | {c: float for c in NUM_COLS if c in df.columns})
+    legacy['日期'] = legacy['日期'].dt.date
+    return int(df.memory_usage(deep=True).sum()), int(legacy.memory_usage(deep=True).sum())
+
+def empty_frame():
+    return compact_frame(pd.DataFrame(columns=SHEET_HEADER))
+
+def filter_frame(df, project=None, months=None):
+    if project is not None: df = df[df['專案'] == project]
+    if months is not None: df = df[df['月份'].isin(list(months))]
+    return df
+
+def _cell_value(col, v):
+    if col in NUM_COLS:
+        v = float(v); return int(v) if v.is_integer() else v
+    return str(v)
+
+def _normalized(df, cols):
+    # 轉成與試算表儲存格相同的表示法，以便比對
+    out = pd.DataFrame(index=df.index)
+    for c in cols:
+        if c in NUM_COLS: out[c] = pd.to_numeric(df[c], errors='coerce').fillna(0).astype(float)
+        elif c == '日期': out[c] = pd.to_datetime(df[c], errors='coerce').dt.strftime("%Y-%m-%d").fillna('')
+        else: out[c] = df[c].astype(str).where(df[c].notna(), '')   # category 欄位不能 fillna('')
+    return out
+
+def diff_frames(old, new):
+    # 依 _id 比對新舊資料：回傳 (更新 {id: {欄: 值}}, 刪除的 id, 新增的列 dict)
+    cols = [c for c in SHEET_HEADER if c not in ('_id', '_ver') and c in old.columns and c in new.columns]
+    old = old[old['_id'].astype(str) != ''].drop_duplicates('_id').set_index('_id', drop=False)
+    new = new.copy()
+    if '_id' not in new.columns: new['_id'] = ''
+    new['_id'] = new['_id'].fillna('').astype(str)
+    is_new = (new['_id'] == '') | ~new['_id'].isin(old.index)
+    kept = new[~is_new].drop_duplicates('_id').set_index('_id', drop=False)
+    deletes = [i for i in old.index if i not in kept.index]
+    updates = {}
+    if not kept.empty:
+        o = _normalized(old.loc[kept.index], cols); n = _normalized(kept, cols)
+        changed = o.ne(n)
+        for c in cols:
+            for rid in changed.index[changed[c]]: updates.setdefault(rid, {})[c] = n.at[rid, c]
+    inserts = []
+    for rec in new[is_new].to_dict('records'):
+        row = {c: rec.get(c, '') for c in SHEET_HEADER}
+        for c in SHEET_HEADER:
+            if c in NUM_COLS: row[c] = pd.to_numeric(row[c], errors='coerce')
+            if pd.isna(row[c]): row[c] = 0 if c in NUM_COLS else ''
+        row['日期'] = str(row['日期'])[:10]; row['_id'] = row['_id'] or new_row_id(); row['_ver'] = 0
+        inserts.append(row)
+    return updates, deletes, inserts
+
+def row_snapshot(df, ids=None):
+    # {_id: 比對用表示法 + _ver}；_ver 為 None 表示編輯畫面沒有帶版本，只能逐欄比對
+    df = df if ids is None else df[df['_id'].isin(list(ids))]
+    df = df[df['_id'].astype(str) != ''].drop_duplicates('_id').set_index('_id', drop=False)
+    out = _normalized(df, [c for c in SHEET_HEADER if c not in ('_id', '_ver') and c in df.columns]).to_dict('index')
+    for rid in out: out[rid]['_ver'] = int(_float(df.at[rid, '_ver'])) if '_ver' in df.columns else None
+    return out
+
+def merge_changes(updates, deletes, base, current):
+    # 條件式寫入：base 為編輯前的列、current 為寫入當下的列 (皆為 row_snapshot)
+    # 版本相同直接寫入；版本不同時，只要要改的欄位他人沒動過 (或已改成相同值) 就合併，否則列為衝突
+    # 回傳 (可寫入的 updates, 可刪除的 id, 衝突 [{_id, 動作, 欄位, 目前的值, 修改}])
+    ok_updates = {}; ok_deletes = []; conflicts = []
+    for rid, cells in updates.items():
+        b = base.get(rid); cur = current.get(rid)
+        if b is None: ok_updates[rid] = cells; continue
+        if cur is None: conflicts.append({'_id': rid, '動作': '修改', '欄位': [], '目前': None, '修改': cells}); continue
+        if b['_ver'] is not None and b['_ver'] == cur['_ver']: ok_updates[rid] = cells; continue
+        new = row_snapshot(pd.DataFrame([{**cells, '_id': rid}]))[rid]
+        clash = [c for c in cells if c in cur and cur[c] != b.get(c, cur[c]) and cur[c] != new.get(c)]
+        if clash: conflicts.append({'_id': rid, '動作': '修改', '欄位': clash, '目前': cur, '修改': cells})
+        else: ok_updates[rid] = cells
+    for rid in deletes:
+        b = base.get(rid); cur = current.get(rid)
+        if cur is None: continue   # 已被他人刪除
+        if b is None or (b['_ver'] is not None and b['_ver'] == cur['_ver']): ok_deletes.append(rid); continue
+        clash = [c for c in b if c != '_ver' and c in cur and cur[c] != b[c]]
+        if clash: conflicts.append({'_id': rid, '動作': '刪除', '欄位': clash, '目前': cur, '修改': None})
+        else: ok_deletes.append(rid)
+    return ok_updates, ok_deletes, conflicts
+
+def row_spans(rows):
+    # 列號 (由大到小) 合併為連續範圍 [起, 迄]，刪除時由下往上以免列號位移
+    spans = []
+    for r in sorted(set(rows), reverse=True):
+        if spans and spans[-1][0] == r + 1: spans[-1][0] = r
+        else: spans.append([r, r])
+    return spans
+
+def _num(v):
+    v = float(v or 0); return int(v) if v.is_integer() else v
+
+def _fmt(v):
+    # 與試算表儲存格文字相同的表示法 (2600.0 → '2600')
+    if isinstance(v, (int, float)) and not isinstance(v, bool): return str(_num(v))
+    return '' if v is None else str(v)
+
+def settings_to_rows(data):
+    rows = [['project', p, '', '', '', '', i] for i, p in enumerate(data.get('projects', []))]
+    rows += [['category', '', c['key'], '', c.get('display', ''), c.get('type', 'text'), i] for i, c in enumerate(data.get('cat_config', []))]
+    for p, cats in data.get('items', {}).items():
+        rows.append(['group', p, '', '', '', '', 0])   # 專案的選單 (即使沒有任何類別)
+        for j, (c, names) in enumerate(cats.items()):
+            rows.append(['group', p, c, '', '', '', j + 1])
+            rows += [['item', p, c, n, '', '', k] for k, n in enumerate(names)]
+    return rows
+
+def rows_to_settings(rows):
+    data = {"projects": [], "items": {}, "cat_config": []}
+    for kind in ['project', 'category', 'group', 'item']:
+        for _, p, c, n, disp, typ, _order in sorted((r for r in rows if r[0] == kind), key=lambda r: _num(r[6])):
+            if kind == 'project': data['projects'].append(p)
+            elif kind == 'category': data['cat_config'].append({"key": c, "display": disp, "type": typ or 'text'})
+            elif kind == 'group':
+                data['items'].setdefault(p, {})
+                if c: data['items'][p].setdefault(c, [])
+            else: data['items'].setdefault(p, {}).setdefault(c, []).append(n)
+    return data
+
+def prices_to_rows(data):
+    rows = []
+    for p, cats in data.items():
+        if not cats: rows.append([p, '', '', '', ''])
+        for c, items in cats.items():
+            if not items: rows.append([p, c, '', '', ''])
+            rows += [[p, c, n, _num(v.get('price', 0)), v.get('unit', '')] for n, v in items.items()]
+    return rows
+
+def rows_to_prices(rows):
+    data = {}
+    for p, c, n, price, unit in rows:
+        cats = data.setdefault(p, {})
+        if c: items = cats.setdefault(c, {})
+        if c and n: items[n] = {"price": _num(price), "unit": unit}
+    return data
+
+def diff_keyed_rows(old_rows, new_rows, nkey):
+    # 依鍵欄比對：回傳 (變動儲存格 [(舊列位置, 欄位置, 值)], 刪除的舊列位置, 新增列)
+    new = {}
+    for r in new_rows: new.setdefault(tuple(_fmt(v) for v in r[:nkey]), r)
+    seen = set(); cells = []; deletes = []
+    for i, r in enumerate(old_rows):
+        k = tuple(_fmt(v) for v in r[:nkey])
+        if k not in new or k in seen: deletes.append(i); continue
+        seen.add(k)
+        cells += [(i, j, v) for j, v in enumerate(new[k]) if j >= nkey and _fmt(v) != (_fmt(r[j]) if j < len(r) else '')]
+    return cells, deletes, [r for k, r in new.items() if k not in seen]
+
+def _float(v):
+    try: v = float(v)
+    except (TypeError, ValueError): return 0.0
+    return 0.0 if v != v else v   # NaN → 0
+
+def record_day(date_value):
+    # 'YYYY-MM-DD' (無效日期為 '')；ISO 字串走快速路徑，其他格式才交給 pandas
+    s = str(date_value)[:10]
+    try: return date.fromisoformat(s).isoformat()
+    except ValueError:
+        d = pd.to_datetime(s, errors='coerce'); return '' if pd.isna(d) else d.strftime("%Y-%m-%d")
+
+def cube_delta(records, sign=1, delta=None):
+    # 紀錄 (dict) 對彙總表的增減量 {(專案, 日期, 類別, 名稱): [總價, 數量, 筆數]}；日期無效的列不計
+    delta = {} if delta is None else delta
+    for r in records:
+        d = record_day(r.get('日期', ''))
+        if not d: continue
+        v = delta.setdefault((str(r.get('專案', '')), d, str(r.get('類別', '')), str(r.get('名稱', ''))), [0.0, 0.0, 0])
+        v[0] += sign * _float(r.get('總價', 0)); v[1] += sign * _float(r.get('數量', 0)); v[2] += sign
+    return delta
+
+def merge_cube(cube, delta):
+    for k, (c, q, n) in delta.items():
+        v = cube.setdefault(k, [0.0, 0.0, 0])
+        v[0] += c; v[1] += q; v[2] += n
+        if v[2] <= 0: del cube[k]
+    return cube
+
+def frame_cube(df, cube=None):
+    # 由紀錄整批彙總 (重建用)
+    cube = {} if cube is None else cube
+    if df.empty: return cube
+    g = df.assign(日期=pd.to_datetime(df['日期']).dt.strftime("%Y-%m-%d")).groupby(['專案', '日期', '類別', '名稱'], sort=False, observed=True).agg(總價=('總價', 'sum'), 數量=('數量', 'sum'), 筆數=('_id', 'size'))
+    return merge_cube(cube, {k: [float(c), float(q), int(n)] for k, c, q, n in zip(g.index, g['總價'], g['數量'], g['筆數'])})
+
+def cube_to_rows(cube):
+    return [list(k) + [_num(round(c, 4)), _num(round(q, 4)), n] for k, (c, q, n) in sorted(cube.items())]
+
+def rows_to_cube(rows):
+    return {tuple(str(v) for v in r[:4]): [_float(r[4]), _float(r[5]), int(_float(r[6]))] for r in rows}
+
+def cube_sig(e):
+    # 分區清單的「列數:版本」；彙總分區寫入時記在清單的「彙總」欄，兩者不同即需由紀錄重建
+    return f"{e['列數']}:{e['版本']}"
+
+def cube_part_title(t):
+    # 分區 d_… 的彙總表
+    return 'c' + t[1:]
+
+class CubePart:
+    # 單一分區 (專案 × 月份) 的彙總表快取；rows：鍵 → 列號，free：已清空可重用的列，end：最後使用的列
+    def __init__(self, sig, values=()):
+        self.sig = sig; self.cube = {}; self.rows = {}; self.free = []; self.end = max(len(values), 1)
+        for i, r in enumerate(values[1:], start=2):
+            r = list(r) + [''] * (len(CUBE_HEADER) - len(r))
+            if not any(r[:4]): self.free.append(i); continue
+            k = tuple(str(v) for v in r[:4])
+            if k in self.rows: raise ValueError(f"彙總表有重複的鍵 {k}")
+            self.rows[k] = i; self.cube[k] = [_float(r[4]), _float(r[5]), int(_float(r[6]))]
+
+    def apply(self, delta):
+        # 合併增量；回傳 (要覆寫的列 {列號: 值}, 要附加的列 [(鍵, 值)])；歸零的鍵清空該列留待重用
+        merge_cube(self.cube, delta); cells = {}; appends = []
+        for k in sorted(delta, key=lambda k: k in self.cube):   # 先清空歸零的列，新鍵才能重用
+            if k in self.cube:
+                row = cube_to_rows({k: self.cube[k]})[0]
+                if k not in self.rows and self.free: self.rows[k] = self.free.pop()
+                if k in self.rows: cells[self.rows[k]] = row
+                else: appends.append((k, row))
+            elif k in self.rows:
+                i = self.rows.pop(k); self.free.append(i); cells[i] = [''] * len(CUBE_HEADER)
+        return cells, appends
+
+    def placed(self, appends, end):
+        # 附加的列寫在以 end 結尾的連續列
+        for i, (k, _) in enumerate(appends, start=end - len(appends) + 1):
+            self.rows[k] = i
+            if i in self.free: self.free.remove(i)
+        self.end = max(self.end, end)
+
+# --- 名稱/備註全文搜尋 ---
+SEARCH_COLS = ['名稱', '備註']
+SEARCH_CACHE = 16   # 最多保留幾組 (專案, 關鍵字) 的搜尋結果 (資料集未變動時直接沿用)
+
+def text_grams(text):
+    # 中文不分詞：取單字與相鄰兩字 (英文不分大小寫)
+    t = str(text).casefold()
+    return set(t) | {t[i:i + 2] for i in range(len(t) - 1)}
+
+class TextIndex:
+    # 倒排索引 n-gram → 含有它的文字編號；只記錄不重複的文字，新增/修改後只有新出現的文字需要切詞
+    # 掃描過的資料集 (共用快取，變動即換新物件) 以物件識別保存各列名稱/備註的文字編號，搜尋時只比對整數陣列
+    # 每個文字記錄有幾個存活的資料集用到它；資料集被換掉 (刪除、修改、換月份後) 就不再用到的文字移出索引，編號留給新文字
+    def __init__(self):
+        self.lock = threading.Lock(); self.ids = {}; self.texts = []; self.grams = {}; self.frames = {}
+        self.refs = []; self.free = []
+        self.results = {}   # (專案, 關鍵字) → (搜尋時各資料集的 weakref, 結果)
+
+    def _text_ids(self, values):
+        out = []
+        for t in values:
+            t = str(t); i = self.ids.get(t)
+            if i is None:
+                if self.free: i = self.free.pop(); self.texts[i] = t; self.refs[i] = 0
+                else: i = len(self.texts); self.texts.append(t); self.refs.append(0)
+                self.ids[t] = i
+                for g in text_grams(t): self.grams.setdefault(g, set()).add(i)
+            out.append(i)
+        return np.array(out, dtype='int32')
+
+    def _evict(self):
+        # 已被回收的資料集：其用到的文字減少引用，歸零者移出 ids/grams
+        for k in [k for k, v in self.frames.items() if v[0]() is None]:
+            for i in self.frames.pop(k)[2].tolist():
+                self.refs[i] -= 1
+                if self.refs[i]: continue
+                t = self.texts[i]; del self.ids[t]; self.texts[i] = None; self.free.append(i)
+                for g in text_grams(t):
+                    ids = self.grams.get(g)
+                    if ids is not None:
+                        ids.discard(i)
+                        if not ids: del self.grams[g]
+        self.results = {k: v for k, v in self.results.items() if all(r() is not None for r in v[0])}
+
+    def evict(self):
+        with self.lock: self._evict()
+
+    def codes(self, df):
+        # 資料集各列 (名稱, 備註) 的文字編號
+        with self.lock:
+            hit = self.frames.get(id(df))
+            if hit is not None and hit[0]() is df: return hit[1]
+            self._evict()
+            cols = []
+            for c in SEARCH_COLS:
+                codes, uniques = pd.factorize(df[c])
+                cols.append(self._text_ids(uniques)[codes] if len(df) else np.zeros(0, dtype='int32'))
+            used = np.unique(np.concatenate(cols))
+            for i in used.tolist(): self.refs[i] += 1
+            self.frames[id(df)] = (weakref.ref(df), cols, used)
+            return cols
+
+    def matches(self, term):
+        # 含有 term 的文字編號：各 n-gram 的集合取交集後再確認是連續出現
+        term = term.casefold(); grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        with self.lock:
+            sets = sorted((self.grams.get(g, set()) for g in grams), key=len)
+            found = set.intersection(*sets) if sets else set()
+            return np.array(sorted(i for i in found if term in self.texts[i].casefold()), dtype='int32')
+
+    def cached(self, key, frames):
+        with self.lock: hit = self.results.get(key)
+        if hit is not None and len(hit[0]) == len(frames) and all(r() is df for r, df in zip(hit[0], frames)): return hit[1]
+        return None
+
+    def remember(self, key, frames, result):
+        with self.lock:
+            if len(self.results) >= SEARCH_CACHE: self.results.pop(next(iter(self.results)))
+            self.results[key] = ([weakref.ref(df) for df in frames], result)
+
+# ==========================================
+# 3. 後端介面
+# ==========================================
+class StorageBackend:
+    # 所有持久化操作都經由此介面；load_records 只回傳指定專案/月份的資料
+    name = ""
+    def load_records(self, project=None, months=None): raise NotImplementedError
+    def list_months(self, project): raise NotImplementedError
+    def _insert_records(self, records): raise NotImplementedError    # 同步批次寫入
+    def _apply_changes(self, updates, deletes, inserts, base): raise NotImplementedError   # 回傳 (衝突, 寫入當下讀到的列 {_id: dict 或 None})
+    def _rows_by_id(self, ids): raise NotImplementedError            # 目前的紀錄 {_id: dict}
+    def _has_records(self): raise NotImplementedError
+    def append_records(self, records): self.insert_records(records)  # 可延後寫入 (預設同步)
+
+    def insert_records(self, records):
+        self._prepare_cube(); self._insert_records(records); self._update_cube(cube_delta(records))
+
+    def apply_changes(self, updates, deletes, inserts, base=None):
+        # base: 編輯前的列 (row_snapshot)；有 base 的列只在他人沒有改到同一欄時寫入，其餘回傳為衝突
+        # 寫入前先取得舊值，彙總表以 (新 - 舊) 增量更新
+        if not (updates or deletes or inserts): return []
+        self._prepare_cube()
+        old = self._rows_by_id(set(updates) | set(deletes))
+        conflicts, fresh = self._apply_changes(updates, deletes, inserts, base or {})
+        self.text_index.evict()   # 被換掉的資料集 (刪除/修改/換月份的列) 不再用到的文字移出搜尋索引
+        old = {rid: r for rid, r in {**old, **fresh}.items() if r is not None}   # fresh 中為 None：已被他人刪除
+        skip = {c['_id'] for c in conflicts}
+        delta = cube_delta([r for rid, r in old.items() if rid not in skip], -1)
+        cube_delta([{**old[rid], **cells} for rid, cells in updates.items() if rid in old and rid not in skip], 1, delta)
+        self._update_cube(cube_delta(inserts, 1, delta))
+        return conflicts
+
+    # --- 成本彙總 ---
+    def _cube(self):
+        # 整份彙總表 (共用快取，逾時重讀)；彙總表為空但已有紀錄、或上次增量更新失敗時由紀錄重建
+        with self.cube_lock:
+            if self.cube_stale: self.rebuild_cube()
+            elif self.cube is None or time.time() - self.cube_at > DATA_CACHE_TTL:
+                cube = rows_to_cube(self._load_table(CUBE_SHEET))
+                if not cube and self._has_records(): cube = self.rebuild_cube()
+                self.cube = cube; self.cube_at = time.time()
+            return self.cube
+
+    def _prepare_cube(self):
+        # 寫入紀錄前先載入 (必要時重建) 彙總表，寫入後只需合併增量
+        try: self._cube()
+        except:
+            with self.cube_lock: self.cube = None; self.cube_stale = True
+
+    def _update_cube(self, delta):
+        delta = {k: v for k, v in delta.items() if any(v)}
+        if not delta: return
+        with self.cube_lock:
+            # 紀錄已寫入，彙總失敗不回報為存檔失敗；下次讀取時重建
+            if self.cube is None or self.cube_stale: self.cube_stale = True; return
+            try: self._write_cube(merge_cube(self.cube, delta), delta.keys())
+            except: self.cube = None; self.cube_stale = True
+
+    def _write_cube(self, cube, keys):
+        # keys: 有變動的鍵 (已不在 cube 中者為刪除)；預設整表差異寫入
+        self._save_table(CUBE_SHEET, cube_to_rows(cube))
+
+    def rebuild_cube(self):
+        cube = {}
+        for df in self.iter_records(): frame_cube(df, cube)
+        with self.cube_lock:
+            self._save_table(CUBE_SHEET, cube_to_rows(cube)); self.cube = cube; self.cube_at = time.time(); self.cube_stale = False
+        return cube
+
+    def load_cube(self, project, months=None):
+        # 回傳 DataFrame：專案, 日期 (YYYY-MM-DD), 類別, 名稱, 總價, 數量, 筆數, 月份
+        with self.cube_lock: rows = cube_to_rows({k: v for k, v in self._cube().items() if k[0] == project})
+        df = pd.DataFrame(rows, columns=CUBE_HEADER)
+        df['月份'] = df['日期'].str[:7]
+        return df if months is None else df[df['月份'].isin(list(months))]
+
+    def _load_table(self, title): raise NotImplementedError          # 正規化列 (依儲存順序)
+    def _save_table(self, title, rows): raise NotImplementedError    # 只寫入與現有列的差異
+    def _load_legacy(self, key): return None                         # 舊版整包 JSON (settings / item_prices)
+
+    def _load_normalized(self, title, key, from_rows, to_rows, rows=None):
+        # rows：已先讀好的正規化列 (啟動時的批次讀取)
+        rows = self._load_table(title) if rows is None else rows
+        if rows: return from_rows(rows)
+        data = self._load_legacy(key)
+        if data: self._save_table(title, to_rows(data))   # 第一次讀取時轉成正規化列，舊資料保留不動
+        return data
+
+    def load_settings(self, rows=None): return self._load_normalized(SETTINGS_SHEET, "settings", rows_to_settings, settings_to_rows, rows)   # 無資料時回傳 None
+    def save_settings(self, data): self._save_table(SETTINGS_SHEET, settings_to_rows(data))
+    def load_prices(self, rows=None): return self._load_normalized(PRICES_SHEET, "item_prices", rows_to_prices, prices_to_rows, rows)
+    def save_prices(self, data): self._save_table(PRICES_SHEET, prices_to_rows(data))
+    def save_catalog(self, settings, prices):                       # 設定與單價一起寫入 (試算表：一次批次)
+        self.save_settings(settings); self.save_prices(prices)
+    def rename_item(self, project, category, old, new): return self.rename_items(project, category, {old: new})
+    def rename_items(self, project, category, renames):
+        # renames {舊名稱: 新名稱}：紀錄、設定與單價列中的 (專案, 類別, 名稱) 一起改名，單價以改名的項目為準；回傳改名的紀錄筆數
+        # 預設：載入該專案的紀錄後差異寫入，設定/單價整表比對
+        check_renames(renames)
+        df = self.load_records(project)
+        hit = df[(df['類別'] == category) & df['名稱'].isin(list(renames))]
+        if len(hit): self.apply_changes({rid: {'名稱': renames[n]} for rid, n in zip(hit['_id'], hit['名稱'])}, [], [])
+        rows = self._load_table(SETTINGS_SHEET)
+        self._save_table(SETTINGS_SHEET, [r[:3] + [renames[r[3]]] + r[4:] if list(r[:3]) == ['item', project, category] and r[3] in renames else r for r in rows])
+        news = set(renames.values())
+        rows = [r for r in self._load_table(PRICES_SHEET) if not (list(r[:2]) == [project, category] and r[2] in news)]
+        self._save_table(PRICES_SHEET, [[project, category, renames[r[2]]] + list(r[3:]) if list(r[:2]) == [project, category] and r[2] in renames else r for r in rows])
+        return len(hit)
+    def load_startup(self):
+        # 啟動時需要的設定與單價；回傳 (設定, 單價, {步驟: 秒})
+        timings = {}; t0 = time.perf_counter()
+        settings = self.load_settings(); timings['設定'] = round(time.perf_counter() - t0, 4); t0 = time.perf_counter()
+        prices = self.load_prices(); timings['單價'] = round(time.perf_counter() - t0, 4)
+        return settings, prices, timings
+    def write_status(self): return None                             # (待上傳, 已上傳, 最後錯誤)；無背景寫入時為 None
+    def quota_status(self): return None                             # API 配額排程的統計；無配額限制時為 None
+    def cube_status(self): return None                              # (彙總增量寫入失敗次數, 最後錯誤)；不追蹤時為 None
+    def data_version(self): raise NotImplementedError                # 資料變動即改變的字串 (備份快取的鍵)
+    def dataset_memory(self): return 0, 0                            # 共用資料集 (精簡格式, 舊格式) 的位元組
+    def iter_records(self, chunk=1000):                              # 依序分塊產出所有紀錄 (匯出用)
+        df = self.load_records()
+        for i in range(0, len(df), chunk): yield df.iloc[i:i + chunk]
+    def invalidate(self): pass
+
+    def _search_frames(self, project): return [self.load_records(project)]   # 搜尋用的共用資料集 (可分多塊)
+    def search_records(self, project, query):
+        # 整個專案 (跨月份) 的名稱/備註搜尋，空白分隔的多個關鍵字需全部符合；資料集變動的部分先補進倒排索引
+        frames = self._search_frames(project); key = (project, tuple(query.split()))
+        result = self.text_index.cached(key, frames)
+        if result is not None: return result
+        codes = [self.text_index.codes(df) for df in frames]
+        terms = [self.text_index.matches(t) for t in key[1]]
+        out = []
+        if terms and all(len(ids) for ids in terms):
+            for df, (names, notes) in zip(frames, codes):
+                mask = np.ones(len(df), dtype=bool)
+                for ids in terms: mask &= np.isin(names, ids) | np.isin(notes, ids)
+                if mask.any(): out.append(df[mask])
+        result = concat_frames(out); self.text_index.remember(key, frames, result)
+        return result
+
+# ==========================================
+# 4. Google 試算表後端
+# ==========================================
+def _col_letter(col):
+    return re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, col))
+
+def _assign_missing_ids(sheet, header, rows, first_row):
+    # 舊資料或手動在試算表新增的列沒有 _id：補上並一次寫回
+    id_col = header.index('_id') + 1; updates = []
+    for i, r in enumerate(rows):
+        while len(r) < len(header): r.append('')
+        if any(str(v).strip() for v in r) and not str(r[id_col - 1]).strip():
+            r[id_col - 1] = new_row_id()
+            updates.append({"range": gspread.utils.rowcol_to_a1(first_row + i, id_col), "values": [[r[id_col - 1]]]})
+    if updates: sheet.batch_update(updates)
+
+def check_renames(renames):
+    # 一次改多個名稱：新名稱不可與其他要改的舊名稱相同 (互換/串接需分次進行)，也不可重複
+    news = list(renames.values())
+    if len(set(news)) != len(news) or set(news) & {o for o, n in renames.items() if o != n}: raise ValueError("改名不可互換、串接或改成相同名稱")
+
+def name_index(header, rows, first_row, index=None):
+    # (類別, 名稱) → {列號: _id}；改名時只需寫入這些列的儲存格
+    index = {} if index is None else index
+    if '類別' not in header or '名稱' not in header: return index
+    i_cat = header.index('類別'); i_name = header.index('名稱'); i_id = header.index('_id') if '_id' in header else None
+    for i, r in enumerate(rows, start=first_row):
+        if not any(str(v).strip() for v in r): continue
+        cell = lambda j: str(r[j]) if j is not None and j < len(r) else ''
+        index.setdefault((cell(i_cat), cell(i_name)), {})[i] = cell(i_id)
+    return index
+
+def record_month(date_value):
+    return record_day(date_value)[:7]
+
+def partition_title(project, month):
+    # 工作表名稱有長度限制，專案名稱以雜湊代表；日期無效的列歸入 invalid 分區
+    return f"d_{month or 'invalid'}_{hashlib.md5(str(project).encode('utf-8')).hexdigest()[:8]}"
+
+def _sheet_row(header, r):
+    return [_cell_value(c, r.get(c, '') or 0) if c in NUM_COLS else str(r.get(c, ''))[:10] if c == '日期' else str(r.get(c, '')) for c in header]
+
+def _end_row(res):
+    # append 回應中的實際寫入範圍，例如 'd_2025-01_xxx'!A15:J17 → 17
+    m = re.search(r'![A-Z]+\d+:[A-Z]+(\d+)', (res or {}).get('updates', {}).get('updatedRange', ''))
+    return int(m.group(1)) if m else None
+
+def partition_legacy_sheet(log=lambda msg: None):
+    # 將單一 sheet1 轉為分區工作表 + _manifest (sheet1 保留不動作為備份)；回傳分區中的紀錄筆數
+    # 只在尚未分區時執行：_manifest 已有分區就不動 (轉換後 sheet1 不再更新，重新轉換會以舊資料蓋掉之後的新增/修改)；
+    # 上次轉換中斷時已寫入資料的分區工作表保留不動，只補上其餘分區與 _manifest
+    done = get_sheet(MANIFEST_SHEET, create=False)
+    if done is not None and len(done.get_all_values()) > 1:
+        log("已經分區 (_manifest 已有分區)，不重新轉換"); return 0
+    legacy = get_sheet(LEGACY_SHEET, create=False)
+    if legacy is None: return 0
+    values = legacy.get_all_values()
+    if len(values) < 2: return 0
+    header = values[0] + ([] if '_id' in values[0] else ['_id'])
+    groups = {}
+    for r in values[1:]:
+        r = r + [''] * (len(header) - len(r))
+        if not any(str(v).strip() for v in r): continue
+        rec = dict(zip(header, r)); rec['_id'] = rec['_id'] or new_row_id()
+        groups.setdefault((rec['專案'], record_month(rec['日期'])), []).append([rec.get(c, '') for c in SHEET_HEADER])
+    manifest = [MANIFEST_HEADER]
+    for (project, month), rows in groups.items():
+        t = partition_title(project, month); sheet = get_sheet(t, create=False)
+        kept = max(len(sheet.get_all_values()) - 1, 0) if sheet is not None else 0
+        if kept:
+            manifest.append([t, project, month, kept, 0]); log(f"{project} {month or '(日期無效)'}: {t} 已有 {kept} 筆，保留不動"); continue
+        with_sheet(t, lambda s: (s.clear(), s.append_rows([SHEET_HEADER] + rows)))
+        manifest.append([t, project, month, len(rows), 0]); log(f"{project} {month or '(日期無效)'}: {len(rows)} 筆 → {t}")
+    with_sheet(MANIFEST_SHEET, lambda s: (s.clear(), s.append_rows(manifest)))
+    return sum(r[3] for r in manifest[1:])
+
+class Partition:
+    # 單一分區工作表的快取；row_count 為工作表中的資料列數 (不含標題，含日期無效而未載入的列)
+    def __init__(self):
+        self.df = None; self.header = []; self.row_count = 0; self.loaded_at = 0.0; self.revision = 0   # revision：載入時分區清單的版本
+        self.mem = (None, 0, 0)   # (計算時的 df, 精簡格式位元組, 舊格式位元組)
+        self.index = None         # name_index (與 row_count/revision 同步)；None：需重新讀取類別/名稱欄
+        self.saved = None         # 最近一次寫入本機快照的 df
+
+    def memory(self):
+        if self.df is None: return 0, 0
+        if self.mem[0] is not self.df: self.mem = (self.df, *memory_usage(self.df))
+        return self.mem[1:]
+
+def snapshot_path(t):
+    return os.path.join(SNAPSHOT_DIR, f"{SHEET_NAME}__{t}.arrow")
+
+def save_snapshot(t, p):
+    # 分區快取寫入本機快照，標記列數/版本/標題；先寫暫存檔再換名，不會讀到寫一半的檔案
+    table = pa.Table.from_pandas(p.df, preserve_index=False)
+    meta = json.dumps({'row_count': p.row_count, 'revision': p.revision, 'header': p.header}, ensure_ascii=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'snapshot': meta.encode('utf-8')})
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True); tmp = f"{snapshot_path(t)}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp, 'wb') as f, pa.ipc.new_file(f, table.schema) as w: w.write_table(table)
+    os.replace(tmp, snapshot_path(t)); p.saved = p.df
+
+def load_snapshot(t):
+    # 回傳快照的 Partition (列數/版本為寫入當時的值)；沒有快照時為 None
+    if not SNAPSHOT_DIR or not os.path.exists(snapshot_path(t)): return None
+    with pa.memory_map(snapshot_path(t)) as src:
+        table = pa.ipc.open_file(src).read_all(); df = table.to_pandas()
+    meta = json.loads(table.schema.metadata[b'snapshot'])
+    p = Partition(); p.df = p.saved = df; p.header = meta['header']; p.row_count = meta['row_count']; p.revision = meta['revision']
+    p.loaded_at = time.time()   # 之後與一般快取相同：依清單的列數/版本補抓差異，逾時完整重讀
+    return p
+
+def drop_snapshot(t):
+    try: os.remove(snapshot_path(t))
+    except OSError: pass
+
+class GoogleSheetsBackend(StorageBackend):
+    # 資料集跨 session 共用；只讀取畫面需要的分區，並依 _manifest 的列數只抓取新增列
+    name = "sheets"
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.manifest = None; self.manifest_at = 0.0; self.manifest_has_header = False; self.manifest_has_version = False; self.manifest_has_cube = False; self.legacy_checked = False
+        self.parts = {}; self.revision = 0   # revision：本程序每次寫入 +1
+        self.cube_parts = {}; self.cube_moved = set()   # 彙總分區的快取 (與分區共用 self.lock)；cube_moved：已寫入紀錄、待寫入彙總增量的分區
+        self.cube_failures = 0; self.cube_error = None  # 彙總增量寫入失敗的次數與最後的錯誤 (該分區改為下次讀取時重建)
+        self.queue = get_write_queue(JOURNAL_FILE); self.text_index = TextIndex()
+
+    # --- 分區清單 ---
+    def _read_manifest(self, sheet):
+        return self._parse_manifest(sheet.get_all_values())
+
+    def _parse_manifest(self, values):
+        entries = {}
+        self.manifest_has_header = bool(values); self.manifest_has_version = bool(values) and len(values[0]) >= 5; self.manifest_has_cube = bool(values) and len(values[0]) >= 6
+        for i, r in enumerate(values[1:], start=2):
+            r = r + [''] * (len(MANIFEST_HEADER) - len(r))
+            if r[0]: entries[r[0]] = {'專案': r[1], '月份': r[2], '列數': int(float(r[3] or 0)), '版本': int(_float(r[4])), '彙總': r[5], 'row': i}
+        return entries
+
+    def _manifest(self):
+        if self.manifest is None or time.time() - self.manifest_at > DATA_CACHE_TTL:
+            try: entries = with_sheet(MANIFEST_SHEET, self._read_manifest)
+            except:
+                if self.manifest is None: raise
+                entries = self.manifest
+            if not entries and not self.legacy_checked:
+                # 尚未分區：將舊的 sheet1 轉換為分區 (只需一次)
+                self.legacy_checked = True
+                if partition_legacy_sheet(): entries = with_sheet(MANIFEST_SHEET, self._read_manifest)
+            self.manifest = entries; self.manifest_at = time.time()
+        return self.manifest
+
+    def _save_manifest_counts(self, titles, revised=()):
+        # revised：就地修改過的分區，一併寫入新版本 (舊的分區清單補上「版本」標題)
+        data = [{"range": f"D{self.manifest[t]['row']}", "values": [[self.manifest[t]['列數']]]} for t in titles if t in self.manifest]
+        data += [{"range": f"E{self.manifest[t]['row']}", "values": [[self.manifest[t]['版本']]]} for t in revised if t in self.manifest]
+        if revised and not self.manifest_has_version: data.append({"range": "E1", "values": [[MANIFEST_HEADER[4]]]}); self.manifest_has_version = True
+        if data: with_sheet(MANIFEST_SHEET, lambda s: s.batch_update(data))
+
+    def _add_manifest_entry(self, t, project, month, count):
+        res = with_sheet(MANIFEST_SHEET, lambda s: s.append_rows([[t, project, month, count, 0]] if self.manifest_has_header else [MANIFEST_HEADER, [t, project, month, count, 0]]))
+        if not self.manifest_has_header: self.manifest_has_version = self.manifest_has_cube = True
+        self.manifest_has_header = True
+        self.manifest[t] = {'專案': project, '月份': month, '列數': count, '版本': 0, '彙總': '', 'row': _end_row(res) or len(self.manifest) + 2}
+
+    # --- 分區資料 ---
+    def _reload(self, p, sheet):
+        values = sheet.get_all_values()
+        header = values[0] if values else []
+        if header and '_id' not in header:
+            header.append('_id'); sheet.update(values=[['_id']], range_name=gspread.utils.rowcol_to_a1(1, len(header)))
+        if header: _assign_missing_ids(sheet, header, values[1:], 2)
+        p.header = header
+        p.row_count = max(len(values) - 1, 0)
+        p.df = build_frame(p.header, values[1:]) if p.row_count else empty_frame()
+        p.index = name_index(header, values[1:], 2); p.loaded_at = time.time()
+
+    def _fetch_appended(self, p, sheet):
+        # 只抓取上次已知列數之後新增的列
+        rows = sheet.get_values(f"A{p.row_count + 2}:{_col_letter(len(p.header))}")
+        while rows and not any(str(v).strip() for v in rows[-1]): rows.pop()
+        if rows:
+            _assign_missing_ids(sheet, p.header, rows, p.row_count + 2)
+            if p.index is not None: name_index(p.header, rows, p.row_count + 2, p.index)
+            p.df = concat_frames([p.df, build_frame(p.header, rows)])
+            p.row_count += len(rows)
+
+    def _partition(self, t):
+        # 未載入/逾時→完整讀取；清單列數較多→只抓新增列；較少 (他處刪除) 或版本不同 (他處修改)→重新讀取
+        # 程序重啟後先載入本機快照，同樣依清單只補抓差異；讀到的新版本寫回快照
+        count = self.manifest[t]['列數']; revision = self.manifest[t]['版本']; p = self.parts.get(t)
+        if p is None:
+            try: p = load_snapshot(t)
+            except: p = None; drop_snapshot(t)   # 損毀或格式不符
+        try:
+            if p is None or p.df is None or not p.header or time.time() - p.loaded_at > DATA_FULL_RELOAD or count < p.row_count or revision != p.revision:
+                fresh = Partition(); fresh.revision = revision; with_sheet(t, lambda s: self._reload(fresh, s)); p = fresh
+            elif count > p.row_count: with_sheet(t, lambda s: self._fetch_appended(p, s))
+        except:
+            if p is None or p.df is None: raise
+        self.parts[t] = p
+        if SNAPSHOT_DIR and p.saved is not p.df:
+            try: save_snapshot(t, p)
+            except: pass   # 快照只是加速，寫入失敗不影響讀取
+        return p
+
+    def _titles(self, project=None, months=None):
+        return [t for t, e in self._manifest().items() if (project is None or e['專案'] == project) and (months is None or e['月份'] in months)]
+
+    def _with_pending(self, df, project=None, months=None):
+        # 尚未上傳的新增紀錄也立即出現在資料集中
+        known = set(df['_id'])
+        pending = [r for r in self.queue.pending_records() if r['_id'] not in known and (project is None or r['專案'] == project) and (months is None or record_month(r['日期']) in months)]
+        if not pending: return df
+        return concat_frames([df, build_frame(SHEET_HEADER, [[str(r.get(c, '')) for c in SHEET_HEADER] for r in pending])])
+
+    def known_ids(self, records):
+        # 待上傳紀錄所屬分區中已存在的 _id (避免重複上傳)
+        with self.lock:
+            titles = {partition_title(r['專案'], record_month(r['日期'])) for r in records}
+            manifest = self._manifest()
+            return {rid for t in titles if t in manifest for rid in self._partition(t).df['_id']}
+
+    def load_records(self, project=None, months=None):
+        months = None if months is None else set(months)
+        # 單一分區直接回傳共用的快取 (唯讀)；多個分區才合併
+        with self.lock:
+            frames = [self._partition(t).df for t in self._titles(project, months)]
+        return self._with_pending(concat_frames(frames), project, months)
+
+    def _search_frames(self, project):
+        # 逐個分區 (不合併，分區未變動就不必重新掃描) + 尚未上傳的新增
+        with self.lock: frames = [self._partition(t).df for t in self._titles(project)]
+        pending = self._with_pending(empty_frame(), project)
+        return frames + ([pending] if len(pending) else [])
+
+    def list_months(self, project):
+        # 只讀分區清單，不下載資料
+        with self.lock: months = {e['月份'] for e in self._manifest().values() if e['專案'] == project and e['列數'] > 0}
+        months |= {record_month(r['日期']) for r in self.queue.pending_records() if r['專案'] == project}
+        return sorted((m for m in months if m), reverse=True)
+
+    def invalidate(self):
+        # 寫入失敗後不確定雲端狀態：已載入分區的快照一併捨棄
+        with self.lock:
+            for t in self.parts: drop_snapshot(t)
+            self.parts = {}; self.manifest = None; self.cube_parts = {}; self.cube_moved = set()
+
+    def _has_records(self):
+        with self.lock: return any(e['列數'] > 0 for e in self._manifest().values())
+
+    def _rows_by_id(self, ids):
+        # 從已載入的分區查詢 (先送出待上傳的新增)；未載入分區的列無法取得舊值
+        if not ids: return {}
+        self.queue.flush()
+        with self.lock:
+            self._manifest(); out = {}
+            for t in [t for t in self.parts if t in self.manifest]:
+                df = self._partition(t).df
+                out.update({r['_id']: r for r in df[df['_id'].isin(ids)].to_dict('records')})
+            return out
+
+    # --- 成本彙總：每個分區一張彙總表 (c_…)，只讀取要求的月份 ---
+    def load_cube(self, project, months=None):
+        # 尚未上傳的新增紀錄也計入
+        months = None if months is None else set(months)
+        with self.lock: cube = {k: v for part in self._cube_parts(self._titles(project, months)) for k, v in part.cube.items() if k[0] == project}
+        pending = [r for r in self.queue.pending_records() if r['專案'] == project and (months is None or record_month(r['日期']) in months)]
+        if pending: cube = merge_cube({k: list(v) for k, v in cube.items()}, cube_delta(pending))
+        df = pd.DataFrame(cube_to_rows(cube), columns=CUBE_HEADER); df['月份'] = df['日期'].str[:7]
+        return df
+
+    def _cube_parts(self, titles):
+        # 快取與分區清單的列數:版本一致者直接使用；清單「彙總」欄相符的彙總分區一次 values_batch_get 讀取，其餘由該分區的紀錄重建
+        manifest = self._manifest()
+        need = [t for t in titles if t in manifest and not (t in self.cube_parts and self.cube_parts[t].sig == cube_sig(manifest[t]))]
+        fetch = [t for t in need if manifest[t]['彙總'] == cube_sig(manifest[t])]
+        if fetch:
+            try:
+                res = with_spreadsheet(lambda sh: sh.values_batch_get([f"'{cube_part_title(t)}'!A:{_col_letter(len(CUBE_HEADER))}" for t in fetch]))
+                for t, vr in zip(fetch, res.get('valueRanges', [])):
+                    try: self.cube_parts[t] = CubePart(cube_sig(manifest[t]), vr.get('values', []))
+                    except ValueError: pass   # 內容損毀：重建
+            except Exception as e:
+                if not _missing_range(e): raise   # 彙總表被刪除：重建
+        rebuilt = [t for t in need if t not in self.cube_parts or self.cube_parts[t].sig != cube_sig(manifest[t])]
+        for t in rebuilt: self._rebuild_cube_part(t)
+        self._mark_cubes(rebuilt)
+        return [self.cube_parts[t] for t in titles if t in self.cube_parts]
+
+    def _rebuild_cube_part(self, t):
+        # 整張改寫 (標題 + 依鍵排序的列)；之後由 _mark_cubes 在分區清單記下對應的列數:版本
+        rows = cube_to_rows(frame_cube(self._partition(t).df)); c = cube_part_title(t)
+        with_sheet(c, lambda s: (s.clear(), s.append_rows([CUBE_HEADER] + rows)))
+        self.cube_parts[t] = CubePart(cube_sig(self.manifest[t]), [CUBE_HEADER] + rows)
+
+    def _mark_cubes(self, titles):
+        # 重建的彙總分區一次寫入分區清單的「彙總」欄
+        data = self._cube_marks({t: cube_sig(self.manifest[t]) for t in titles})
+        if data: with_spreadsheet(lambda sh: sh.values_batch_update({"valueInputOption": "RAW", "data": data}))
+        for t in titles: self.manifest[t]['彙總'] = cube_sig(self.manifest[t])
+
+    def _cube_marks(self, sigs):
+        # 分區清單「彙總」欄的寫入 {分區: 列數:版本} (舊的分區清單補上標題)
+        data = [{"range": f"'{MANIFEST_SHEET}'!F{self.manifest[t]['row']}", "values": [[sig]]} for t, sig in sigs.items()]
+        if data and not self.manifest_has_cube:
+            data.append({"range": f"'{MANIFEST_SHEET}'!E1:F1", "values": [MANIFEST_HEADER[4:]]}); self.manifest_has_version = self.manifest_has_cube = True
+        return data
+
+    def _advance_cube(self, t, old):
+        # 本程序改了分區的列數/版本 (old：寫入前試算表上的列數:版本)：與 old 一致的彙總快取跟著前進，增量稍後由 _update_cube 寫入；
+        # 不一致 (他處也寫入過) 則捨棄，清單的「彙總」欄因此不符，下次讀取時重建
+        part = self.cube_parts.get(t)
+        if part is None: return
+        if part.sig == old: part.sig = cube_sig(self.manifest[t]); self.cube_moved.add(t)
+        else: self.cube_parts.pop(t)
+
+    def _prepare_cube(self): pass
+
+    def _update_cube(self, delta):
+        # 依分區分組，只寫入變動的鍵 (鍵 → 列號)；新鍵先填清空的列，不夠才附加
+        groups = {}
+        for k, v in delta.items():
+            if any(v): groups.setdefault(partition_title(k[0], k[1][:7]), {})[k] = v
+        with self.lock:
+            titles = sorted(self.cube_moved | set(groups)); self.cube_moved = set()
+            # 紀錄已寫入，彙總失敗不回報為存檔失敗；捨棄快取，清單的「彙總」欄不符而於下次讀取時重建
+            try: self._write_cube(titles, groups)
+            except Exception as e:
+                self.cube_failures += 1; self.cube_error = f"{', '.join(titles)}: {e}"
+                for t in titles: self.cube_parts.pop(t, None)
+
+    def _write_cube(self, titles, groups):
+        # 變動的列、清空的列與分區清單的「彙總」欄一次 values_batch_update；新鍵依分區 append_rows (接在最後使用的列之後)
+        data = []; synced = []
+        for t in titles:
+            part = self.cube_parts.get(t); e = self.manifest.get(t) if self.manifest else None
+            if part is None or e is None or part.sig != cube_sig(e): self.cube_parts.pop(t, None); continue
+            cells, appends = part.apply(groups.get(t, {})); c = cube_part_title(t)
+            if appends:
+                end = _end_row(with_sheet(c, lambda s: s.append_rows([r for _, r in appends], table_range=f"A{part.end + 1}")))
+                if not end: self.cube_parts.pop(t); continue
+                part.placed(appends, end)
+            data += [{"range": f"'{c}'!A{i}:{_col_letter(len(CUBE_HEADER))}{i}", "values": [r]} for i, r in sorted(cells.items())]
+            synced.append(t)
+        data += self._cube_marks({t: cube_sig(self.manifest[t]) for t in synced})
+        if data: with_spreadsheet(lambda sh: sh.values_batch_update({"valueInputOption": "RAW", "data": data}))
+        for t in synced: self.manifest[t]['彙總'] = cube_sig(self.manifest[t])
+
+    def rebuild_cube(self):
+        # 逐一分區重建 (命令列 cube)
+        cube = {}
+        with self.lock:
+            titles = sorted(self._titles())
+            for t in titles: self._rebuild_cube_part(t); cube.update(self.cube_parts[t].cube)
+            self._mark_cubes(titles)
+        return cube
+
+    def load_startup(self):
+        # 設定、單價與分區清單以一次 values_batch_get 讀取；有工作表尚未建立 (第一次使用) 而失敗時改為同時送出各自的讀取
+        titles = [SETTINGS_SHEET, PRICES_SHEET, MANIFEST_SHEET]
+        widths = [len(SETTINGS_HEADER), len(PRICES_HEADER), len(MANIFEST_HEADER)]
+        timings = {}; t0 = time.perf_counter()
+        try: res = with_spreadsheet(lambda sh: sh.values_batch_get([f"'{t}'!A:{_col_letter(w)}" for t, w in zip(titles, widths)]))
+        except Exception as e:
+            if not _missing_range(e): raise
+            return self._load_startup_parallel()
+        values = [vr.get('values', []) for vr in res.get('valueRanges', [])]
+        values += [[]] * (len(titles) - len(values))
+        timings['批次讀取'] = round(time.perf_counter() - t0, 4); t0 = time.perf_counter()
+        settings = self.load_settings([r + [''] * (widths[0] - len(r)) for r in values[0][1:] if any(r)])
+        timings['設定'] = round(time.perf_counter() - t0, 4); t0 = time.perf_counter()
+        prices = self.load_prices([r + [''] * (widths[1] - len(r)) for r in values[1][1:] if any(r)])
+        timings['單價'] = round(time.perf_counter() - t0, 4); t0 = time.perf_counter()
+        with self.lock:
+            entries = self._parse_manifest(values[2])
+            if entries: self.manifest = entries; self.manifest_at = time.time()   # 沒有分區時留給 _manifest() 檢查舊的 sheet1
+        timings['分區清單'] = round(time.perf_counter() - t0, 4)
+        return settings, prices, timings
+
+    def _load_startup_parallel(self):
+        def timed(fn):
+            t0 = time.perf_counter(); out = fn(); return out, round(time.perf_counter() - t0, 4)
+        def manifest():
+            with self.lock: self._manifest()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            jobs = [pool.submit(timed, fn) for fn in (self.load_settings, self.load_prices, manifest)]
+            (settings, t_s), (prices, t_p), (_, t_m) = [j.result() for j in jobs]
+        return settings, prices, {'平行讀取': round(time.perf_counter() - t0, 4), '設定': t_s, '單價': t_p, '分區清單': t_m}
+
+    # --- 本機快照 (命令列工具) ---
+    def rebuild_snapshots(self, log=print):
+        # 所有分區由雲端完整讀取後寫入快照；回傳分區數
+        with self.lock:
+            self.manifest = None; manifest = self._manifest()
+            for t in sorted(manifest):
+                p = Partition(); p.revision = manifest[t]['版本']; with_sheet(t, lambda s: self._reload(p, s))
+                save_snapshot(t, p); self.parts[t] = p; log(f"{t}: {p.row_count} 列")
+            return len(manifest)
+
+    def verify_snapshots(self, content=True, log=print):
+        # 快照的列數/版本與分區清單比對 (content：再與雲端資料逐列比對)；回傳需要重建的分區數
+        with self.lock:
+            self.manifest = None; manifest = self._manifest(); bad = 0
+            for t in sorted(manifest):
+                e = manifest[t]
+                try: snap = load_snapshot(t)
+                except Exception as ex: log(f"{t}: 快照無法讀取 ({ex})"); bad += 1; continue
+                if snap is None: log(f"{t}: 沒有快照"); bad += 1; continue
+                if snap.revision != e['版本'] or snap.row_count > e['列數']:
+                    log(f"{t}: 快照 {snap.row_count} 列/版本 {snap.revision}，雲端 {e['列數']} 列/版本 {e['版本']}"); bad += 1; continue
+                if content:
+                    p = Partition(); with_sheet(t, lambda s: self._reload(p, s))
+                    cloud = p.df.head(len(snap.df)) if snap.row_count < e['列數'] else p.df
+                    key = lambda df: _normalized(df, SHEET_HEADER).sort_values('_id').reset_index(drop=True)
+                    if not key(snap.df).equals(key(cloud)): log(f"{t}: 內容與雲端不同"); bad += 1; continue
+                log(f"{t}: OK" + (f" (落後 {e['列數'] - snap.row_count} 列，啟動時補抓)" if snap.row_count < e['列數'] else ""))
+            return bad
+
+    def dataset_memory(self):
+        with self.lock: parts = [p for p in self.parts.values() if p.df is not None]
+        sizes = [p.memory() for p in parts]
+        return sum(a for a, _ in sizes), sum(b for _, b in sizes)
+
+    def data_version(self):
+        # 分區清單的列數與版本 + 本程序的寫入次數 + 待上傳筆數；不下載任何資料
+        with self.lock: counts = sorted((t, e['列數'], e['版本']) for t, e in self._manifest().items())
+        return hashlib.sha1(json.dumps([counts, self.revision, self.queue.pending_count()]).encode()).hexdigest()
+
+    def iter_records(self, chunk=1000):
+        # 一次只載入一個分區
+        with self.lock: titles = sorted(self._titles())
+        for t in titles:
+            with self.lock: df = self._partition(t).df
+            for i in range(0, len(df), chunk): yield df.iloc[i:i + chunk]
+        pending = self._with_pending(empty_frame())
+        if len(pending): yield pending
+
+    def _insert_records(self, records):
+        # 依 (專案, 月份) 分組，每個分區一次 append_rows；分區清單的列數一次更新
+        groups = {}
+        for r in records: groups.setdefault((str(r.get('專案', '')), record_month(r.get('日期'))), []).append(r)
+        with self.lock:
+            manifest = self._manifest(); touched = []; self.revision += 1
+            for (project, month), recs in groups.items():
+                t = partition_title(project, month); p = self.parts.get(t)
+                header = p.header if p is not None and p.header else list(SHEET_HEADER); new_sheet = False
+                if t not in manifest or (manifest[t]['列數'] == 0 and not (p is not None and p.header)):
+                    # 清單沒有列數時以工作表的第一列為準 (上次 append 後、更新清單前中斷的分區已有標題與資料)
+                    first = with_sheet(t, lambda s: s.get_values("1:1"))
+                    if first and any(first[0]): header = first[0]
+                    else: new_sheet = True
+                rows = [_sheet_row(header, r) for r in recs]
+                res = with_sheet(t, lambda s: s.append_rows([header] + rows if new_sheet else rows))
+                end = _end_row(res)
+                if t not in manifest: self._add_manifest_entry(t, project, month, (end or len(rows) + 1) - 1)
+                else:
+                    before = manifest[t]['列數']; old = f"{end - 1 - len(rows)}:{manifest[t]['版本']}" if end else None
+                    manifest[t]['列數'] = end - 1 if end else before + len(rows); touched.append(t); self._advance_cube(t, old)
+                # 新增列緊接在快取資料之後才直接補進快取，否則讓下次讀取補抓
+                if p is not None and p.df is not None and p.header and end == p.row_count + 1 + len(rows):
+                    if p.index is not None: name_index(p.header, rows, p.row_count + 2, p.index)
+                    p.df = concat_frames([p.df, build_frame(p.header, [[str(v) for v in r] for r in rows])])
+                    p.row_count += len(rows)
+            self._save_manifest_counts(touched)
+
+    def append_records(self, records):
+        self.queue.put(records)
+
+    def write_status(self):
+        return self.queue.pending_count(), self.queue.flushed, self.queue.last_error
+
+    def quota_status(self):
+        return SCHEDULER.status()
+
+    def cube_status(self):
+        with self.lock: return self.cube_failures, self.cube_error
+
+    def _apply_changes(self, updates, deletes, inserts, base):
+        # 跨分區：先一次 values_batch_get 讀取各分區的 _id/_ver 欄與分區清單的版本欄 (條件式寫入的依據)，
+        # 變動的儲存格一次 values_batch_update、刪列一次 batch_update、新增列依分區 append_rows
+        if not (updates or deletes or inserts): return [], {}
+        self.queue.flush()   # 先送出待上傳的新增，編輯才找得到這些列
+        updates = dict(updates); deletes = list(deletes); inserts = list(inserts); conflicts = []; fresh = {}
+        with self.lock:
+            self._manifest(); self.revision += 1
+            owner = {rid: t for t, p in self.parts.items() if p.df is not None for rid in p.df['_id']}
+            touched = sorted({owner[r] for r in list(updates) + deletes if r in owner})
+            row_of = {}; ver_of = {}; consistent = {}; counts = {}; revs = []
+            if touched:
+                spans = {}
+                for t in touched:
+                    h = self.parts[t].header; idx = [h.index(c) for c in ('_id', '_ver') if c in h]
+                    spans[t] = (f"'{t}'!{_col_letter(min(idx) + 1)}:{_col_letter(max(idx) + 1)}", h.index('_id') - min(idx), h.index('_ver') - min(idx) if '_ver' in h else None)
+                res = with_spreadsheet(lambda sh: sh.values_batch_get([spans[t][0] for t in touched] + [f"'{MANIFEST_SHEET}'!E:E"]))
+                vrs = res.get('valueRanges', [])
+                if len(vrs) > len(touched): revs = [r[0] if r else '' for r in vrs[len(touched)].get('values', [])]
+                for t, vr in zip(touched, vrs):
+                    _, i_id, i_ver = spans[t]; vals = vr.get('values', [])
+                    consistent[t] = len(vals) - 1 == self.parts[t].row_count; counts[t] = max(len(vals) - 1, 0)
+                    for i, r in enumerate(vals[1:], start=2):
+                        rid = r[i_id] if len(r) > i_id else ''
+                        if rid: row_of[(t, rid)] = i; ver_of[rid] = int(_float(r[i_ver])) if i_ver is not None and len(r) > i_ver else 0
+            # 快取中的版本與試算表不同 (他處已修改/刪除)：讀取這幾列目前的值，作為合併與彙總的依據
+            cached = {}
+            for t in touched:
+                df = self.parts[t].df; df = df[df['_id'].isin(set(updates) | set(deletes))]
+                cached.update({r['_id']: r for r in df.to_dict('records')})
+            stale = [rid for rid in cached if (owner[rid], rid) not in row_of or ver_of[rid] != cached[rid]['_ver']]
+            if stale:
+                found = [rid for rid in stale if (owner[rid], rid) in row_of]
+                ranges = [f"'{owner[rid]}'!A{row_of[(owner[rid], rid)]}:{_col_letter(len(self.parts[owner[rid]].header))}{row_of[(owner[rid], rid)]}" for rid in found]
+                res = with_spreadsheet(lambda sh: sh.values_batch_get(ranges)) if ranges else {}
+                fresh = {rid: None for rid in stale}
+                for rid, vr in zip(found, res.get('valueRanges', [])):
+                    cur = build_frame(self.parts[owner[rid]].header, vr.get('values', [])[:1]).to_dict('records')
+                    if cur: fresh[rid] = cached[rid] = cur[0]
+                    else: fresh[rid] = cached[rid]   # 日期已無效而無法解析：仍以快取的列為準
+                for rid in stale:
+                    if fresh[rid] is None: cached.pop(rid)
+                    consistent[owner[rid]] = False
+            current = row_snapshot(pd.DataFrame(list(cached.values()), columns=DATA_COLS)) if cached else {}
+            # 不在已載入分區中的列視為已被刪除 (有 base 的修改回報為衝突)
+            updates, deletes, conflicts = merge_changes(updates, deletes, base, current)
+            # 改了日期或專案而換分區的列：舊分區刪除、新分區新增
+            for rid, cells in list(updates.items()):
+                t = owner.get(rid)
+                if t is None or rid not in cached or not ({'日期', '專案'} & set(cells)): continue
+                rec = {**cached[rid], **cells}
+                if partition_title(rec['專案'], record_month(rec['日期'])) != t:
+                    rec['日期'] = str(rec['日期'])[:10]; rec['_ver'] = ver_of.get(rid, 0) + 1
+                    inserts.append({c: rec.get(c, '') for c in SHEET_HEADER})
+                    del updates[rid]; deletes.append(rid)
+            if touched:
+                data = []
+                for t in touched:
+                    header = self.parts[t].header
+                    if '_ver' not in header and any(owner.get(rid) == t for rid in updates):
+                        header.append('_ver'); data.append({"range": f"'{t}'!" + gspread.utils.rowcol_to_a1(1, len(header)), "values": [['_ver']]})
+                for rid, cells in updates.items():
+                    t = owner.get(rid)
+                    if (t, rid) not in row_of: continue
+                    header = self.parts[t].header
+                    for c, v in {**cells, '_ver': ver_of[rid] + 1}.items():
+                        if c in header: data.append({"range": f"'{t}'!" + gspread.utils.rowcol_to_a1(row_of[(t, rid)], header.index(c) + 1), "values": [[_cell_value(c, v)]]})
+                if data: with_spreadsheet(lambda sh: sh.values_batch_update({"valueInputOption": "RAW", "data": data}))
+                reqs = []; removed = {}
+                for t in touched:
+                    rows = {row_of[(t, rid)] for rid in deletes if owner.get(rid) == t and (t, rid) in row_of}
+                    spans = row_spans(rows)
+                    if spans:
+                        sheet_id = get_sheet(t).id
+                        reqs += [{"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": a - 1, "endIndex": b}}} for a, b in spans]
+                    removed[t] = len(rows)
+                if reqs: with_spreadsheet(lambda sh: sh.batch_update({"requests": reqs}))
+                # 更新分區快取、清單列數與版本 (就地修改/刪除過的分區版本 +1，他處的快取因此重新讀取)
+                revised = []
+                for t in touched:
+                    p = self.parts[t]; e = self.manifest[t]; sig = cube_sig(e)
+                    old = f"{counts.get(t, e['列數'])}:{int(_float(revs[e['row'] - 1])) if len(revs) >= e['row'] else e['版本']}"   # 寫入前試算表上的列數:版本
+                    if removed[t]: e['列數'] = max(e['列數'] - removed[t], 0)
+                    if removed[t] or any(owner.get(rid) == t and (t, rid) in row_of for rid in updates):
+                        e['版本'] = max(e['版本'], int(_float(revs[e['row'] - 1])) if len(revs) >= e['row'] else 0) + 1; revised.append(t)
+                    if cube_sig(e) != sig: self._advance_cube(t, old)
+                    if removed[t] or any(owner.get(rid) == t and {'類別', '名稱'} & set(cells) for rid, cells in updates.items()): p.index = None   # 列號或鍵已變
+                    if not consistent[t]: p.df = None; continue
+                    df = editable_frame(p.df).set_index('_id', drop=False)
+                    for rid, cells in updates.items():
+                        if owner.get(rid) != t or rid not in df.index: continue
+                        for c, v in {**cells, '_ver': ver_of.get(rid, 0) + 1}.items():
+                            if c in df.columns: df.at[rid, c] = v
+                    df = df.drop(index=[r for r in deletes if owner.get(r) == t and r in df.index]).reset_index(drop=True)
+                    p.df = compact_frame(df); p.row_count -= removed[t]; p.revision = e['版本']
+                self._save_manifest_counts([t for t in touched if removed[t]], revised)
+            if inserts: self._insert_records(inserts)
+        return conflicts, fresh
+
+    def rename_items(self, project, category, renames):
+        # 一次 values_batch_get 讀取分區清單與設定/單價列 (分區的 name_index 過期時連同該分區的類別~_ver 欄)，
+        # 再以一次 values_batch_update 寫入：各分區要改的名稱與 _ver、設定與單價的鍵、彙總分區改鍵的列與分區清單的版本/彙總
+        check_renames(renames)
+        self.queue.flush()
+        with self.lock: count = self._rename_cells(project, category, renames)
+        if count is None: return super().rename_items(project, category, renames)   # 有工作表尚未建立
+        return count
+
+    def _rename_cells(self, project, category, renames):
+        # 回傳改名筆數 (None：有工作表尚未建立)
+        keys = {(category, old): new for old, new in renames.items()}
+        tables = [(SETTINGS_SHEET, len(SETTINGS_HEADER)), (PRICES_SHEET, len(PRICES_HEADER)), (MANIFEST_SHEET, len(MANIFEST_HEADER))]
+        self._manifest()
+        def consistent(t):
+            p = self.parts.get(t); e = self.manifest.get(t)
+            return p is not None and p.df is not None and bool(p.header) and e is not None and e['列數'] == p.row_count and e['版本'] == p.revision
+        def span(t):
+            p = self.parts.get(t); h = p.header if p is not None and p.header else SHEET_HEADER
+            idx = [h.index(c) for c in ('類別', '名稱', '_id', '_ver') if c in h]
+            return min(idx), max(idx)
+        def lookup_range(t):
+            lo, hi = span(t); return f"'{t}'!{_col_letter(lo + 1)}:{_col_letter(hi + 1)}"
+        lookup = [t for t in self._titles(project) if not (consistent(t) and self.parts[t].index is not None)]
+        try: res = with_spreadsheet(lambda sh: sh.values_batch_get([f"'{t}'!A:{_col_letter(w)}" for t, w in tables] + [lookup_range(t) for t in lookup]))
+        except Exception as e:
+            if not _missing_range(e): raise
+            return None
+        vrs = [vr.get('values', []) for vr in res.get('valueRanges', [])]
+        vrs += [[]] * (len(tables) + len(lookup) - len(vrs))
+        entries = self._parse_manifest(vrs[2])
+        if entries: self.manifest = entries; self.manifest_at = time.time()
+        found = dict(zip(lookup, vrs[len(tables):]))
+        missed = [t for t in self._titles(project) if t not in found and not (consistent(t) and self.parts[t].index is not None)]   # 他處剛新增/修改的分區
+        if missed:
+            res = with_spreadsheet(lambda sh: sh.values_batch_get([lookup_range(t) for t in missed]))
+            found.update(zip(missed, [vr.get('values', []) for vr in res.get('valueRanges', [])] + [[]] * len(missed)))
+        # 各分區要改的列 {列號: (_id, 目前的 _ver 或 None, 新名稱)} 與名稱/_ver 欄的位置
+        data = []; hits = {}; indexes = {}
+        for t in self._titles(project):
+            p = self.parts.get(t)
+            if t in found:
+                vals = found[t]; lo, _ = span(t); sub = vals[0] if vals else []
+                if vals and '名稱' not in sub: continue   # 標題與預期不同：略過 (下次讀取分區時重建索引)
+                rows = [r + [''] * (len(sub) - len(r)) for r in vals[1:]]
+                indexes[t] = name_index(sub, rows, 2)
+                i_ver = sub.index('_ver') if '_ver' in sub else None
+                got = {i: (rid, int(_float(rows[i - 2][i_ver])) if i_ver is not None else None, new) for k, new in keys.items() for i, rid in indexes[t].get(k, {}).items()}
+                cols = (lo + sub.index('名稱') + 1, lo + i_ver + 1 if i_ver is not None else None) if sub else (0, None)
+            else:
+                df = p.df[(p.df['類別'] == category) & p.df['名稱'].isin(list(renames))]; ver = dict(zip(df['_id'], df['_ver'].tolist()))
+                got = {i: (rid, ver.get(rid), new) for k, new in keys.items() for i, rid in p.index.get(k, {}).items()}
+                cols = (p.header.index('名稱') + 1, p.header.index('_ver') + 1 if '_ver' in p.header else None)
+            if not got: continue
+            hits[t] = got
+            for i, (rid, ver, new) in got.items():
+                data.append({"range": f"'{t}'!" + gspread.utils.rowcol_to_a1(i, cols[0]), "values": [[new]]})
+                if cols[1] and ver is not None: data.append({"range": f"'{t}'!" + gspread.utils.rowcol_to_a1(i, cols[1]), "values": [[ver + 1]]})
+        revised = [t for t in hits if t in self.manifest]
+        data += [{"range": f"'{MANIFEST_SHEET}'!E{self.manifest[t]['row']}", "values": [[self.manifest[t]['版本'] + 1]]} for t in revised]
+        if revised and not self.manifest_has_version: data.append({"range": f"'{MANIFEST_SHEET}'!E1", "values": [[MANIFEST_HEADER[4]]]})
+        # 設定/單價的鍵 (單價已有同名的列時清空該列，以改名的項目為準)
+        pad = lambda vals, w: [r + [''] * (w - len(r)) for r in vals[1:]]
+        for i, r in enumerate(pad(vrs[0], len(SETTINGS_HEADER)), start=2):
+            if r[:3] == ['item', project, category] and r[3] in renames: data.append({"range": f"'{SETTINGS_SHEET}'!D{i}", "values": [[renames[r[3]]]]})
+        prices = pad(vrs[1], len(PRICES_HEADER)); news = set(renames.values())
+        if any(r[:2] == [project, category] and r[2] in renames for r in prices):
+            for i, r in enumerate(prices, start=2):
+                if r[:2] != [project, category]: continue
+                if r[2] in renames: data.append({"range": f"'{PRICES_SHEET}'!C{i}", "values": [[renames[r[2]]]]})
+                elif r[2] in news: data.append({"range": f"'{PRICES_SHEET}'!A{i}:E{i}", "values": [[''] * len(PRICES_HEADER)]})
+        # 彙總分區：快取與改名前的列數:版本一致者以增量改鍵 (舊鍵的列清空、併入新鍵)；
+        # 其餘捨棄 (版本 +1 後清單的「彙總」欄不符，下次讀取時重建)
+        synced = {}
+        for t in revised:
+            part = self.cube_parts.get(t)
+            if part is None: continue
+            if part.sig != cube_sig(self.manifest[t]): self.cube_parts.pop(t); continue
+            delta = {}
+            for k, v in part.cube.items():
+                if k[0] != project or k[2] != category or k[3] not in renames: continue
+                for nk, sign in ((k, -1), ((k[0], k[1], k[2], renames[k[3]]), 1)):
+                    d = delta.setdefault(nk, [0.0, 0.0, 0]); d[0] += sign * v[0]; d[1] += sign * v[1]; d[2] += sign * v[2]
+            cells, appends = part.apply(delta); c = cube_part_title(t)
+            if appends:
+                end = _end_row(with_sheet(c, lambda s: s.append_rows([r for _, r in appends], table_range=f"A{part.end + 1}")))
+                if not end: self.cube_parts.pop(t); continue
+                part.placed(appends, end)
+            data += [{"range": f"'{c}'!A{i}:{_col_letter(len(CUBE_HEADER))}{i}", "values": [r]} for i, r in sorted(cells.items())]
+            synced[t] = f"{self.manifest[t]['列數']}:{self.manifest[t]['版本'] + 1}"
+        data += self._cube_marks(synced)
+        if data: with_spreadsheet(lambda sh: sh.values_batch_update({"valueInputOption": "RAW", "data": data}))
+        # 更新快取：分區資料與索引、清單版本、彙總分區
+        self.revision += 1
+        for t in revised:
+            e = self.manifest[t]; p = self.parts.get(t); ok = consistent(t); e['版本'] += 1
+            if t in synced: self.cube_parts[t].sig = e['彙總'] = synced[t]
+            if not ok: continue
+            if t in indexes: p.index = indexes[t]
+            for k, new in keys.items(): p.index.setdefault((category, new), {}).update(p.index.pop(k, {}))
+            by_new = {}
+            for rid, _, new in hits[t].values(): by_new.setdefault(new, set()).add(rid)
+            names = p.df['名稱']; bumped = np.zeros(len(p.df), dtype='int32')
+            for new, rids in by_new.items():
+                m = p.df['_id'].isin(rids).to_numpy(); bumped += m
+                if new not in names.cat.categories: names = names.cat.add_categories([new])
+                names = names.mask(m, new)
+            names = names.astype('category').cat.remove_unused_categories()
+            p.df = p.df.assign(名稱=names, _ver=p.df['_ver'] + bumped); p.revision = e['版本']
+        for t in indexes:
+            if t not in revised and consistent(t): self.parts[t].index = indexes[t]
+        if revised and not self.manifest_has_version: self.manifest_has_version = True
+        return sum(len(v) for v in hits.values())
+
+    # --- 設定與單價 (正規化列) ---
+    def _load_table(self, title):
+        header, _ = TABLES[title]
+        return [r + [''] * (len(header) - len(r)) for r in with_sheet(title, lambda s: s.get_all_values())[1:] if any(r)]
+
+    def save_catalog(self, settings, prices):
+        self._save_tables({SETTINGS_SHEET: settings_to_rows(settings), PRICES_SHEET: prices_to_rows(prices)})
+
+    def _save_tables(self, tables):
+        # {工作表: 列}：一次 values_batch_get 讀取各表，變動的儲存格一次 values_batch_update、刪列一次 batch_update，新增的列依表 append_rows
+        titles = list(tables)
+        try: res = with_spreadsheet(lambda sh: sh.values_batch_get([f"'{t}'!A:{_col_letter(len(TABLES[t][0]))}" for t in titles]))
+        except Exception as e:
+            if not _missing_range(e): raise
+            for t in titles: self._save_table(t, tables[t])   # 有工作表尚未建立
+            return
+        vrs = [vr.get('values', []) for vr in res.get('valueRanges', [])] + [[]] * len(titles)
+        data = []; reqs = []; appends = {}
+        for t, values in zip(titles, vrs):
+            header, nkey = TABLES[t]
+            cells, deletes, inserts = diff_keyed_rows([r + [''] * (len(header) - len(r)) for r in values[1:]], tables[t], nkey)
+            data += [{"range": f"'{t}'!" + gspread.utils.rowcol_to_a1(i + 2, j + 1), "values": [[v]]} for i, j, v in cells]
+            if deletes:
+                sheet_id = get_sheet(t).id
+                reqs += [{"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": a - 1, "endIndex": b}}} for a, b in row_spans(i + 2 for i in deletes)]
+            if inserts or not values: appends[t] = ([] if values else [header]) + inserts
+        if data: with_spreadsheet(lambda sh: sh.values_batch_update({"valueInputOption": "RAW", "data": data}))
+        if reqs: with_spreadsheet(lambda sh: sh.batch_update({"requests": reqs}))
+        for t, rows in appends.items(): with_sheet(t, lambda s: s.append_rows(rows))
+
+    def _save_table(self, title, rows):
+        # 只送出變動的儲存格、刪除與新增的列；以寫入前讀到的列位置為準
+        header, nkey = TABLES[title]
+        sheet = get_sheet(title)
+        values = with_sheet(title, lambda s: s.get_all_values())
+        old = [r + [''] * (len(header) - len(r)) for r in values[1:]]
+        cells, deletes, inserts = diff_keyed_rows(old, rows, nkey)
+        data = [{"range": gspread.utils.rowcol_to_a1(i + 2, j + 1), "values": [[v]]} for i, j, v in cells]
+        if data: with_sheet(title, lambda s: s.batch_update(data))
+        if deletes:
+            reqs = [{"deleteDimension": {"range": {"sheetId": sheet.id, "dimension": "ROWS", "startIndex": a - 1, "endIndex": b}}} for a, b in row_spans(i + 2 for i in deletes)]
+            with_spreadsheet(lambda sh: sh.batch_update({"requests": reqs}))
+        if inserts or not values: with_sheet(title, lambda s: s.append_rows(([] if values else [header]) + inserts))
+
+    def _load_legacy(self, key):
+        # 讀取 A1 儲存格的值
+        sheet = get_sheet(key, create=False)
+        data = sheet.acell('A1').value if sheet else None
+        return json.loads(data) if data else None
+
+# --- 背景批次寫入佇列 (每個日誌檔一個，放在模組層級：清除 st 快取也不會多開執行緒) ---
+class WriteQueue:
+    # 新增紀錄先寫入本機 SQLite 日誌 (重啟後仍在)，背景執行緒依筆數/時間門檻合併成一次 append_rows
+    def __init__(self, path):
+        self.path = path
+        self.mem_lock = threading.Lock(); self.flush_lock = threading.Lock(); self.wake = threading.Event()
+        self.flushed = 0; self.failures = 0; self.retry_at = 0.0; self.last_error = None
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS pending (seq INTEGER PRIMARY KEY AUTOINCREMENT, rid TEXT UNIQUE, record TEXT, created REAL)")
+            self.rows = {rid: (json.loads(rec), created) for rid, rec, created in db.execute("SELECT rid, record, created FROM pending ORDER BY seq")}
+        threading.Thread(target=self._run, daemon=True, name="sheet-write-behind").start()
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def put(self, records):
+        now = time.time()
+        with self.mem_lock:
+            with self._db() as db:
+                db.executemany("INSERT OR IGNORE INTO pending (rid, record, created) VALUES (?, ?, ?)", [(r['_id'], json.dumps(r, ensure_ascii=False, default=str), now) for r in records])
+            for r in records: self.rows[r['_id']] = (r, now)
+            if len(self.rows) >= FLUSH_BATCH: self.wake.set()
+
+    def pending_records(self):
+        with self.mem_lock: return [r for r, _ in self.rows.values()]
+
+    def pending_count(self):
+        with self.mem_lock: return len(self.rows)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.mem_lock: batch = [r for r, _ in self.rows.values()]
+            if not batch: return 0
+            backend = get_backend("sheets")
+            # 上次上傳成功但日誌未清除 (如程式中斷) 的列不重複上傳
+            known = backend.known_ids(batch)
+            todo = [r for r in batch if r['_id'] not in known]
+            if todo: backend.insert_records(todo)
+            ids = [r['_id'] for r in batch]
+            with self.mem_lock:
+                with self._db() as db: db.executemany("DELETE FROM pending WHERE rid = ?", [(i,) for i in ids])
+                for i in ids: self.rows.pop(i, None)
+            self.flushed += len(todo); self.failures = 0; self.retry_at = 0.0; self.last_error = None
+            return len(todo)
+
+    def _due(self):
+        with self.mem_lock:
+            if not self.rows: return False
+            oldest = min(c for _, c in self.rows.values())
+            return len(self.rows) >= FLUSH_BATCH or time.time() - oldest >= FLUSH_INTERVAL
+
+    def _run(self):
+        while True:
+            self.wake.wait(FLUSH_INTERVAL); self.wake.clear()
+            if time.time() < self.retry_at or not self._due(): continue
+            try: self.flush()
+            except Exception as e:
+                # 指數退避 + 抖動，網路恢復後自動補送
+                self.failures += 1; self.last_error = str(e)
+                self.retry_at = time.time() + min(FLUSH_MAX_BACKOFF, FLUSH_INTERVAL * 2 ** self.failures) * random.uniform(0.5, 1.0)
+
+_QUEUES = {}; _QUEUES_LOCK = threading.Lock()
+
+def get_write_queue(path):
+    with _QUEUES_LOCK:
+        if path not in _QUEUES: _QUEUES[path] = WriteQueue(path)
+        return _QUEUES[path]
+
+# ==========================================
+# 5. 本機 SQLite 後端
+# ==========================================
+SQLITE_FRAME_CACHE = 32   # SQLite 後端最多快取幾組 (專案, 月份) 查詢結果
+
+class SQLiteBackend(StorageBackend):
+    # 資料表 records 以 (專案, 月份, 類別) 建索引，畫面只查詢需要顯示的列
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path; self.lock = threading.Lock()
+        self.cube_lock = threading.RLock(); self.cube = None; self.cube_at = 0.0; self.cube_stale = False; self.text_index = TextIndex()
+        self.frames = {}; self.frames_version = None   # (專案, 月份) 查詢結果的共用快取，資料版本改變即清空
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute('CREATE TABLE IF NOT EXISTS records ("_id" TEXT PRIMARY KEY, "日期" TEXT, "專案" TEXT, "類別" TEXT, "名稱" TEXT, "單位" TEXT, "數量" REAL, "單價" REAL, "總價" REAL, "備註" TEXT, "月份" TEXT, "_ver" INTEGER DEFAULT 0)')
+            if '_ver' not in [r[1] for r in db.execute("PRAGMA table_info(records)")]: db.execute('ALTER TABLE records ADD COLUMN "_ver" INTEGER DEFAULT 0')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_records_proj_month_cat ON records ("專案", "月份", "類別")')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_records_proj_cat_name ON records ("專案", "類別", "名稱")')   # 項目改名
+            db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")   # 舊版整包 JSON
+            for title, (header, nkey) in TABLES.items():
+                cols = ", ".join(f'"{c}"' for c in header)
+                db.execute(f'CREATE TABLE IF NOT EXISTS "{title}" ({cols}, PRIMARY KEY (' + ", ".join(f'"{c}"' for c in header[:nkey]) + '))')
+
+    def load_records(self, project=None, months=None):
+        key = (project, None if months is None else tuple(sorted(months)))
+        version = self.data_version()
+        with self.lock:
+            if self.frames_version != version: self.frames = {}; self.frames_version = version
+            if key in self.frames: return self.frames[key]
+        df = self._query_records(project, months)
+        with self.lock:
+            if self.frames_version == version:
+                if len(self.frames) >= SQLITE_FRAME_CACHE: self.frames.pop(next(iter(self.frames)))
+                self.frames[key] = df
+        return df
+
+    def _query_records(self, project=None, months=None):
+        sql = "SELECT " + ", ".join(f'"{c}"' for c in SHEET_HEADER) + " FROM records"; where = []; args = []
+        if project is not None: where.append('"專案" = ?'); args.append(project)
+        if months is not None:
+            months = list(months)
+            if not months: return empty_frame()
+            where.append('"月份" IN (' + ", ".join("?" * len(months)) + ')'); args += months
+        if where: sql += " WHERE " + " AND ".join(where)
+        with self.lock: rows = self.conn.execute(sql + " ORDER BY rowid", args).fetchall()
+        return build_frame(SHEET_HEADER, rows) if rows else empty_frame()
+
+    def list_months(self, project):
+        with self.lock: rows = self.conn.execute('SELECT DISTINCT "月份" FROM records WHERE "專案" = ? ORDER BY "月份" DESC', (project,)).fetchall()
+        return [r[0] for r in rows if r[0]]
+
+    def dataset_memory(self):
+        with self.lock: frames = list(self.frames.values())
+        sizes = [memory_usage(df) for df in frames]
+        return sum(a for a, _ in sizes), sum(b for _, b in sizes)
+
+    def data_version(self):
+        # total_changes：本連線的寫入；PRAGMA data_version：其他連線 (程序) 的寫入
+        with self.lock: return f"{self.conn.total_changes}-{self.conn.execute('PRAGMA data_version').fetchone()[0]}"
+
+    def iter_records(self, chunk=1000):
+        # 另開唯讀連線逐批 fetchmany，不佔用共用連線的鎖
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            cur = conn.execute("SELECT " + ", ".join(f'"{c}"' for c in SHEET_HEADER) + " FROM records ORDER BY rowid")
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows: break
+                yield build_frame(SHEET_HEADER, rows)
+        finally: conn.close()
+
+    def _row(self, r):
+        vals = [_cell_value(c, r.get(c, 0) or 0) if c in NUM_COLS else str(r.get(c, '')) for c in SHEET_HEADER]
+        vals[0] = str(r.get('日期', ''))[:10]; vals[SHEET_HEADER.index('_ver')] = int(_float(r.get('_ver')))
+        return vals + [record_month(vals[0])]
+
+    def _has_records(self):
+        with self.lock: return self.conn.execute("SELECT 1 FROM records LIMIT 1").fetchone() is not None
+
+    def _rows_by_id(self, ids):
+        with self.lock: return self._select_ids(self.conn, ids)
+
+    def _select_ids(self, db, ids):
+        ids = list(ids); out = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            cur = db.execute("SELECT " + ", ".join(f'"{c}"' for c in SHEET_HEADER) + ' FROM records WHERE "_id" IN (' + ", ".join("?" * len(part)) + ")", part)
+            out.update({r['_id']: r for r in (dict(zip(SHEET_HEADER, row)) for row in cur.fetchall())})
+        return out
+
+    def _insert_records(self, records):
+        cols = SHEET_HEADER + ['月份']
+        with self.lock, self.conn as db:
+            db.executemany("INSERT OR REPLACE INTO records (" + ", ".join(f'"{c}"' for c in cols) + ") VALUES (" + ", ".join("?" * len(cols)) + ")", [self._row(r) for r in records])
+
+    def _apply_changes(self, updates, deletes, inserts, base):
+        # 在同一個寫入交易內讀取目前的列再合併，其他程序的寫入不會插在比對與寫入之間
+        with self.lock, self.conn as db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = self._select_ids(db, set(updates) | set(deletes))
+            fresh = {rid: rows.get(rid) for rid in set(updates) | set(deletes)}
+            current = row_snapshot(build_frame(SHEET_HEADER, [[r[c] for c in SHEET_HEADER] for r in rows.values()])) if rows else {}
+            updates, deletes, conflicts = merge_changes(updates, deletes, base, current)
+            for rid, cells in updates.items():
+                cells = {c: (_cell_value(c, v) if c in NUM_COLS else str(v)) for c, v in cells.items() if c in SHEET_HEADER and c != '_ver'}
+                if '日期' in cells:
+                    m = pd.to_datetime(cells['日期'], errors='coerce'); cells['月份'] = '' if pd.isna(m) else m.strftime("%Y-%m")
+                if cells: db.execute("UPDATE records SET " + ", ".join(f'"{c}" = ?' for c in cells) + ', "_ver" = "_ver" + 1 WHERE "_id" = ?', list(cells.values()) + [rid])
+            db.executemany('DELETE FROM records WHERE "_id" = ?', [(rid,) for rid in deletes])
+        if inserts: self._insert_records(inserts)
+        return conflicts, fresh
+
+    def rename_items(self, project, category, renames):
+        # 以 (專案, 類別, 名稱) 索引在同一交易內改名 (紀錄版本 +1)；彙總表以舊鍵扣除、新鍵加上的增量更新
+        check_renames(renames)
+        self._prepare_cube()
+        where = '"專案" = ? AND "類別" = ? AND "名稱" = ?'; recs = []
+        with self.lock, self.conn as db:
+            for old, new in renames.items():
+                rows = db.execute(f'SELECT "日期", "總價", "數量" FROM records WHERE {where}', (project, category, old)).fetchall()
+                db.execute(f'UPDATE records SET "名稱" = ?, "_ver" = "_ver" + 1 WHERE {where}', (new, project, category, old))
+                db.execute(f'UPDATE OR REPLACE "{SETTINGS_SHEET}" SET "名稱" = ? WHERE "種類" = ? AND {where}', (new, 'item', project, category, old))
+                db.execute(f'UPDATE OR REPLACE "{PRICES_SHEET}" SET "名稱" = ? WHERE {where}', (new, project, category, old))
+                recs += [({'日期': d, '專案': project, '類別': category, '名稱': old, '總價': c, '數量': q}, new) for d, c, q in rows]
+        self._update_cube(cube_delta([{**r, '名稱': new} for r, new in recs], 1, cube_delta([r for r, _ in recs], -1)))
+        return len(recs)
+
+    def _load_table(self, title):
+        with self.lock: return [list(r) for r in self.conn.execute(f'SELECT * FROM "{title}" ORDER BY rowid').fetchall()]
+
+    def _save_table(self, title, rows):
+        header, nkey = TABLES[title]
+        old = self._load_table(title)
+        cells, deletes, inserts = diff_keyed_rows(old, rows, nkey)
+        new = {tuple(_fmt(v) for v in r[:nkey]): r for r in rows}
+        changed = [new[tuple(_fmt(v) for v in old[i][:nkey])] for i in sorted({i for i, _, _ in cells})]
+        where = " AND ".join(f'"{c}" = ?' for c in header[:nkey])
+        with self.lock, self.conn as db:
+            db.executemany(f'DELETE FROM "{title}" WHERE {where}', [[_fmt(v) for v in old[i][:nkey]] for i in deletes])
+            db.executemany(f'UPDATE "{title}" SET ' + ", ".join(f'"{c}" = ?' for c in header[nkey:]) + f' WHERE {where}', [list(r[nkey:]) + [_fmt(v) for v in r[:nkey]] for r in changed])
+            db.executemany(f'INSERT INTO "{title}" VALUES (' + ", ".join("?" * len(header)) + ')', [[_fmt(v) if j < nkey else v for j, v in enumerate(r)] for r in inserts])
+
+    def _write_cube(self, cube, keys):
+        # 只寫入變動的鍵
+        where = " AND ".join(f'"{c}" = ?' for c in CUBE_HEADER[:4])
+        rows = cube_to_rows({k: cube[k] for k in keys if k in cube})
+        with self.lock, self.conn as db:
+            db.executemany(f'DELETE FROM "{CUBE_SHEET}" WHERE {where}', [list(k) for k in keys if k not in cube])
+            db.executemany(f'INSERT OR REPLACE INTO "{CUBE_SHEET}" VALUES (' + ", ".join("?" * len(CUBE_HEADER)) + ')', rows)
+
+    def _load_legacy(self, key):
+        with self.lock: row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+# ==========================================
+# 6. 後端選擇與遷移工具
+# ==========================================
+def backend_name():
+    name = STORAGE_BACKEND
+    if not name:
+        try: name = st.secrets.get("storage_backend", "")
+        except: name = ""
+    return (name or "sheets").lower()
+
+@st.cache_resource
+def _make_backend(name):
+    if name == "sqlite": return SQLiteBackend(SQLITE_FILE)
+    if name == "sheets": return GoogleSheetsBackend()
+    raise ValueError(f"未知的儲存後端: {name}")
+
+def get_backend(name=None):
+    return _make_backend(name or backend_name())
+
+def migrate(src, dst, chunk=1000, log=print):
+    # 一次性複製：設定、單價與所有紀錄 (依 _id 略過目標已存在的列，可重複執行)
+    settings, prices = src.load_settings(), src.load_prices()
+    if settings is not None: dst.save_settings(settings)
+    if prices is not None: dst.save_prices(prices)
+    df = src.load_records()
+    existing = set(dst.load_records()['_id'])
+    records = [r for r in df.drop(columns=['月份']).to_dict('records') if r['_id'] not in existing]
+    for i in range(0, len(records), chunk):
+        dst.insert_records(records[i:i + chunk]); log(f"已複製 {min(i + chunk, len(records))}/{len(records)} 筆")
+    return len(records)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="儲存後端遷移工具")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    mg = sub.add_parser("migrate", help="將設定、單價與紀錄從一個後端複製到另一個")
+    mg.add_argument("--from", dest="src", choices=["sheets", "sqlite"], required=True)
+    mg.add_argument("--to", dest="dst", choices=["sheets", "sqlite"], required=True)
+    mg.add_argument("--sqlite-file", default=SQLITE_FILE)
+    mg.add_argument("--chunk", type=int, default=1000)
+    sub.add_parser("partition", help="將舊的單一 sheet1 轉換為「專案 × 月份」分區工作表")
+    cb = sub.add_parser("cube", help="由所有紀錄重建成本彙總表")
+    cb.add_argument("--backend", choices=["sheets", "sqlite"], default=None)
+    cb.add_argument("--sqlite-file", default=SQLITE_FILE)
+    sn = sub.add_parser("snapshot", help="試算表後端的本機快照：由雲端重建 (rebuild) 或與雲端比對 (verify)")
+    sn.add_argument("action", choices=["rebuild", "verify"])
+    sn.add_argument("--tags-only", action="store_true", help="verify 只比對列數/版本，不下載資料")
+    args = ap.parse_args()
+    make = lambda n: SQLiteBackend(args.sqlite_file) if n == "sqlite" else GoogleSheetsBackend()
+    if args.cmd == "partition":
+        print(f"完成，共轉換 {partition_legacy_sheet(log=print)} 筆紀錄"); sys.exit()
+    if args.cmd == "snapshot":
+        if args.action == "rebuild": print(f"完成，共 {GoogleSheetsBackend().rebuild_snapshots()} 個分區"); sys.exit()
+        bad = GoogleSheetsBackend().verify_snapshots(content=not args.tags_only)
+        sys.exit(f"{bad} 個分區的快照需要重建 (python storage.py snapshot rebuild)" if bad else 0)
+    if args.cmd == "cube":
+        print(f"完成，共 {len(make(args.backend or backend_name()).rebuild_cube())} 個彙總鍵"); sys.exit()
+    if args.src == args.dst: sys.exit("來源與目標相同")
+    n = migrate(make(args.src), make(args.dst), chunk=args.chunk)
+    print(f"完成，共複製 {n} 筆紀錄")
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+
+# ==========================================
+# 測試共用：試算表後端改接 benchmarks/fake_gspread (記憶體中的試算表)
+# ==========================================
+# 必須在匯入 storage/core 之前設定：日誌與備份放在暫存目錄，背景上傳只在明確 flush 時執行
+WORK = tempfile.mkdtemp(prefix="tests_")
+os.environ.setdefault("WRITE_JOURNAL", os.path.join(WORK, "pending_rows.db"))
+os.environ.setdefault("BACKUP_DIR", os.path.join(WORK, "backups"))
+os.environ["FLUSH_BATCH"] = "1000000"; os.environ["FLUSH_INTERVAL"] = "1e9"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import streamlit.logger
+import storage
+from benchmarks.fake_gspread import CallLog, FakeClient
+
+streamlit.logger.set_log_level("error")
+
+@pytest.fixture
+def sheets(monkeypatch, tmp_path):
+    # 每個測試一份新的假試算表；回傳 FakeSpreadsheet (seed 放初始資料、sheets 直接檢查內容)
+    client = FakeClient(CallLog())
+    fake = lambda: client
+    fake.clear = lambda: None
+    monkeypatch.setattr(storage, "get_google_client", fake)
+    monkeypatch.setattr(storage, "JOURNAL_FILE", str(tmp_path / "pending_rows.db"))
+    monkeypatch.setattr(storage, "SNAPSHOT_DIR", "")
+    storage.reset_sheet_handles()
+    yield client.spreadsheet
+    storage.reset_sheet_handles()
+
+def record(day, project="P1", category="工種 (人力)", name="粗工", qty=1, price=2500, note=""):
+    return {'日期': day, '專案': project, '類別': category, '名稱': name, '單位': '工', '數量': qty, '單價': price,
+            '總價': qty * price, '備註': note, '_id': storage.new_row_id()}
+
+def legacy_rows(n, project="P1", months=("2025-01",)):
+    # 分區前的 sheet1 (沒有 _id 欄)
+    rows = [['日期', '專案', '類別', '名稱', '單位', '數量', '單價', '總價', '備註']]
+    for m in months:
+        for i in range(n):
+            rows.append([f"{m}-{i % 28 + 1:02d}", project, '工種 (人力)' if i % 2 else '機具 (設備)', '粗工' if i % 3 else '山貓', '工', 2, 2500, 5000, f"n{i}"])
+    return rows
@@ -0,0 +1,100 @@
+import pandas as pd
+import storage
+from tests.conftest import record
+
+# ==========================================
+# 條件式寫入：diff_frames / merge_changes / GoogleSheetsBackend._apply_changes
+# ==========================================
+def seeded(sheets, recs):
+    b = storage.GoogleSheetsBackend(); b.insert_records(recs); return b
+
+def submit(b, df, changes):
+    # 模擬編輯畫面：以 df (可能是他人寫入前載入的) 為 base，依 _id 修改欄位 (值為 None 表示刪除該列) 後寫回
+    base = storage.row_snapshot(df)
+    new = storage.editable_frame(df).drop(columns=['月份'], errors='ignore').set_index('_id', drop=False)
+    for rid, cells in changes.items():
+        if cells is None: new = new.drop(rid)
+        else:
+            for c, v in cells.items(): new.loc[rid, c] = v
+    updates, deletes, inserts = storage.diff_frames(df, new.reset_index(drop=True))
+    return b.apply_changes(updates, deletes, inserts, base)
+
+def edit(b, changes): return submit(b, b.load_records("P1"), changes)
+
+def rows_of(sheets, project, month):
+    rows = sheets.sheets[storage.partition_title(project, month)].rows
+    return {r[rows[0].index('_id')]: dict(zip(rows[0], r)) for r in rows[1:]}
+
+def test_diff_frames_reports_updates_deletes_and_inserts():
+    old = pd.DataFrame([{**record("2025-01-01"), '_ver': 0}, {**record("2025-01-02"), '_ver': 0}])
+    new = storage.editable_frame(old).copy()
+    new.loc[0, '備註'] = '改'; new = new.drop(index=1)
+    new = pd.concat([new, pd.DataFrame([{**record("2025-01-03"), '_id': ''}])], ignore_index=True)
+    updates, deletes, inserts = storage.diff_frames(old, new)
+    assert updates == {old.at[0, '_id']: {'備註': '改'}}
+    assert deletes == [old.at[1, '_id']]
+    assert len(inserts) == 1 and inserts[0]['_id'] and inserts[0]['_ver'] == 0 and inserts[0]['日期'] == "2025-01-03"
+
+def test_merge_changes_merges_other_fields_and_reports_same_field():
+    r = {**record("2025-01-01"), '_ver': 0}; rid = r['_id']
+    base = storage.row_snapshot(pd.DataFrame([r]))
+    current = storage.row_snapshot(pd.DataFrame([{**r, '備註': '他人', '_ver': 1}]))
+    ok, _, conflicts = storage.merge_changes({rid: {'數量': 3}}, [], base, current)
+    assert ok == {rid: {'數量': 3}} and conflicts == []
+    ok, _, conflicts = storage.merge_changes({rid: {'備註': '我'}}, [], base, current)
+    assert ok == {} and conflicts[0]['_id'] == rid and conflicts[0]['欄位'] == ['備註']
+    # 他人已改成相同的值不算衝突
+    ok, _, conflicts = storage.merge_changes({rid: {'備註': '他人'}}, [], base, current)
+    assert ok == {rid: {'備註': '他人'}} and conflicts == []
+
+def test_merge_changes_delete_of_changed_row_is_conflict():
+    r = {**record("2025-01-01"), '_ver': 0}; rid = r['_id']
+    base = storage.row_snapshot(pd.DataFrame([r]))
+    changed = storage.row_snapshot(pd.DataFrame([{**r, '數量': 5, '_ver': 1}]))
+    _, deletes, conflicts = storage.merge_changes({}, [rid], base, changed)
+    assert deletes == [] and conflicts[0]['動作'] == '刪除' and conflicts[0]['欄位'] == ['數量']
+    # 已被他人刪除：略過，不算衝突
+    assert storage.merge_changes({}, [rid], base, {}) == ({}, [], [])
+
+def test_two_writers_edit_different_fields_both_kept(sheets):
+    x = record("2025-01-05", note="原"); a = seeded(sheets, [x, record("2025-01-06")])
+    b = storage.GoogleSheetsBackend(); stale = b.load_records("P1")
+    assert edit(a, {x['_id']: {'備註': 'A 改'}}) == []
+    assert submit(b, stale, {x['_id']: {'數量': 3}}) == []
+    row = rows_of(sheets, "P1", "2025-01")[x['_id']]
+    assert row['備註'] == 'A 改' and float(row['數量']) == 3 and int(row['_ver']) == 2
+
+def test_two_writers_same_field_is_conflict(sheets):
+    x = record("2025-01-05", note="原"); a = seeded(sheets, [x])
+    b = storage.GoogleSheetsBackend(); stale = b.load_records("P1")
+    assert edit(a, {x['_id']: {'備註': 'A 改'}}) == []
+    conflicts = submit(b, stale, {x['_id']: {'備註': 'B 改'}})
+    assert [(c['_id'], c['動作'], c['欄位']) for c in conflicts] == [(x['_id'], '修改', ['備註'])]
+    assert rows_of(sheets, "P1", "2025-01")[x['_id']]['備註'] == 'A 改'
+
+def test_delete_of_row_changed_by_other_writer_is_conflict(sheets):
+    x = record("2025-01-05"); y = record("2025-01-06"); a = seeded(sheets, [x, y])
+    b = storage.GoogleSheetsBackend(); stale = b.load_records("P1")
+    assert edit(a, {x['_id']: {'數量': 4}}) == []
+    conflicts = submit(b, stale, {x['_id']: None, y['_id']: None})
+    assert [(c['_id'], c['動作']) for c in conflicts] == [(x['_id'], '刪除')]
+    rows = rows_of(sheets, "P1", "2025-01")
+    assert x['_id'] in rows and y['_id'] not in rows
+    assert storage.GoogleSheetsBackend()._manifest()[storage.partition_title("P1", "2025-01")]['列數'] == 1
+
+def test_edit_date_moves_row_to_other_month(sheets):
+    x = record("2025-01-05", note="搬"); a = seeded(sheets, [x, record("2025-01-06")])
+    assert edit(a, {x['_id']: {'日期': '2025-02-03'}}) == []
+    assert x['_id'] not in rows_of(sheets, "P1", "2025-01")
+    moved = rows_of(sheets, "P1", "2025-02")[x['_id']]
+    assert moved['日期'] == '2025-02-03' and moved['備註'] == '搬' and int(moved['_ver']) == 1
+    m = storage.GoogleSheetsBackend()._manifest()
+    assert m[storage.partition_title("P1", "2025-01")]['列數'] == 1 and m[storage.partition_title("P1", "2025-02")]['列數'] == 1
+    df = storage.GoogleSheetsBackend().load_records("P1")
+    assert df.loc[df['_id'] == x['_id'], '月份'].tolist() == ['2025-02']
+
+def test_edited_copy_leaves_shared_dataset_untouched(sheets):
+    x = record("2025-01-05", note="原"); a = seeded(sheets, [x])
+    shared = a.load_records("P1"); edited = storage.editable_frame(shared)
+    edited.loc[edited['_id'] == x['_id'], '備註'] = '改'
+    assert a.load_records("P1") is shared and shared['備註'].tolist() == ['原']
@@ -0,0 +1,47 @@
+import pandas as pd
+import storage
+from tests.conftest import record
+from tests.test_apply_changes import edit
+
+# ==========================================
+# 成本彙總：增量更新後應與由紀錄直接彙總的結果相同
+# ==========================================
+KEYS = ['專案', '日期', '類別', '名稱']
+
+def grouped(df):
+    # 由原始紀錄 groupby 的彙總 (總價, 數量, 筆數)
+    df = df.assign(日期=pd.to_datetime(df['日期']).dt.strftime("%Y-%m-%d"))
+    g = df.groupby(KEYS, observed=True).agg(總價=('總價', 'sum'), 數量=('數量', 'sum'), 筆數=('_id', 'size')).reset_index()
+    return {tuple(str(v) for v in r[:4]): (round(float(r[4]), 4), round(float(r[5]), 4), int(r[6])) for r in g.itertuples(index=False)}
+
+def cube_of(b, project="P1"):
+    return {tuple(r[:4]): (round(float(r[4]), 4), round(float(r[5]), 4), int(r[6])) for r in b.load_cube(project)[storage.CUBE_HEADER].itertuples(index=False)}
+
+def test_incremental_cube_matches_groupby_after_appends_edits_moves_deletes(sheets):
+    recs = [record(f"2025-01-{d:02d}", name=n, qty=q) for d in (3, 4, 5) for n, q in (("粗工", 1), ("技工", 2))]
+    recs += [record("2025-02-01", category="機具 (設備)", name="山貓", qty=1, price=6000)]
+    b = storage.GoogleSheetsBackend(); b.insert_records(recs[:4])
+    assert cube_of(b) == grouped(b.load_records("P1"))   # 第一次讀取：建立彙總分區
+    b.insert_records(recs[4:])
+    b.insert_records([record("2025-01-03", qty=3)])      # 既有的鍵
+    b.insert_records([record("2025-01-09", name="水電")])  # 新的鍵
+    assert edit(b, {recs[0]['_id']: {'數量': 4, '總價': 10000}, recs[1]['_id']: {'名稱': '粗工'}}) == []
+    assert edit(b, {recs[2]['_id']: {'日期': '2025-02-11'}, recs[3]['_id']: {'日期': '2025-01-28'}}) == []
+    assert edit(b, {recs[5]['_id']: None, recs[6]['_id']: None}) == []
+    b.insert_records([record("2025-01-04", name="技工", qty=5)])   # 重新使用刪除後清空的鍵
+    expected = grouped(b.load_records("P1"))
+    assert len(expected) > 5
+    assert cube_of(b) == expected and b.cube_failures == 0
+    # 重新啟動：由彙總工作表讀取 (不重建)
+    fresh = storage.GoogleSheetsBackend(); fresh._manifest()
+    assert all(e['彙總'] == storage.cube_sig(e) for e in fresh.manifest.values())
+    assert cube_of(fresh) == expected
+
+def test_failed_cube_write_is_recorded_and_rebuilt(sheets):
+    b = storage.GoogleSheetsBackend(); b.insert_records([record("2025-01-03")]); b.load_cube("P1")
+    def broken(titles, groups): raise RuntimeError("寫入失敗")
+    b._write_cube = broken
+    b.insert_records([record("2025-01-03", qty=2)])
+    assert b.cube_failures == 1 and "寫入失敗" in b.cube_error
+    del b._write_cube
+    assert cube_of(b) == grouped(b.load_records("P1"))
@@ -0,0 +1,37 @@
+import gspread
+import pytest
+import storage
+from benchmarks.fake_gspread import _api_error
+
+# ==========================================
+# 工作表物件快取：只有憑證過期或試算表已不存在時才重開並重試
+# ==========================================
+def test_missing_range_is_not_retried(sheets):
+    mark = sheets.log.mark()
+    with pytest.raises(gspread.exceptions.APIError) as e:
+        storage.with_spreadsheet(lambda sh: sh.values_batch_get([f"'{storage.MANIFEST_SHEET}'!A:F"]))
+    assert storage._missing_range(e.value)
+    ops = sheets.log.since(mark)['ops']
+    assert ops == {'open': 1, 'values_batch_get': 1}   # 不重開試算表、不重試
+
+def test_first_run_startup_reads_once_before_falling_back(sheets):
+    mark = sheets.log.mark()
+    settings, prices, timings = storage.GoogleSheetsBackend().load_startup()
+    assert '平行讀取' in timings
+    assert sheets.log.since(mark)['ops'].get('values_batch_get') == 1
+
+def test_not_found_reopens_and_retries_once(sheets):
+    calls = []
+    def op(sh):
+        calls.append(sh)
+        if len(calls) == 1: raise _api_error(404, "Requested entity was not found.")
+        return "ok"
+    assert storage.with_spreadsheet(op) == "ok" and len(calls) == 2
+
+def test_deleted_sheet_handle_is_dropped_without_retry(sheets):
+    sheets.seed("x", [["a"]]); calls = []
+    assert storage.with_sheet("x", lambda s: s.get_values("A:A")) == [["a"]]
+    def op(s):
+        calls.append(s); raise _api_error(400, "Unable to parse range: 'x'!A:A")
+    with pytest.raises(gspread.exceptions.APIError): storage.with_sheet("x", op)
+    assert len(calls) == 1 and "x" not in storage.get_sheet_handles().worksheets
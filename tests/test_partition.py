@@ -0,0 +1,39 @@
+import storage
+from tests.conftest import legacy_rows, record
+
+def test_partition_twice_keeps_rows_added_after_migration(sheets):
+    sheets.seed(storage.LEGACY_SHEET, legacy_rows(30, months=("2025-01", "2025-02")))
+    assert storage.partition_legacy_sheet() == 60
+    b = storage.GoogleSheetsBackend()
+    added = record("2025-01-15", note="轉換後新增")
+    b.insert_records([added])
+    # 再執行一次：_manifest 已有分區，不重新轉換 (sheet1 沒有這筆新增)
+    assert storage.partition_legacy_sheet() == 0
+    df = storage.GoogleSheetsBackend().load_records("P1")
+    assert len(df) == 61 and added['_id'] in set(df['_id'])
+
+def test_partition_resumes_without_clearing_written_partitions(sheets):
+    # 上次轉換在寫入 _manifest 之前中斷：已寫入的分區保留 (含之後寫入的列)，只補上 _manifest
+    sheets.seed(storage.LEGACY_SHEET, legacy_rows(10, months=("2025-01", "2025-02")))
+    storage.partition_legacy_sheet()
+    t = storage.partition_title("P1", "2025-01")
+    extra = list(sheets.sheets[t].rows[1]); extra[storage.SHEET_HEADER.index('_id')] = 'extra-id'
+    sheets.sheets[t].rows.append(extra)
+    del sheets.sheets[storage.MANIFEST_SHEET]; storage.reset_sheet_handles()
+    assert storage.partition_legacy_sheet() == 21
+    b = storage.GoogleSheetsBackend()
+    assert b._manifest()[t]['列數'] == 11
+    assert 'extra-id' in set(b.load_records("P1", ["2025-01"])['_id'])
+
+def test_insert_into_sheet_missing_from_manifest_adds_no_second_header(sheets):
+    # append_rows 成功但更新清單前中斷：工作表已有標題與資料，清單沒有這個分區
+    sheets.seed(storage.LEGACY_SHEET, legacy_rows(5))
+    storage.partition_legacy_sheet()
+    t = storage.partition_title("P1", "2025-02")
+    orphan = [record("2025-02-01"), record("2025-02-02")]
+    sheets.seed(t, [storage.SHEET_HEADER] + [[r.get(c, '') for c in storage.SHEET_HEADER] for r in orphan])
+    b = storage.GoogleSheetsBackend()
+    b.insert_records([record("2025-02-03")])
+    assert [r[0] for r in sheets.sheets[t].rows].count('日期') == 1
+    assert b._manifest()[t]['列數'] == 3
+    assert len(storage.GoogleSheetsBackend().load_records("P1", ["2025-02"])) == 3
@@ -0,0 +1,31 @@
+import gc
+import storage
+from tests.conftest import record
+from tests.test_apply_changes import edit
+
+# ==========================================
+# 搜尋索引：刪除、修改、換月份後不再用到的文字移出索引
+# ==========================================
+def search_ids(b, query):
+    return set(b.search_records("P1", query)['_id'])
+
+def test_search_index_evicts_deleted_edited_and_moved_rows(sheets):
+    gone = record("2025-01-03", note="刪除的備註"); renamed = record("2025-01-04", note="舊的備註"); moved = record("2025-01-05", note="搬走的備註")
+    b = storage.GoogleSheetsBackend(); b.insert_records([gone, renamed, moved, record("2025-01-06", note="留下")])
+    assert search_ids(b, "備註") == {gone['_id'], renamed['_id'], moved['_id']}
+    idx = b.text_index; before = len(idx.ids)
+    assert edit(b, {gone['_id']: None, renamed['_id']: {'備註': '新的備註'}, moved['_id']: {'日期': '2025-02-01'}}) == []
+    gc.collect()
+    assert search_ids(b, "備註") == {renamed['_id'], moved['_id']}
+    assert search_ids(b, "舊的") == set() and search_ids(b, "新的") == {renamed['_id']}
+    assert search_ids(b, "搬走") == {moved['_id']}
+    assert '刪除的備註' not in idx.ids and '舊的備註' not in idx.ids and '搬走的備註' in idx.ids
+    assert not any(i in ids for g, ids in idx.grams.items() for i in idx.free)
+    assert '刪' not in idx.grams
+    assert len(idx.ids) == before - 1   # 少了兩個舊文字、多了一個新文字
+    # 編號重複使用：索引不會隨著修改無限成長
+    for n in range(5):
+        assert edit(b, {renamed['_id']: {'備註': f"第{n}次"}}) == []
+        assert search_ids(b, f"第{n}次") == {renamed['_id']}
+    gc.collect(); b.text_index.evict()
+    assert len(idx.texts) <= before + 2 and len(idx.ids) == before - 1